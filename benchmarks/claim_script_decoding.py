@@ -0,0 +1,98 @@
+'''Times deserializing blocks and deriving hashX and claim addresses from their outputs, decoding claim scripts
+once in the deserializer against decoding them again for hashX and address.
+
+Usage: python benchmarks/claim_script_decoding.py [rounds]'''
+import json
+import os
+import sys
+import time
+from binascii import unhexlify
+
+from lbryumx.coin import LBC
+from lbryumx.model import TxClaimOutput
+from lbryumx.opcodes import decode_claim_script
+from lbryumx.tx import LBRYDeserializer
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'tests', 'data')
+
+
+class RedecodingDeserializer(LBRYDeserializer):
+    '''Deserializer keeping plain pk_scripts, so hashX and address decode claim scripts again.'''
+
+    def _read_output(self):
+        value = self._read_le_int64()
+        script = self._read_varbytes()
+        claim = decode_claim_script(script)
+        claim = claim[0] if claim else None
+        return TxClaimOutput(value, script, claim)
+
+
+def load_blocks():
+    raw_blocks = []
+    for file_name in sorted(os.listdir(DATA_PATH)):
+        if file_name.startswith('block'):
+            with open(os.path.join(DATA_PATH, file_name)) as block_file:
+                raw_blocks.append(unhexlify(json.load(block_file)['block']))
+    return raw_blocks
+
+
+def process(deserializer, raw_block):
+    outputs = claims = 0
+    for tx, _ in deserializer(raw_block, start=LBC.BASIC_HEADER_SIZE).read_tx_block():
+        for output in tx.outputs:
+            LBC.hashX_from_script(output.pk_script)
+            outputs += 1
+            if output.claim:
+                LBC.address_from_script(output.pk_script)
+                claims += 1
+    return outputs, claims
+
+
+def run(deserializer, raw_blocks, rounds):
+    start = time.time()
+    for _ in range(rounds):
+        for raw_block in raw_blocks:
+            outputs, claims = process(deserializer, raw_block)
+    return (time.time() - start) / (rounds * len(raw_blocks)), outputs, claims
+
+
+def varint(value):
+    if value < 0xfd:
+        return bytes((value,))
+    return b'\xfd' + value.to_bytes(2, 'little')
+
+
+def run_claim_outputs(deserializer, raw_blocks, rounds):
+    '''Sample blocks are light on claims, so also time the claim outputs alone.'''
+    raw_outputs = []
+    for raw_block in raw_blocks:
+        for tx, _ in LBRYDeserializer(raw_block, start=LBC.BASIC_HEADER_SIZE).read_tx_block():
+            for output in tx.outputs:
+                if output.claim:
+                    raw_outputs.append(output.value.to_bytes(8, 'little') + varint(len(output.pk_script)) +
+                                       bytes(output.pk_script))
+    start = time.time()
+    for _ in range(rounds):
+        for raw_output in raw_outputs:
+            output = deserializer(raw_output)._read_output()
+            LBC.hashX_from_script(output.pk_script)
+            LBC.address_from_script(output.pk_script)
+    return (time.time() - start) / (rounds * len(raw_outputs))
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    raw_blocks = load_blocks()
+    before, outputs, claims = run(RedecodingDeserializer, raw_blocks, rounds)
+    after, _, _ = run(LBRYDeserializer, raw_blocks, rounds)
+    print('last block: {:,d} outputs, {:,d} claims'.format(outputs, claims))
+    print('decoding again: {:.3f}ms per block'.format(before * 1000))
+    print('decoding once:  {:.3f}ms per block ({:.1f}x)'.format(after * 1000, before / after))
+    before = run_claim_outputs(RedecodingDeserializer, raw_blocks, rounds * 20)
+    after = run_claim_outputs(LBRYDeserializer, raw_blocks, rounds * 20)
+    print('decoding again: {:.1f}us per claim output'.format(before * 1000000))
+    print('decoding once:  {:.1f}us per claim output ({:.1f}x)'.format(after * 1000000, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+'''Times backing up the claims of reorgs up to REORG_LIMIT blocks deep, one block at a time with a claim flush
+around every 50 blocks against all the blocks at once with a single flush.
+
+Usage: python benchmarks/reorg.py [claims per block] [names]'''
+import os
+import sys
+import tempfile
+import time
+from random import Random
+
+from electrumx.server.env import Env
+
+from lbryumx.coin import LBC
+from lbryumx.model import NameClaim, ClaimSupport, TxClaimOutput
+
+ADDRESS = 'bTZito1AqWPig64GBioom11mHpoegMfXHx'
+
+
+def random_txid(random):
+    return bytes(random.getrandbits(8) for _ in range(32))
+
+
+def make_block_processor(db_dir):
+    os.environ.clear()
+    os.environ['DB_DIRECTORY'] = db_dir
+    os.environ['DAEMON_URL'] = ''
+    return LBC.BLOCK_PROCESSOR(Env(LBC), None, None)
+
+
+def advance(block_processor, blocks, claims_per_block, names):
+    '''Adds blocks of claims and supports competing for a few names, the way advance_blocks does.'''
+    random = Random(blocks)
+    claim_ids = []
+    for height in range(1, blocks + 1):
+        undo = []
+        for _ in range(claims_per_block):
+            name = 'name-{}'.format(random.randrange(names)).encode()
+            output = TxClaimOutput(random.randrange(1, 1000), LBC.pay_to_address_script(ADDRESS),
+                                   NameClaim(name, b'value'))
+            undo.append(block_processor.advance_claim_name_transaction(output, height, random_txid(random), 0))
+            claim_ids.append((name, undo[-1][0]))
+            name, claim_id = random.choice(claim_ids)
+            block_processor.advance_support(ClaimSupport(name, claim_id), random_txid(random), 0, height,
+                                            random.randrange(1, 1000))
+        block_processor.update_claimtrie(height)
+        block_processor.height = height
+        claimtrie_undo, block_processor.claimtrie_undo = list(block_processor.claimtrie_undo.items()), {}
+        supports_undo, block_processor.supports_undo = list(block_processor.supports_undo.items()), {}
+        block_processor.claim_undo_cache[height] = (undo, claimtrie_undo, supports_undo)
+    block_processor.batched_flush_claims()
+
+
+def backup_block_by_block(block_processor, depth):
+    for start in range(0, depth, 50):
+        block_processor.batched_flush_claims()
+        for _ in range(min(50, depth - start)):
+            block_processor.backup_claim_txs()
+            block_processor.restore_claimtrie_undo()
+            block_processor.height -= 1
+        block_processor.batched_flush_claims()
+
+
+def backup_at_once(block_processor, depth):
+    block_processor.reorg_claim_undo = block_processor.load_claim_undo_info(block_processor.height - depth + 1,
+                                                                            block_processor.height)
+    for _ in range(depth):
+        block_processor.backup_claim_txs()
+        block_processor.height -= 1
+    block_processor.restore_claimtrie_undo()
+    block_processor.batched_flush_claims()
+
+
+def run(backup, depth, claims_per_block, names):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as db_dir:
+        block_processor = make_block_processor(db_dir)
+        advance(block_processor, depth + 10, claims_per_block, names)
+        start = time.time()
+        backup(block_processor, depth)
+        elapsed = time.time() - start
+        claimtrie = list(block_processor.claimtrie_db.iterator())
+        assert claimtrie
+        for db in (block_processor.claims_db, block_processor.names_db, block_processor.signatures_db,
+                   block_processor.outpoint_to_claim_id_db, block_processor.claim_undo_db,
+                   block_processor.claimtrie_db, block_processor.supports_db, block_processor.utxo_db,
+                   block_processor.history.db):
+            db.close()
+        os.chdir(cwd)
+    return elapsed, claimtrie
+
+
+def main():
+    claims_per_block = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    names = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for depth in (1, 10, 50, 100, LBC.REORG_LIMIT):
+        block_by_block, expected = run(backup_block_by_block, depth, claims_per_block, names)
+        at_once, claimtrie = run(backup_at_once, depth, claims_per_block, names)
+        assert claimtrie == expected
+        print('{:>4d} blocks: block by block {:.3f}s, at once {:.3f}s, {:.1f}x'.format(
+            depth, block_by_block, at_once, block_by_block / at_once))
+
+
+if __name__ == '__main__':
+    main()
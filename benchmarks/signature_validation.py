@@ -0,0 +1,92 @@
+'''Times claim signature validation inline and in process pools of a few sizes.
+
+Usage: python benchmarks/signature_validation.py [claims]'''
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+
+from electrumx.lib.hash import hash_to_str
+from lbryschema.claim import ClaimDict
+from lbryschema.decode import smart_decode
+from lbryschema.schema import SECP256k1
+from lbryschema.signer import get_signer
+
+from lbryumx.block_processor import validate_claim_signature
+
+ADDRESS = 'bTZito1AqWPig64GBioom11mHpoegMfXHx'
+STREAM = {
+    "version": "_0_0_1",
+    "claimType": "streamType",
+    "stream": {
+        "source": {
+            "source": "d5169241150022f996fa7cd6a9a1c421937276a3275eb912790bd07ba7aec1fac5fd45431d226b8fb402691e79aeb24b",
+            "version": "_0_0_1",
+            "contentType": "video/mp4",
+            "sourceType": "lbry_sd_hash"
+        },
+        "version": "_0_0_1",
+        "metadata": {
+            "license": "LBRY Inc",
+            "description": "benchmark claim",
+            "language": "en",
+            "title": "benchmark",
+            "author": "lbryumx",
+            "version": "_0_1_0",
+            "nsfw": False,
+            "licenseUrl": "",
+            "preview": "",
+            "thumbnail": ""
+        }
+    }
+}
+
+
+def make_jobs(count):
+    private_key = get_signer(SECP256k1).generate().private_key.to_pem()
+    certificate = ClaimDict.generate_certificate(private_key, curve=SECP256k1)
+    cert_claim_id = sha256(b'certificate').digest()[:20]
+    jobs = []
+    for index in range(count):
+        stream = dict(STREAM, stream=dict(STREAM['stream'], metadata=dict(
+            STREAM['stream']['metadata'], title='benchmark {}'.format(index))))
+        claim = smart_decode(ClaimDict.load_dict(stream).serialized)
+        signed = claim.sign(private_key, ADDRESS, hash_to_str(cert_claim_id), curve=SECP256k1)
+        jobs.append((signed.serialized, ADDRESS, certificate.serialized))
+    return jobs
+
+
+def run(jobs, workers):
+    values, addresses, cert_values = zip(*jobs)
+    if workers == 1:
+        start = time.time()
+        results = list(map(validate_claim_signature, values, addresses, cert_values))
+        elapsed = time.time() - start
+    else:
+        # the block processor keeps its pool around, so start the workers before timing
+        with ProcessPoolExecutor(workers) as executor:
+            list(executor.map(validate_claim_signature, *zip(*jobs[:workers])))
+            start = time.time()
+            chunksize = max(len(jobs) // (4 * workers), 1)
+            results = list(executor.map(validate_claim_signature, values, addresses, cert_values,
+                                        chunksize=chunksize))
+            elapsed = time.time() - start
+    assert all(results)
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    jobs = make_jobs(count)
+    cpus = os.cpu_count() or 1
+    baseline = None
+    for workers in sorted({1, 2, 4, cpus}):
+        elapsed = run(jobs, workers)
+        baseline = baseline or elapsed
+        print('{:>3d} workers: {:,d} signatures in {:.2f}s, {:,.0f}/s, {:.1f}x'.format(
+            workers, count, elapsed, count / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
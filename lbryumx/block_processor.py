@@ -1,35 +1,150 @@
+import asyncio
 import hashlib
+import os
 import struct
 import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain
 
 import msgpack
-from electrumx.lib.hash import hash_to_str
+from electrumx.lib.coins import Block
+from electrumx.lib.hash import hash_to_str, hash_to_hex_str
+from electrumx.lib.util import chunks
 
 from electrumx.server.block_processor import BlockProcessor
 from lbryschema.proto.claim_pb2 import Claim
 from lbryschema.uri import parse_lbry_uri
 from lbryschema.decode import smart_decode
 
-from lbryumx.model import NameClaim, ClaimInfo, ClaimUpdate, ClaimSupport
+from lbryumx.bloom import BloomFilter
+from lbryumx.cache import LRUCache, NOT_CACHED, ProofCache, ResolveCache
+from lbryumx.metrics import Metrics, cache_lines
+from lbryumx.subscriptions import ClaimSubscriptions
+from lbryumx.model import NameClaim, ClaimInfo, ClaimUpdate, ClaimSupport, ClaimTrieNode
+from lbryumx.storage import KeySpace
+
+CLAIM_OUTPOINT_FILTER_FILE = 'meta/claim_outpoints_filter'
+CLAIM_OUTPOINT_FILTER_MIN_CAPACITY = 1000000
+
+# names DB key prefixes and version, claims of a name are stored one per row
+NAME_CLAIM_ID_PREFIX = b'i'
+NAME_SEQUENCE_PREFIX = b'q'
+NAME_COUNT_PREFIX = b'c'
+NAMES_DB_VERSION_KEY = b'\x00version'
+NAMES_DB_VERSION = 1
+
+# signatures DB key prefixes and version, claims signed by a certificate are stored one per row
+SIGNED_CLAIM_PREFIX = b'm'
+SIGNED_COUNT_PREFIX = b'c'
+SIGNED_NAME_PREFIX = b'n'
+SIGNATURES_DB_VERSION_KEY = b'\x00version'
+SIGNATURES_DB_VERSION = 2
+
+# prefixes of the claim DBs when they share the UTXO DB key space, electrumx uses h, u, U and state
+CLAIM_KEY_SPACE_PREFIXES = {
+    'claims': b'Lc', 'names': b'Ln', 'signatures': b'Ls', 'outpoint_claim_id': b'Lo', 'claim_undo': b'Lu',
+    'claimtrie': b'Lt', 'supports': b'Lp'
+}
+
+# DBs synced before the claimtrie and supports indexes existed don't have their version
+CLAIMTRIE_DB_VERSION_KEY = b'\x00version'
+CLAIMTRIE_DB_VERSION = 1
+SUPPORTS_DB_VERSION_KEY = b'\x00version'
+SUPPORTS_DB_VERSION = 1
+# claim undo records start with their version, older ones are plain lists of (claim_id, claim info) pairs
+CLAIM_UNDO_VERSION = 2
+
+# claimtrie DB key prefixes
+CLAIMTRIE_NODE_PREFIX = b'n'
+ACTIVATION_PREFIX = b'a'
+SUPPORT_OUTPOINT_PREFIX = b's'
 
 
 class LBRYBlockProcessor(BlockProcessor):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, env, *args, **kwargs):
         self.claim_cache = {}
         self.claims_for_name_cache = {}
         self.claims_signed_by_cert_cache = {}
         self.outpoint_to_claim_id_cache = {}
+        self.claimtrie_cache = {}
+        self.supports_cache = {}
         self.claims_db = self.names_db = self.signatures_db = self.outpoint_to_claim_id_db = self.claim_undo_db = None
-        super().__init__(*args, **kwargs)
+        self.claimtrie_db = self.supports_db = None
+        self.claim_key_space = None
+        # False when the DB was synced before the claimtrie was indexed, the daemon tells winners and amounts then
+        self.claimtrie_indexed = True
+        # same for the supports index, the daemon tells the supports of claims then
+        self.supports_indexed = True
+        self.claim_undo_cache = {}
+        # approximate memory used by the caches above, counted as entries are added
+        self.claim_caches_size = 0
+        self.claim_outpoint_filter = None
+        # lowest height that may still have claim undo info on disk
+        self.claim_undo_start_height = 0
+        # undo info of the blocks being backed up, loaded at once, and the net claimtrie and supports changes
+        # collected while backing them up
+        self.reorg_claim_undo = {}
+        self.reorg_claimtrie_undo = {}
+        self.reorg_supports_undo = {}
+        # decoded claim infos by claim id, None when the claim doesn't exist, written through on every change.
+        # Set up before the DBs are opened as upgrading them reads claim infos
+        self.claim_info_cache = LRUCache(env.integer('CLAIM_INFO_CACHE_SIZE', 1000000),
+                                         env.integer('CLAIM_INFO_CACHE_MB', 100) * 1000 * 1000,
+                                         claim_info_size)
+        self.claim_info_generation = 0
+        # claims written by a flush, their cached infos are dropped once it is committed
+        self.flushed_claim_ids = set()
+        super().__init__(env, *args, **kwargs)
 
         # stores deletes not yet flushed to disk
         self.pending_abandons = {}
+        # claimtrie state for the block being processed: names to check for takeovers and values before changes
+        self.touched_names = set()
+        self.claimtrie_undo = {}
+        self.supports_undo = {}
+        # activations scheduled but not yet flushed, by height
+        self.pending_activations = {}
         self.should_validate_signatures = self.env.boolean('VALIDATE_CLAIM_SIGNATURES', False)
         self.log_info("LbryumX Block Processor - Validating signatures: {}".format(self.should_validate_signatures))
+        # signatures of a block batch are validated up front in worker processes, results keyed by their inputs
+        self.signature_executor = None
+        self.signature_results = {}
+        # decoded certificates by claim id, dropped whenever the certificate claim changes
+        self.certificate_cache = LRUCache(self.env.integer('CERTIFICATE_CACHE_SIZE', 10000))
+        # resolve results of all the sessions, invalidated by the names changed since the last flush once flushed
+        self.resolve_cache = ResolveCache(self.env.integer('RESOLVE_CACHE_SIZE', 10000))
+        # daemon name proofs, the ones at the tip are invalidated along with the resolve results
+        self.proof_cache = ProofCache(self.env.integer('PROOF_CACHE_SIZE', 100000),
+                                      self.env.integer('PROOF_CACHE_MB', 50) * 1000 * 1000)
+        self.changed_names = set()
+        # sessions following names and claim ids, told about the ones changed by each flush
+        self.claim_subscriptions = ClaimSubscriptions()
+        self.changed_claim_ids = set()
+        # latency of the session handlers, reported with the daemon and cache metrics by metrics_report
+        self.handler_metrics = Metrics('handler')
+        # blocks can be deserialized in worker processes, which also pre-parse the claim ids and certificate ids
+        # of the batch for advance_blocks
+        self.block_parse_executor = None
+        self.block_parse_workers = self.env.integer('BLOCK_PARSE_WORKERS', 0)
+        if self.block_parse_workers > 1:
+            self.block_parse_executor = ProcessPoolExecutor(self.block_parse_workers)
+            self.log_info("parsing blocks with {:,d} worker processes".format(self.block_parse_workers))
+        self.parsed_claim_ids = {}
+        self.parsed_cert_ids = {}
+        self.signature_workers = max(self.env.integer('SIGNATURE_VALIDATION_WORKERS', os.cpu_count() or 1), 1)
+        if self.should_validate_signatures:
+            if self.signature_workers > 1:
+                self.signature_executor = ProcessPoolExecutor(self.signature_workers)
+            self.log_info("validating signatures with {:,d} worker processes".format(self.signature_workers))
+        self.open_claim_outpoint_filter()
 
     def open_dbs(self):
         super().open_dbs()
+        if self.env.boolean('SINGLE_CLAIM_KEYSPACE', False):
+            return self.open_claim_key_space()
+
         def log_reason(message, is_for_sync):
             reason = 'sync' if is_for_sync else 'serving'
             self.logger.info('{} for {}'.format(message, reason))
@@ -44,27 +159,164 @@ class LBRYBlockProcessor(BlockProcessor):
                 self.signatures_db.close()
                 self.outpoint_to_claim_id_db.close()
                 self.claim_undo_db.close()
+                self.claimtrie_db.close()
+                self.supports_db.close()
             self.claims_db = self.db_class('claims', for_sync)
             self.names_db = self.db_class('names', for_sync)
+            self.upgrade_names_db()
             self.signatures_db = self.db_class('signatures', for_sync)
+            self.upgrade_signatures_db()
             self.outpoint_to_claim_id_db = self.db_class('outpoint_claim_id', for_sync)
             self.claim_undo_db = self.db_class('claim_undo', for_sync)
+            self.clear_excess_claim_undo_info()
+            self.claimtrie_db = self.db_class('claimtrie', for_sync)
+            self.claimtrie_indexed = self.check_index_version(self.claimtrie_db, CLAIMTRIE_DB_VERSION_KEY,
+                                                              CLAIMTRIE_DB_VERSION, 'claimtrie')
+            self.supports_db = self.db_class('supports', for_sync)
+            self.supports_indexed = self.check_index_version(self.supports_db, SUPPORTS_DB_VERSION_KEY,
+                                                             SUPPORTS_DB_VERSION, 'supports')
             log_reason('opened claim DBs', self.claims_db.for_sync)
 
+    def open_claim_key_space(self):
+        '''Opens the claim DBs as prefixed views of the UTXO DB, so they are written in its flush batch.'''
+        if self.claim_key_space:
+            return  # views follow the UTXO DB when electrumx re-opens it
+        if os.path.isdir('claims'):
+            self.log_warning('separate claim DBs found but SINGLE_CLAIM_KEYSPACE is set, they are not migrated. '
+                             'Unset it or resync from scratch.')
+        self.claim_key_space = KeySpace(lambda: self.utxo_db)
+        view = self.claim_key_space.view
+        self.claims_db = view(CLAIM_KEY_SPACE_PREFIXES['claims'])
+        self.names_db = view(CLAIM_KEY_SPACE_PREFIXES['names'])
+        self.upgrade_names_db()
+        self.signatures_db = view(CLAIM_KEY_SPACE_PREFIXES['signatures'])
+        self.upgrade_signatures_db()
+        self.outpoint_to_claim_id_db = view(CLAIM_KEY_SPACE_PREFIXES['outpoint_claim_id'])
+        self.claim_undo_db = view(CLAIM_KEY_SPACE_PREFIXES['claim_undo'])
+        self.clear_excess_claim_undo_info()
+        self.claimtrie_db = view(CLAIM_KEY_SPACE_PREFIXES['claimtrie'])
+        self.claimtrie_indexed = self.check_index_version(self.claimtrie_db, CLAIMTRIE_DB_VERSION_KEY,
+                                                          CLAIMTRIE_DB_VERSION, 'claimtrie')
+        self.supports_db = view(CLAIM_KEY_SPACE_PREFIXES['supports'])
+        self.supports_indexed = self.check_index_version(self.supports_db, SUPPORTS_DB_VERSION_KEY,
+                                                         SUPPORTS_DB_VERSION, 'supports')
+        self.logger.info('opened claim DBs in the UTXO DB key space')
+
     def flush(self, flush_utxos=False):
         # flush claims together with utxos as they are parsed together
-        self.batched_flush_claims()
-        return super().flush(flush_utxos=flush_utxos)
+        if not self.claim_key_space:
+            self.batched_flush_claims()
+        super().flush(flush_utxos=flush_utxos)
+        self.invalidate_flushed_claim_infos()
+        self.invalidate_name_caches()
+
+    def check_cache_size(self):
+        '''Flushes if the caches get too big, same as electrumx but also counting unflushed claims.'''
+        one_MB = 1000*1000
+        utxo_cache_size = len(self.utxo_cache) * 205
+        db_deletes_size = len(self.db_deletes) * 57
+        hist_cache_size = self.history.unflushed_memsize()
+        tx_hash_size = ((self.tx_count - self.fs_tx_count) * 32
+                        + (self.height - self.fs_height) * 42)
+        utxo_MB = (db_deletes_size + utxo_cache_size) // one_MB
+        hist_MB = (hist_cache_size + tx_hash_size) // one_MB
+        claims_MB = self.claim_caches_size // one_MB
+
+        self.logger.info('our height: {:,d} daemon: {:,d} UTXOs {:,d}MB hist {:,d}MB claims {:,d}MB'
+                         .format(self.height, self.daemon.cached_height(), utxo_MB, hist_MB, claims_MB))
+
+        # Claims are written on every flush, so they only add to the total
+        if utxo_MB + hist_MB + claims_MB >= self.cache_MB or hist_MB >= self.cache_MB // 5:
+            self.flush(utxo_MB >= self.cache_MB * 4 // 5)
+
+    def flush_state(self, batch):
+        # with a single key space claims go in the same batch as the UTXOs and chain state, electrumx also calls
+        # this outside of a batch to update the wall time
+        if self.claim_key_space and batch is not self.utxo_db:
+            with self.claim_key_space.joined_batch(batch):
+                self.batched_flush_claims()
+        return super().flush_state(batch)
+
+    def open_claim_outpoint_filter(self):
+        '''Loads the filter saved by the last clean shutdown. It's only saved on shutdown, so the file is removed
+        once loaded and a crash leaves none, the filter is rebuilt from the DBs then.'''
+        try:
+            self.claim_outpoint_filter = BloomFilter.from_file(CLAIM_OUTPOINT_FILTER_FILE)
+            os.remove(CLAIM_OUTPOINT_FILTER_FILE)
+            self.log_info("loaded claim outpoints filter with {:,d} entries".format(self.claim_outpoint_filter.count))
+        except (IOError, ValueError):
+            self.rebuild_claim_outpoint_filter()
+
+    def save_claim_outpoint_filter(self):
+        # after the last flush, the filter only gains entries so it's a superset of what's on disk
+        self.claim_outpoint_filter.to_file(CLAIM_OUTPOINT_FILTER_FILE)
+
+    def rebuild_claim_outpoint_filter(self):
+        '''Rebuilds the filter of claim and support outpoints, sized for twice as many entries.
+        Unflushed removals are kept, the filter must stay a superset of what is on disk.'''
+        start = time.time()
+        outpoints = {key for key, _ in self.outpoint_to_claim_id_db.iterator()}
+        outpoints.update(key[1:] for key, _ in self.claimtrie_db.iterator(prefix=SUPPORT_OUTPOINT_PREFIX))
+        outpoints.update(key for key, claim_id in self.outpoint_to_claim_id_cache.items() if claim_id)
+        outpoints.update(key[1:] for key, value in self.claimtrie_cache.items()
+                         if key[:1] == SUPPORT_OUTPOINT_PREFIX and value is not None)
+        claim_outpoint_filter = BloomFilter(max(2 * len(outpoints), CLAIM_OUTPOINT_FILTER_MIN_CAPACITY))
+        for outpoint in outpoints:
+            claim_outpoint_filter.add(outpoint)
+        self.claim_outpoint_filter = claim_outpoint_filter
+        self.log_info("rebuilt claim outpoints filter with {:,d} entries in {:.1f}s".format(
+            len(outpoints), time.time() - start))
+
+    def add_to_claim_outpoint_filter(self, outpoint):
+        self.claim_outpoint_filter.add(outpoint)
+        if self.claim_outpoint_filter.is_full:
+            self.rebuild_claim_outpoint_filter()
 
     def batched_flush_claims(self):
         with self.claims_db.write_batch() as claims_batch:
             with self.names_db.write_batch() as names_batch:
                 with self.signatures_db.write_batch() as signed_claims_batch:
                     with self.outpoint_to_claim_id_db.write_batch() as outpoint_batch:
-                        self.flush_claims(claims_batch, names_batch, signed_claims_batch,
-                                          outpoint_batch)
+                        with self.claimtrie_db.write_batch() as claimtrie_batch:
+                            with self.supports_db.write_batch() as supports_batch:
+                                with self.claim_undo_db.write_batch() as undo_batch:
+                                    self.flush_claims(claims_batch, names_batch, signed_claims_batch,
+                                                      outpoint_batch, claimtrie_batch, supports_batch, undo_batch)
+
+    def clear_excess_claim_undo_info(self):
+        '''Deletes claim undo info below the reorg limit left by older versions, then compacts the DB.
+        Only runs through the DB once on open, flushes prune by height after that.'''
+        min_height = self.min_undo_height(self.db_height)
+        keys = []
+        for key, _ in self.claim_undo_db.iterator():
+            height, = struct.unpack('>I', key)
+            if height >= min_height:
+                break
+            keys.append(key)
+        self.claim_undo_start_height = max(min_height, 0)
+        if keys:
+            with self.claim_undo_db.write_batch() as batch:
+                for key in keys:
+                    batch.delete(key)
+            self.log_info('deleted {:,d} stale claim undo entries'.format(len(keys)))
+            self.compact_claim_undo_db()
+
+    def compact_claim_undo_db(self):
+        start = time.time()
+        db = getattr(self.claim_undo_db, 'db', None)
+        if hasattr(db, 'compact_range'):
+            db.compact_range()
+            self.log_info('compacted claim undo DB in {:.1f}s'.format(time.time() - start))
 
-    def flush_claims(self, batch, names_batch, signed_claims_batch, outpoint_batch):
+    def prune_claim_undo_info(self, undo_batch):
+        '''Deletes claim undo info that went below the reorg limit since the last flush.'''
+        min_height = self.min_undo_height(self.height)
+        for height in range(self.claim_undo_start_height, min_height):
+            undo_batch.delete(struct.pack(">I", height))
+        self.claim_undo_start_height = max(min_height, self.claim_undo_start_height)
+
+    def flush_claims(self, batch, names_batch, signed_claims_batch, outpoint_batch, claimtrie_batch,
+                     supports_batch, undo_batch):
         flush_start = time.time()
         write_claim, write_name, write_cert = batch.put, names_batch.put, signed_claims_batch.put
         write_outpoint = outpoint_batch.put
@@ -74,9 +326,11 @@ class LBRYBlockProcessor(BlockProcessor):
             claim = self.get_claim_info(claim_id)
             self.remove_claim_for_name(claim.name, claim_id)
             if claim.cert_id:
-                self.remove_claim_from_certificate_claims(claim.cert_id, claim_id)
+                self.remove_claim_from_certificate_claims(claim.cert_id, claim_id, claim.name)
             self.remove_certificate(claim_id)
             self.claim_cache[claim_id] = None
+            self.cache_claim_info(claim_id, None)
+            self.invalidate_certificate(claim_id)
             for txid, tx_index in outpoints:
                 self.put_claim_id_for_outpoint(txid, tx_index, None)
         for key, claim in self.claim_cache.items():
@@ -84,33 +338,100 @@ class LBRYBlockProcessor(BlockProcessor):
                 write_claim(key, claim)
             else:
                 delete_claim(key)
-        for name, claims in self.claims_for_name_cache.items():
-            if not claims:
-                delete_name(name)
-            else:
-                write_name(name, msgpack.dumps(claims))
-        for cert_id, claims in self.claims_signed_by_cert_cache.items():
-            if not claims:
-                delete_cert(cert_id)
-            else:
-                write_cert(cert_id, msgpack.dumps(claims))
+        for name, rows in self.claims_for_name_cache.items():
+            for key, value in rows.items():
+                if value is not None:
+                    write_name(key, value)
+                else:
+                    delete_name(key)
+        for cert_id, rows in self.claims_signed_by_cert_cache.items():
+            for key, value in rows.items():
+                if value is not None:
+                    write_cert(key, value)
+                else:
+                    delete_cert(key)
         for key, claim_id in self.outpoint_to_claim_id_cache.items():
             if claim_id:
                 write_outpoint(key, claim_id)
             else:
                 delete_outpoint(key)
-        self.logger.info('flushed {:,d} blocks with {:,d} claims, {:,d} outpoints, {:,d} names '
-                         'and {:,d} certificates added while {:,d} were abandoned in {:.1f}s, committing...'
+        for key, value in self.claimtrie_cache.items():
+            if value is not None:
+                claimtrie_batch.put(key, value)
+            else:
+                claimtrie_batch.delete(key)
+        for claim_id, supports in self.supports_cache.items():
+            if supports:
+                supports_batch.put(claim_id, msgpack.dumps(supports))
+            else:
+                supports_batch.delete(claim_id)
+        for height, undo_info in self.claim_undo_cache.items():
+            undo_batch.put(struct.pack(">I", height), msgpack.dumps((CLAIM_UNDO_VERSION,) + undo_info))
+        self.prune_claim_undo_info(undo_batch)
+        self.logger.info('flushed {:,d} blocks with {:,d} claims, {:,d} outpoints, {:,d} names, '
+                         '{:,d} certificates, {:,d} claimtrie entries and {:,d} supported claims added '
+                         'while {:,d} were abandoned ({:,d}MB) in {:.1f}s, committing...'
                          .format(self.height - self.db_height,
                                  len(self.claim_cache), len(self.outpoint_to_claim_id_cache),
                                  len(self.claims_for_name_cache),
-                                 len(self.claims_signed_by_cert_cache), len(self.pending_abandons),
-                                 time.time() - flush_start))
+                                 len(self.claims_signed_by_cert_cache), len(self.claimtrie_cache),
+                                 len(self.supports_cache), len(self.pending_abandons),
+                                 self.claim_caches_size // 1000000, time.time() - flush_start))
+        self.log_cache_stats('claim info', self.claim_info_cache)
+        if self.should_validate_signatures:
+            self.log_cache_stats('certificate', self.certificate_cache)
+        if len(self.resolve_cache):
+            self.log_cache_stats('resolve', self.resolve_cache)
+        if len(self.proof_cache):
+            self.log_cache_stats('name proof', self.proof_cache)
+        if len(self.resolve_cache) or len(self.proof_cache) or len(self.claim_subscriptions):
+            self.changed_names.update(self.get_unflushed_claim_names())
+        if len(self.claim_subscriptions):
+            self.changed_claim_ids.update(self.claim_cache, self.supports_cache)
+        self.flushed_claim_ids.update(self.claim_cache, self.pending_abandons)
         self.claim_cache = {}
         self.claims_for_name_cache = {}
         self.claims_signed_by_cert_cache = {}
         self.outpoint_to_claim_id_cache = {}
+        self.claimtrie_cache = {}
+        self.supports_cache = {}
+        self.claim_undo_cache = {}
+        self.pending_activations = {}
         self.pending_abandons = {}
+        self.claim_caches_size = 0
+
+    def get_unflushed_claim_names(self):
+        '''Names of the claims, claimtrie nodes, supports and certificates changed since the last flush.'''
+        names = set(self.claims_for_name_cache)
+        node_prefix_size = len(CLAIMTRIE_NODE_PREFIX)
+        names.update(key[node_prefix_size:] for key in self.claimtrie_cache if key[:1] == CLAIMTRIE_NODE_PREFIX)
+        for claim_id in chain(self.claim_cache, self.supports_cache, self.claims_signed_by_cert_cache):
+            claim_info = self.get_claim_info(claim_id)
+            if claim_info:
+                names.add(claim_info.name)
+        return names
+
+    def invalidate_flushed_claim_infos(self):
+        '''Drops the infos of the claims written by the last flush, once it is on disk. Sessions reading while it
+        was committing missed the unflushed claims and read the DB before the commit, so they may have cached stale
+        infos.'''
+        claim_ids, self.flushed_claim_ids = self.flushed_claim_ids, set()
+        # before the drops, so reads that started before them aren't cached
+        self.claim_info_generation += 1
+        for claim_id in claim_ids:
+            self.claim_info_cache.pop(claim_id)
+
+    def invalidate_name_caches(self):
+        '''Drops the resolve results and tip proofs of the names changed by the last flush, once it is on disk,
+        and notifies the sessions subscribed to the changed names and claims.'''
+        names, self.changed_names = self.changed_names, set()
+        claim_ids, self.changed_claim_ids = self.changed_claim_ids, set()
+        # even without names, the changed names aren't collected while the caches are empty and a result built
+        # during the flush must not be stored
+        self.resolve_cache.invalidate(names)
+        self.proof_cache.invalidate(names)
+        if names or claim_ids:
+            self.claim_subscriptions.changed(names, claim_ids)
 
     def assert_flushed(self):
         super().assert_flushed()
@@ -118,19 +439,97 @@ class LBRYBlockProcessor(BlockProcessor):
         assert not self.claims_for_name_cache
         assert not self.claims_signed_by_cert_cache
         assert not self.outpoint_to_claim_id_cache
+        assert not self.claimtrie_cache
+        assert not self.supports_cache
+        assert not self.claim_undo_cache
         assert not self.pending_abandons
 
     def advance_blocks(self, blocks):
-        # save height, advance blocks as usual, then hook our claim tx processing
+        # process claims first, electrumx may flush while advancing and the claims must be in the same flush
         height = self.height + 1
-        super().advance_blocks(blocks)
-        pending_undo = []
+        if self.should_validate_signatures:
+            self.prevalidate_signatures(blocks)
         for index, block in enumerate(blocks):
             undo = self.advance_claim_txs(block.transactions, height + index)
-            pending_undo.append((height+index, undo,))
-        with self.claim_undo_db.write_batch() as writer:
-            for height, undo_info in pending_undo:
-                writer.put(struct.pack(">I", height), msgpack.dumps(undo_info))
+            self.update_claimtrie(height + index)
+            claimtrie_undo, self.claimtrie_undo = list(self.claimtrie_undo.items()), {}
+            supports_undo, self.supports_undo = list(self.supports_undo.items()), {}
+            self.claim_undo_cache[height + index] = (undo, claimtrie_undo, supports_undo)
+            self.claim_caches_size += 200 + 600 * len(undo) + 150 * len(supports_undo) + sum(
+                150 + len(key) + len(value or b'') for key, value in claimtrie_undo)
+        self.signature_results = {}
+        self.parsed_claim_ids, self.parsed_cert_ids = {}, {}
+        super().advance_blocks(blocks)
+
+    async def check_and_advance_blocks(self, raw_blocks, first):
+        '''Same as electrumx, but blocks are deserialized in worker processes when BLOCK_PARSE_WORKERS is set.'''
+        if not self.block_parse_executor:
+            return await super().check_and_advance_blocks(raw_blocks, first)
+        self.prefetcher.processing_blocks(raw_blocks)
+        if first != self.height + 1:
+            # If we prefetched two sets of blocks and the first caused
+            # a reorg this will happen when we try to process the
+            # second.  It should be very rare.
+            self.logger.warning('ignoring {:,d} blocks starting height {:,d}, '
+                                'expected {:,d}'.format(len(raw_blocks), first,
+                                                        self.height + 1))
+            return
+
+        blocks = await self.parse_blocks(raw_blocks, first)
+        headers = [block.header for block in blocks]
+        hprevs = [self.coin.header_prevhash(h) for h in headers]
+        expected_hprevs = [self.tip] + [self.coin.header_hash(h) for h in headers[:-1]]
+
+        if hprevs == expected_hprevs:
+            start = time.time()
+            await self.controller.run_in_executor(self.advance_blocks, blocks)
+            if not self.first_sync:
+                s = '' if len(blocks) == 1 else 's'
+                self.logger.info('processed {:,d} block{} in {:.1f}s'
+                                 .format(len(blocks), s,
+                                         time.time() - start))
+                self.controller.mempool.on_new_block(self.touched)
+            self.touched.clear()
+        else:
+            self.parsed_claim_ids, self.parsed_cert_ids = {}, {}
+            if hprevs[0] != expected_hprevs[0]:
+                await self.reorg_chain()
+            else:
+                # It is probably possible but extremely rare that what
+                # bitcoind returns doesn't form a chain because it
+                # reorg-ed the chain as it was processing the batched
+                # block hash requests.  Should this happen it's simplest
+                # just to reset the prefetcher and try again.
+                self.logger.warning('daemon blocks do not form a chain; '
+                                    'resetting the prefetcher')
+                await self.prefetcher.reset_height()
+
+    async def parse_blocks(self, raw_blocks, first):
+        '''Deserializes raw blocks in the worker processes, one chunk per worker, returning them in order.'''
+        loop = asyncio.get_event_loop()
+        chunk_size = -(-len(raw_blocks) // self.block_parse_workers)
+        raw_chunks = list(chunks(raw_blocks, chunk_size))
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self.block_parse_executor, parse_raw_blocks, self.coin, chunk,
+                                 first + index * chunk_size)
+            for index, chunk in enumerate(raw_chunks)))
+        blocks = []
+        for chunk, parsed_blocks in zip(raw_chunks, results):
+            for raw_block, (header, transactions, claim_ids, cert_ids) in zip(chunk, parsed_blocks):
+                blocks.append(Block(raw_block, header, transactions))
+                self.parsed_claim_ids.update(claim_ids)
+                self.parsed_cert_ids.update(cert_ids)
+        return blocks
+
+    def get_new_claim_id(self, txid, nout):
+        claim_id = self.parsed_claim_ids.get((txid, nout))
+        return claim_id or claim_id_hash(txid, nout)
+
+    def get_signing_cert_id(self, name, value):
+        key = (name, value)
+        if key in self.parsed_cert_ids:
+            return self.parsed_cert_ids[key]
+        return signing_cert_id(name, value)
 
     def spend_utxo(self, tx_hash, tx_idx):
         # this is called during electrumx tx advance, we gather spents in the process to avoid looping again
@@ -163,7 +562,11 @@ class LBRYBlockProcessor(BlockProcessor):
                 if txin not in update_inputs:
                     abandoned_claim_id = self.abandon_spent(txin.prev_hash, txin.prev_idx)
                     if abandoned_claim_id:
-                        add_undo((abandoned_claim_id, self.get_claim_info(abandoned_claim_id)))
+                        abandoned_claim_info = self.get_claim_info(abandoned_claim_id)
+                        self.remove_claim_from_claimtrie(abandoned_claim_info.name, abandoned_claim_id, height)
+                        add_undo((abandoned_claim_id, abandoned_claim_info))
+                    else:
+                        self.spend_support(txin.prev_hash, txin.prev_idx, height)
         return undo_info
 
     def advance_update_claim(self, output, height, txid, nout):
@@ -172,21 +575,24 @@ class LBRYBlockProcessor(BlockProcessor):
         old_claim_info = self.get_claim_info(claim_id)
         self.put_claim_id_for_outpoint(old_claim_info.txid, old_claim_info.nout, None)
         if old_claim_info.cert_id:
-            self.remove_claim_from_certificate_claims(old_claim_info.cert_id, claim_id)
+            self.remove_claim_from_certificate_claims(old_claim_info.cert_id, claim_id, old_claim_info.name)
         if claim_info.cert_id:
-            self.put_claim_id_signed_by_cert_id(claim_info.cert_id, claim_id)
+            self.put_claim_id_signed_by_cert_id(claim_info.cert_id, claim_id, claim_info.name)
         self.put_claim_info(claim_id, claim_info)
         self.put_claim_id_for_outpoint(txid, nout, claim_id)
+        self.remove_claim_from_claimtrie(old_claim_info.name, claim_id, height)
+        self.add_claim_to_claimtrie(claim_id, claim_info, height)
         return claim_id, old_claim_info
 
     def advance_claim_name_transaction(self, output, height, txid, nout):
-        claim_id = claim_id_hash(txid, nout)
+        claim_id = self.get_new_claim_id(txid, nout)
         claim_info = self.claim_info_from_output(output, txid, nout, height)
         if claim_info.cert_id:
-            self.put_claim_id_signed_by_cert_id(claim_info.cert_id, claim_id)
+            self.put_claim_id_signed_by_cert_id(claim_info.cert_id, claim_id, claim_info.name)
         self.put_claim_info(claim_id, claim_info)
         self.put_claim_for_name(claim_info.name, claim_id)
         self.put_claim_id_for_outpoint(txid, nout, claim_id)
+        self.add_claim_to_claimtrie(claim_id, claim_info, height)
         return claim_id, None
 
     def backup_from_undo_info(self, claim_id, undo_claim_info):
@@ -205,7 +611,8 @@ class LBRYBlockProcessor(BlockProcessor):
             # update, remove current claim
             self.remove_claim_id_for_outpoint(current_claim_info.txid, current_claim_info.nout)
             if current_claim_info.cert_id:
-                self.remove_claim_from_certificate_claims(current_claim_info.cert_id, claim_id)
+                self.remove_claim_from_certificate_claims(current_claim_info.cert_id, claim_id,
+                                                          current_claim_info.name)
         elif current_claim_info and not undo_claim_info:
             # claim, abandon it
             self.abandon_spent(current_claim_info.txid, current_claim_info.nout)
@@ -220,32 +627,191 @@ class LBRYBlockProcessor(BlockProcessor):
             self.put_claim_info(claim_id, undo_claim_info)
             if undo_claim_info.cert_id:
                 cert_id = self._checksig(undo_claim_info.name, undo_claim_info.value, undo_claim_info.address)
-                self.put_claim_id_signed_by_cert_id(cert_id, claim_id)
+                self.put_claim_id_signed_by_cert_id(cert_id, claim_id, undo_claim_info.name)
             self.put_claim_for_name(undo_claim_info.name, claim_id)
             self.put_claim_id_for_outpoint(undo_claim_info.txid, undo_claim_info.nout, claim_id)
 
     def backup_txs(self, txs):
         self.log_info("Reorg at height {} with {} transactions.".format(self.height, len(txs)))
-        undo_info = msgpack.loads(self.claim_undo_db.get(struct.pack(">I", self.height)), use_list=False)
+        self.backup_claim_txs()
+        return super().backup_txs(txs)
+
+    def backup_claim_txs(self):
+        serialized = self.reorg_claim_undo.pop(self.height, None) or self.claim_undo_db.get(
+            struct.pack(">I", self.height))
+        undo_info, claimtrie_undo, supports_undo = claim_undo_from_serialized(serialized)
         for claim_id, undo_claim_info in reversed(undo_info):
             self.backup_from_undo_info(claim_id, undo_claim_info)
-        return super().backup_txs(txs)
+        # blocks are backed up from the top, so the undo values of lower blocks replace the ones of higher blocks
+        self.reorg_claimtrie_undo.update(claimtrie_undo)
+        self.reorg_supports_undo.update(supports_undo)
 
     def backup_blocks(self, raw_blocks):
-        self.batched_flush_claims()
-        super().backup_blocks(raw_blocks=raw_blocks)
-        self.batched_flush_claims()
+        self.reorg_claim_undo = self.load_claim_undo_info(self.height - len(raw_blocks) + 1, self.height)
+        try:
+            super().backup_blocks(raw_blocks=raw_blocks)
+        finally:
+            self.reorg_claim_undo = {}
+        if not self.claim_key_space:
+            # otherwise the electrumx backup flush wrote the claims too
+            self.batched_flush_claims()
+        self.invalidate_flushed_claim_infos()
+        self.invalidate_name_caches()
+
+    def backup_flush(self):
+        self.restore_claimtrie_undo()
+        super().backup_flush()
+
+    def restore_claimtrie_undo(self):
+        '''Writes the net claimtrie and supports changes of the blocks backed up to the caches, each key once.'''
+        self.claimtrie_cache.update(self.reorg_claimtrie_undo)
+        for claim_id, supports in self.reorg_supports_undo.items():
+            self.supports_cache[claim_id] = [list(support) for support in supports]
+        self.log_info("restored {:,d} claimtrie values and supports of {:,d} claims".format(
+            len(self.reorg_claimtrie_undo), len(self.reorg_supports_undo)))
+        self.reorg_claimtrie_undo, self.reorg_supports_undo = {}, {}
+        # what backing up changed isn't undo info of the next block
+        self.claimtrie_undo, self.supports_undo = {}, {}
+
+    def load_claim_undo_info(self, min_height, max_height):
+        '''Reads the serialized claim undo info of the heights from min_height to max_height in one pass.'''
+        undo_infos = {}
+        for key, value in self.claim_undo_db.iterator(reverse=True):
+            height, = struct.unpack(">I", key)
+            if height < min_height:
+                break
+            if height <= max_height:
+                undo_infos[height] = value
+        return undo_infos
+
+    async def reorg_chain(self, count=None):
+        '''Same as electrumx, but all the blocks are backed up at once so they are flushed together.'''
+        if count is None:
+            self.logger.info('chain reorg detected')
+        else:
+            self.logger.info('faking a reorg of {:,d} blocks'.format(count))
+        await self.controller.run_in_executor(self.flush, True)
+
+        hashes = await self.reorg_hashes(count)
+        # Reverse and convert to hex strings.
+        hashes = [hash_to_hex_str(hash) for hash in reversed(hashes)]
+        raw_blocks = []
+        for hex_hashes in chunks(hashes, 50):
+            raw_blocks.extend(await self.daemon.raw_blocks(hex_hashes))
+        await self.controller.run_in_executor(self.backup_blocks, raw_blocks)
+        await self.prefetcher.reset_height()
 
     def shutdown(self, executor):
-        self.batched_flush_claims()
-        return super().shutdown(executor=executor)
+        if not self.claim_key_space:
+            self.batched_flush_claims()
+        if self.signature_executor:
+            self.signature_executor.shutdown()
+            self.signature_executor = None
+        if self.block_parse_executor:
+            self.block_parse_executor.shutdown()
+            self.block_parse_executor = None
+        result = super().shutdown(executor=executor)
+        self.save_claim_outpoint_filter()
+        return result
 
     def backup_claim_name(self, txid, nout):
         self.abandon_spent(txid, nout)
 
     def advance_support(self, claim_support, txid, nout, height, amount):
-        # TODO: check for more controller claim rules, like takeover or ordering
-        pass
+        name, claim_id = claim_support.name, claim_support.claim_id
+        self.log_info("[+] Adding support: {}:{} for {}.".format(hash_to_str(txid), nout, hash_to_str(claim_id)))
+        node = self.get_claimtrie_node(name) or ClaimTrieNode.empty()
+        delay = 0 if claim_id == node.winning_claim_id else self.get_activation_delay(node, height)
+        node.supports[txid + struct.pack('>I', nout)] = [claim_id, amount, height, height + delay]
+        if delay:
+            self.schedule_activation(name, height + delay)
+        self.put_claimtrie_node(name, node)
+        self.put_claimtrie_value(support_outpoint_key(txid, nout), name)
+        self.add_to_claim_outpoint_filter(txid + struct.pack('>I', nout))
+        self.put_support_for_claim_id(claim_id, txid, nout, amount, height)
+
+    def spend_support(self, tx_hash, tx_idx, height):
+        if tx_hash + struct.pack('>I', tx_idx) not in self.claim_outpoint_filter:
+            return
+        key = support_outpoint_key(tx_hash, tx_idx)
+        name = self.get_claimtrie_value(key)
+        if name is None:
+            return
+        self.log_info("[-] Spent support: {}:{}".format(hash_to_str(tx_hash), tx_idx))
+        node = self.get_claimtrie_node(name)
+        claim_id, _, support_height, _ = node.supports.pop(tx_hash + struct.pack('>I', tx_idx))
+        self.put_claimtrie_node(name, self.mark_expired_removal(node, support_height, height))
+        self.put_claimtrie_value(key, None)
+        self.remove_support_for_claim_id(claim_id, tx_hash, tx_idx)
+
+    def add_claim_to_claimtrie(self, claim_id, claim_info, height):
+        node = self.get_claimtrie_node(claim_info.name) or ClaimTrieNode.empty()
+        # updates to the controlling claim don't wait for activation
+        delay = 0 if claim_id == node.winning_claim_id else self.get_activation_delay(node, height)
+        node.claims[claim_id] = [claim_info.txid, claim_info.nout, claim_info.amount, height, height + delay]
+        if delay:
+            self.schedule_activation(claim_info.name, height + delay)
+        self.put_claimtrie_node(claim_info.name, node)
+
+    def remove_claim_from_claimtrie(self, name, claim_id, height):
+        node = self.get_claimtrie_node(name)
+        claim = node and node.claims.pop(claim_id, None)
+        if claim:
+            self.put_claimtrie_node(name, self.mark_expired_removal(node, claim[3], height))
+
+    def mark_expired_removal(self, node, removed_height, height):
+        '''Marks node as expired if the claim or support made at removed_height and removed at height had expired.
+        The takeovers expirations cause aren't modelled, so once the expired output is gone the node can't tell
+        its winner anymore. The mark stays until the name is emptied and starts over.'''
+        if height >= self.expiration_height(removed_height):
+            return node._replace(expired=True)
+        return node
+
+    def get_activation_delay(self, node, height):
+        if node.last_takeover_height is None:
+            return 0
+        return min((height - node.last_takeover_height) // self.coin.CLAIMTRIE_PROPORTIONAL_DELAY_FACTOR,
+                   self.coin.CLAIMTRIE_MAX_DELAY)
+
+    def schedule_activation(self, name, height):
+        self.pending_activations.setdefault(height, set()).add(name)
+        self.put_claimtrie_value(activation_key(height, name), b'')
+
+    def get_names_activating_at(self, height):
+        prefix = activation_key(height, b'')
+        names = set(self.pending_activations.get(height, ()))
+        names.update(key[len(prefix):] for key, _ in self.claimtrie_db.iterator(prefix=prefix))
+        return names
+
+    def update_claimtrie(self, height):
+        '''Checks for takeovers on names touched or activating at height, following lbrycrd rules:
+        when the best active claim is not the controlling one, everything pending for the name activates.'''
+        activating = self.get_names_activating_at(height)
+        names = self.touched_names | activating
+        # activations change effective amounts without writing the node
+        self.changed_names.update(names)
+        for name in names:
+            node = self.get_claimtrie_node(name)
+            if not node:
+                continue
+            if node.is_empty:
+                self.put_claimtrie_value(claimtrie_node_key(name), None)
+                continue
+            best_claim_id = node.best_claim_id(height)
+            if best_claim_id == node.winning_claim_id:
+                continue
+            if node.has_pending(height):
+                node.activate_all(height)
+                best_claim_id = node.best_claim_id(height)
+            self.log_info("[*] Takeover: {} on {} at {}".format(
+                hash_to_str(best_claim_id) if best_claim_id else None, name, height))
+            node = node._replace(winning_claim_id=best_claim_id,
+                                 last_takeover_height=height if best_claim_id else None)
+            self.put_claimtrie_node(name, node)
+        # applied, the claim undo restores them on a reorg
+        for name in activating:
+            self.put_claimtrie_value(activation_key(height, name), None)
+        self.touched_names = set()
 
     def claim_info_from_output(self, output, txid, nout, height):
         amount = output.value
@@ -256,21 +822,117 @@ class LBRYBlockProcessor(BlockProcessor):
         return ClaimInfo(name, value, txid, nout, amount, address, height, cert_id)
 
     def _checksig(self, name, value, address):
+        cert_id = self.get_signing_cert_id(name, value)
+        if not cert_id or not self.should_validate_signatures:
+            return cert_id
         try:
-            parse_lbry_uri(name.decode())  # skip invalid names
-            cert_id = Claim.FromString(value).publisherSignature.certificateId[::-1] or None
-            if not self.should_validate_signatures:
+            cert_value, certificate = self.get_decoded_certificate(cert_id)
+            if certificate and self.is_signature_valid(value, address, cert_value, certificate):
                 return cert_id
-            if cert_id:
-                cert_claim = self.get_claim_info(cert_id)
-                if cert_claim:
-                    certificate = smart_decode(cert_claim.value)
-                    claim_dict = smart_decode(value)
-                    claim_dict.validate_signature(address, certificate)
-                    return cert_id
         except Exception as e:
             pass
 
+    def get_decoded_certificate(self, cert_id):
+        '''Returns the certificate claim value and its decoded form, which is None if it doesn't decode.
+        Returns (None, None) if the certificate isn't claimed.'''
+        cached = self.certificate_cache.get(cert_id)
+        if cached:
+            return cached
+        cert_claim = self.get_claim_info(cert_id)
+        if not cert_claim:
+            return None, None
+        try:
+            certificate = smart_decode(cert_claim.value)
+        except Exception:
+            certificate = None
+        cached = (cert_claim.value, certificate)
+        self.certificate_cache.put(cert_id, cached)
+        return cached
+
+    def invalidate_certificate(self, claim_id):
+        self.certificate_cache.pop(claim_id)
+
+    def cache_stats(self):
+        caches = {'claim_info': self.claim_info_cache, 'certificate': self.certificate_cache,
+                  'resolve': self.resolve_cache, 'name_proof': self.proof_cache,
+                  'daemon_result': self.daemon.result_cache, 'raw_tx': self.daemon.raw_tx_cache}
+        return {name: cache.stats for name, cache in caches.items()}
+
+    def metrics_report(self):
+        '''Handler and daemon latencies, with the time handlers wait on the daemon, daemon call coalescing and
+        batching counts and cache stats.'''
+        return {'handlers': self.handler_metrics.stats, 'daemon': self.daemon.metrics.stats,
+                'daemon_calls': {method: dict(stats) for method, stats in self.daemon.method_stats.items()},
+                'daemon_batches': dict(self.daemon.batch_stats), 'caches': self.cache_stats()}
+
+    def prometheus_metrics(self):
+        lines = self.handler_metrics.prometheus_lines() + self.daemon.metrics.prometheus_lines()
+        lines.append('# TYPE lbryumx_daemon_calls_total counter')
+        for method, stats in sorted(self.daemon.method_stats.items()):
+            lines.extend('lbryumx_daemon_calls_total{{method="{}",outcome="{}"}} {}'.format(method, outcome, count)
+                         for outcome, count in sorted(stats.items()))
+        lines.extend(cache_lines(self.cache_stats()))
+        return '\n'.join(lines) + '\n'
+
+    def log_cache_stats(self, name, cache):
+        stats = cache.stats
+        self.log_info('{} cache: {:,d}/{:,d} entries, {:,d}KB, {:,d} hits, {:,d} misses ({:.1%} hit rate)'.format(
+            name, stats['size'], stats['max_size'], stats['bytes'] // 1000, stats['hits'], stats['misses'],
+            stats['hit_rate']))
+
+    def is_signature_valid(self, value, address, cert_value, certificate):
+        job = (value, address, cert_value)
+        if job in self.signature_results:
+            return self.signature_results[job]
+        try:
+            smart_decode(value).validate_signature(address, certificate)
+            return True
+        except Exception:
+            return False
+
+    def prevalidate_signatures(self, blocks):
+        '''Validates the signed claims of a block batch in worker processes.
+        Jobs are keyed by claim value, address and certificate value, the certificate being the one the claim
+        would see when processed in order, so results are the same as validating them one by one.'''
+        start = time.time()
+        jobs = set()
+        batch_values = {}
+        for block in blocks:
+            for tx, txid in block.transactions:
+                if not tx.has_claims:
+                    continue
+                for index, output in enumerate(tx.outputs):
+                    claim = output.claim
+                    if isinstance(claim, NameClaim):
+                        claim_id = self.get_new_claim_id(txid, index)
+                    elif isinstance(claim, ClaimUpdate):
+                        claim_id = claim.claim_id
+                    else:
+                        continue
+                    batch_values[claim_id] = claim.value
+                    cert_id = self.get_signing_cert_id(claim.name, claim.value)
+                    if not cert_id:
+                        continue
+                    cert_value = batch_values.get(cert_id)
+                    if cert_value is None:
+                        cert_value, certificate = self.get_decoded_certificate(cert_id)
+                        if certificate is None:
+                            continue
+                    if cert_value is not None:
+                        jobs.add((claim.value, self.coin.address_from_script(output.pk_script), cert_value))
+        if not jobs:
+            return
+        jobs = list(jobs)
+        values, addresses, cert_values = zip(*jobs)
+        if self.signature_executor:
+            chunksize = max(len(jobs) // (4 * self.signature_workers), 1)
+            results = self.signature_executor.map(
+                validate_claim_signature, values, addresses, cert_values, chunksize=chunksize)
+        else:
+            results = map(validate_claim_signature, values, addresses, cert_values)
+        self.signature_results = dict(zip(jobs, results))
+        self.log_info("validated {:,d} claim signatures in {:.2f}s".format(len(jobs), time.time() - start))
+
     def get_update_input(self, claim, inputs):
         claim_id = claim.claim_id
         claim_info = self.get_claim_info(claim_id)
@@ -285,71 +947,457 @@ class LBRYBlockProcessor(BlockProcessor):
         claim_id = self.get_claim_id_from_outpoint(tx_hash, tx_idx)
         if claim_id:
             self.log_info("[!] Abandon: {}".format(hash_to_str(claim_id)))
+            self.invalidate_certificate(claim_id)
+            self.count_cache_entry(self.pending_abandons, claim_id, 150)
             self.pending_abandons.setdefault(claim_id, []).append((tx_hash, tx_idx,))
             return claim_id
 
     def put_claim_id_for_outpoint(self, tx_hash, tx_idx, claim_id):
         self.log_info("[+] Adding outpoint: {}:{} for {}.".format(hash_to_str(tx_hash), tx_idx,
                                                                   hash_to_str(claim_id) if claim_id else None))
-        self.outpoint_to_claim_id_cache[tx_hash + struct.pack('>I', tx_idx)] = claim_id
+        key = tx_hash + struct.pack('>I', tx_idx)
+        if claim_id:
+            self.add_to_claim_outpoint_filter(key)
+        self.count_cache_entry(self.outpoint_to_claim_id_cache, key, 180)
+        self.outpoint_to_claim_id_cache[key] = claim_id
 
     def remove_claim_id_for_outpoint(self, tx_hash, tx_idx):
         self.log_info("[-] Remove outpoint: {}:{}.".format(hash_to_str(tx_hash), tx_idx))
-        self.outpoint_to_claim_id_cache[tx_hash + struct.pack('>I', tx_idx)] = None
+        key = tx_hash + struct.pack('>I', tx_idx)
+        self.count_cache_entry(self.outpoint_to_claim_id_cache, key, 180)
+        self.outpoint_to_claim_id_cache[key] = None
+
+    def get_tx_height(self, tx_hash):
+        '''Height of a flushed transaction with unspent outputs, found through the UTXO table and a bisect over
+        tx_counts. None if it isn't there, when all its outputs are spent only the daemon knows it.'''
+        # Key: b'h' + compressed_tx_hash + tx_idx + tx_num
+        for db_key, _ in self.utxo_db.iterator(prefix=b'h' + tx_hash[:4]):
+            tx_num, = struct.unpack('<I', db_key[-4:])
+            db_tx_hash, height = self.fs_tx_hash(tx_num)
+            if db_tx_hash == tx_hash:
+                return height
+        return None
 
     def get_claim_id_from_outpoint(self, tx_hash, tx_idx):
         key = tx_hash + struct.pack('>I', tx_idx)
+        if key not in self.claim_outpoint_filter:
+            return None
         return self.outpoint_to_claim_id_cache.get(key) or self.outpoint_to_claim_id_db.get(key)
 
+    def upgrade_names_db(self):
+        '''Moves names DBs holding one msgpack dict per name to one row per claim.'''
+        if self.names_db.get(NAMES_DB_VERSION_KEY):
+            return
+        start, count = time.time(), 0
+        with self.names_db.write_batch() as batch:
+            for name, db_claims in self.names_db.iterator():
+                claims = msgpack.loads(db_claims)
+                for claim_id, sequence in claims.items():
+                    batch.put(name_claim_id_key(name, claim_id), struct.pack('>I', sequence))
+                    batch.put(name_sequence_key(name, sequence), claim_id)
+                batch.put(name_count_key(name), struct.pack('>I', len(claims)))
+                batch.delete(name)
+                count += 1
+            batch.put(NAMES_DB_VERSION_KEY, struct.pack('>I', NAMES_DB_VERSION))
+        if count:
+            self.log_info("upgraded {:,d} names to one row per claim in {:.1f}s".format(count, time.time() - start))
+
+    def check_index_version(self, db, version_key, version, index_name):
+        '''Marks the index of a new DB with its version. An existing DB without it was synced before the index
+        existed, so the index is incomplete and left to the daemon until the DB is resynced.'''
+        if db.get(version_key):
+            return True
+        if self.db_height >= 0:
+            self.log_warning('the {} index is missing from this DB, it comes from the daemon until the DB is '
+                             'resynced from scratch'.format(index_name))
+            return False
+        with db.write_batch() as batch:
+            batch.put(version_key, struct.pack('>I', version))
+        return True
+
+    def get_name_row(self, name, key):
+        return get_cached_row(self.claims_for_name_cache, self.names_db, name, key)
+
+    def put_name_row(self, name, key, value):
+        self.put_cached_row(self.claims_for_name_cache, name, key, value)
+
     def get_claims_for_name(self, name):
-        if name in self.claims_for_name_cache: return self.claims_for_name_cache[name]
-        db_claims = self.names_db.get(name)
-        return msgpack.loads(db_claims) if db_claims else {}
+        '''Returns a dict of claim_id -> sequence for every claim of name.'''
+        prefix = name_claim_id_key(name, b'')
+        return {key[len(prefix):]: struct.unpack('>I', value)[0] for key, value in
+                iterate_cached_rows(self.claims_for_name_cache, self.names_db, name, prefix)}
+
+    def get_claim_sequence(self, name, claim_id):
+        sequence = self.get_name_row(name, name_claim_id_key(name, claim_id))
+        return struct.unpack('>I', sequence)[0] if sequence else None
+
+    def get_claim_id_for_sequence(self, name, sequence):
+        return self.get_name_row(name, name_sequence_key(name, sequence))
+
+    def get_claims_count_for_name(self, name):
+        count = self.get_name_row(name, name_count_key(name))
+        return struct.unpack('>I', count)[0] if count else 0
 
     def put_claim_for_name(self, name, claim_id):
         self.log_info("[+] Adding claim {} for name {}.".format(hash_to_str(claim_id), name))
-        claims = self.get_claims_for_name(name)
-        claims.setdefault(claim_id, max(claims.values() or [0]) + 1)
-        self.claims_for_name_cache[name] = claims
+        if self.get_claim_sequence(name, claim_id):
+            return
+        sequence = self.get_claims_count_for_name(name) + 1
+        self.put_name_row(name, name_claim_id_key(name, claim_id), struct.pack('>I', sequence))
+        self.put_name_row(name, name_sequence_key(name, sequence), claim_id)
+        self.put_name_row(name, name_count_key(name), struct.pack('>I', sequence))
 
     def remove_claim_for_name(self, name, claim_id):
         self.log_info("[-] Removing claim from name: {} - {}".format(hash_to_str(claim_id), name))
-        claims = self.get_claims_for_name(name)
-        claim_n = claims.pop(claim_id)
-        for claim_id, number in claims.items():
-            if number > claim_n:
-                claims[claim_id] = number - 1
-        self.claims_for_name_cache[name] = claims
+        removed_sequence = self.get_claim_sequence(name, claim_id)
+        if not removed_sequence:
+            return
+        count = self.get_claims_count_for_name(name)
+        # only claims after the removed one are renumbered
+        for sequence in range(removed_sequence + 1, count + 1):
+            moved_claim_id = self.get_claim_id_for_sequence(name, sequence)
+            self.put_name_row(name, name_sequence_key(name, sequence - 1), moved_claim_id)
+            self.put_name_row(name, name_claim_id_key(name, moved_claim_id), struct.pack('>I', sequence - 1))
+        self.put_name_row(name, name_claim_id_key(name, claim_id), None)
+        self.put_name_row(name, name_sequence_key(name, count), None)
+        self.put_name_row(name, name_count_key(name), struct.pack('>I', count - 1) if count > 1 else None)
+
+    def upgrade_signatures_db(self):
+        '''Moves signatures DBs holding one msgpack list per certificate to one row per signed claim (v1),
+        then adds the (certificate, name) rows for every signed claim (v2).'''
+        version = self.signatures_db.get(SIGNATURES_DB_VERSION_KEY)
+        version = struct.unpack('>I', version)[0] if version else 0
+        if version == SIGNATURES_DB_VERSION:
+            return
+        start, count = time.time(), 0
+        with self.signatures_db.write_batch() as batch:
+            if version < 1:
+                signed_claims = []
+                for cert_id, db_claims in self.signatures_db.iterator():
+                    claim_ids = set(msgpack.loads(db_claims))
+                    for claim_id in claim_ids:
+                        batch.put(signed_claim_key(cert_id, claim_id), b'')
+                        signed_claims.append((cert_id, claim_id))
+                    batch.put(signed_count_key(cert_id), struct.pack('>I', len(claim_ids)))
+                    batch.delete(cert_id)
+            else:
+                signed_claims = [split_signed_claim_key(key) for key, _ in
+                                 self.signatures_db.iterator(prefix=SIGNED_CLAIM_PREFIX)]
+            for cert_id, claim_id in signed_claims:
+                claim_info = self.get_claim_info(claim_id)
+                if claim_info:
+                    batch.put(signed_name_key(cert_id, claim_info.name, claim_id), b'')
+                count += 1
+            batch.put(SIGNATURES_DB_VERSION_KEY, struct.pack('>I', SIGNATURES_DB_VERSION))
+        if count:
+            self.log_info("upgraded signatures DB from version {} with {:,d} signed claims in {:.1f}s".format(
+                version, count, time.time() - start))
+
+    def iterate_signed_claim_ids_by_cert_id(self, cert_id):
+        prefix = signed_claim_key(cert_id, b'')
+        for key, _ in iterate_cached_rows(self.claims_signed_by_cert_cache, self.signatures_db, cert_id, prefix):
+            yield key[len(prefix):]
 
     def get_signed_claim_ids_by_cert_id(self, cert_id):
-        if cert_id in self.claims_signed_by_cert_cache: return self.claims_signed_by_cert_cache[cert_id]
-        db_claims = self.signatures_db.get(cert_id)
-        return msgpack.loads(db_claims, use_list=True) if db_claims else []
+        return list(self.iterate_signed_claim_ids_by_cert_id(cert_id))
+
+    def get_signed_claim_ids_by_cert_id_and_name(self, cert_id, name):
+        prefix = signed_name_key(cert_id, name, b'')
+        return [key[len(prefix):] for key, _ in
+                iterate_cached_rows(self.claims_signed_by_cert_cache, self.signatures_db, cert_id, prefix)]
+
+    def get_signed_claims_count(self, cert_id):
+        count = get_cached_row(self.claims_signed_by_cert_cache, self.signatures_db, cert_id,
+                               signed_count_key(cert_id))
+        return struct.unpack('>I', count)[0] if count else 0
+
+    def is_signed_by_cert_id(self, cert_id, claim_id):
+        return get_cached_row(self.claims_signed_by_cert_cache, self.signatures_db, cert_id,
+                              signed_claim_key(cert_id, claim_id)) is not None
 
-    def put_claim_id_signed_by_cert_id(self, cert_id, claim_id):
+    def put_signed_claims_count(self, cert_id, count):
+        self.put_cached_row(self.claims_signed_by_cert_cache, cert_id, signed_count_key(cert_id),
+                            struct.pack('>I', count) if count else None)
+
+    def put_claim_id_signed_by_cert_id(self, cert_id, claim_id, name=None):
         self.log_info("[+] Adding signature: {} - {}".format(hash_to_str(claim_id), hash_to_str(cert_id)))
-        certs = self.get_signed_claim_ids_by_cert_id(cert_id)
-        certs.append(claim_id)
-        self.claims_signed_by_cert_cache[cert_id] = certs
+        if name is not None:
+            self.put_cached_row(self.claims_signed_by_cert_cache, cert_id, signed_name_key(cert_id, name, claim_id),
+                                b'')
+        if self.is_signed_by_cert_id(cert_id, claim_id):
+            return
+        self.put_cached_row(self.claims_signed_by_cert_cache, cert_id, signed_claim_key(cert_id, claim_id), b'')
+        self.put_signed_claims_count(cert_id, self.get_signed_claims_count(cert_id) + 1)
 
     def remove_certificate(self, cert_id):
         self.log_info("[-] Removing certificate: {}".format(hash_to_str(cert_id)))
-        self.claims_signed_by_cert_cache[cert_id] = []
+        if not self.get_signed_claims_count(cert_id):
+            return
+        for prefix in (signed_claim_key(cert_id, b''), signed_name_prefix(cert_id)):
+            for key, _ in list(iterate_cached_rows(self.claims_signed_by_cert_cache, self.signatures_db,
+                                                   cert_id, prefix)):
+                self.put_cached_row(self.claims_signed_by_cert_cache, cert_id, key, None)
+        self.put_signed_claims_count(cert_id, 0)
 
-    def remove_claim_from_certificate_claims(self, cert_id, claim_id):
+    def remove_claim_from_certificate_claims(self, cert_id, claim_id, name=None):
         self.log_info("[-] Removing signature: {} - {}".format(hash_to_str(claim_id), hash_to_str(cert_id)))
-        certs = self.get_signed_claim_ids_by_cert_id(cert_id)
-        if claim_id in certs:
-            certs.remove(claim_id)
-        self.claims_signed_by_cert_cache[cert_id] = certs
+        if name is not None:
+            self.put_cached_row(self.claims_signed_by_cert_cache, cert_id, signed_name_key(cert_id, name, claim_id),
+                                None)
+        if not self.is_signed_by_cert_id(cert_id, claim_id):
+            return
+        self.put_cached_row(self.claims_signed_by_cert_cache, cert_id, signed_claim_key(cert_id, claim_id), None)
+        self.put_signed_claims_count(cert_id, self.get_signed_claims_count(cert_id) - 1)
+
+    def get_claimtrie_value(self, key):
+        if key in self.claimtrie_cache: return self.claimtrie_cache[key]
+        return self.claimtrie_db.get(key)
+
+    def put_claimtrie_value(self, key, value):
+        if key not in self.claimtrie_undo:
+            self.claimtrie_undo[key] = self.get_claimtrie_value(key)
+        old_value = self.claimtrie_cache.get(key)
+        self.count_cache_entry(self.claimtrie_cache, key, 150 + len(key))
+        self.claim_caches_size += len(value or b'') - len(old_value or b'')
+        self.claimtrie_cache[key] = value
+
+    def get_claimtrie_node(self, name):
+        serialized = self.get_claimtrie_value(claimtrie_node_key(name))
+        return ClaimTrieNode.from_serialized(serialized) if serialized else None
+
+    def put_claimtrie_node(self, name, node):
+        self.touched_names.add(name)
+        self.put_claimtrie_value(claimtrie_node_key(name), node.serialized)
+
+    def get_winning_claim_id(self, name):
+        node = self.get_claimtrie_node(name)
+        return node.winning_claim_id if node else None
+
+    def knows_winner(self, name):
+        '''False if the local claimtrie can't tell the winner of name, see knows_claimtrie_node.'''
+        node = self.get_claimtrie_node(name)
+        return self.claimtrie_indexed and (not node or self.knows_claimtrie_node(node))
+
+    def knows_claimtrie_node(self, node):
+        '''Expiration isn't modelled by the local claimtrie, so a name is left to the daemon once any of its
+        claims or supports expired, even once removed, as is everything when the claimtrie index is incomplete.'''
+        return self.claimtrie_indexed and not node.expired and \
+            not any(self.is_expired(claim[3]) for claim in node.claims.values()) and \
+            not any(self.is_expired(support[2]) for support in node.supports.values())
+
+    def expiration_height(self, height):
+        '''Height at which a claim or support made at height expires.'''
+        expiration_height = height + self.coin.CLAIM_EXPIRATION_TIME
+        if expiration_height > self.coin.EXTENDED_CLAIM_EXPIRATION_FORK_HEIGHT:
+            expiration_height = height + self.coin.EXTENDED_CLAIM_EXPIRATION_TIME
+        return expiration_height
+
+    def is_expired(self, height):
+        return self.height >= self.expiration_height(height)
+
+    def get_claimtrie_claim(self, name, claim_id):
+        '''Returns (effective_amount, valid_at_height) of a claim on the claimtrie, None if it's not there or the
+        local claimtrie doesn't know the state of its name.'''
+        node = self.get_claimtrie_node(name)
+        if not node or claim_id not in node.claims or not self.knows_claimtrie_node(node):
+            return None
+        return node.effective_amount(claim_id, self.height), node.claims[claim_id][4]
+
+    def get_supports_for_claim_id(self, claim_id):
+        if claim_id in self.supports_cache: return self.supports_cache[claim_id]
+        db_supports = self.supports_db.get(claim_id)
+        return msgpack.loads(db_supports) if db_supports else []
+
+    def put_support_for_claim_id(self, claim_id, txid, nout, amount, height):
+        supports = self.get_supports_for_claim_id(claim_id)
+        if claim_id not in self.supports_undo:
+            self.supports_undo[claim_id] = list(supports)
+        supports.append([txid, nout, amount, height])
+        self.count_cache_entry(self.supports_cache, claim_id, 200)
+        self.claim_caches_size += 250
+        self.supports_cache[claim_id] = supports
+
+    def remove_support_for_claim_id(self, claim_id, txid, nout):
+        supports = self.get_supports_for_claim_id(claim_id)
+        if claim_id not in self.supports_undo:
+            self.supports_undo[claim_id] = list(supports)
+        self.count_cache_entry(self.supports_cache, claim_id, 200 + 250 * len(supports))
+        self.supports_cache[claim_id] = [support for support in supports if support[:2] != [txid, nout]]
 
     def get_claim_info(self, claim_id):
+        claim_info = self.claim_info_cache.get(claim_id, NOT_CACHED)
+        if claim_info is not NOT_CACHED:
+            return claim_info
+        # sessions read from another thread than sync, don't cache what sync changed while we were reading
+        generation = self.claim_info_generation
         serialized = self.claim_cache.get(claim_id) or self.claims_db.get(claim_id)
-        return ClaimInfo.from_serialized(serialized) if serialized else None
+        claim_info = ClaimInfo.from_serialized(serialized) if serialized else None
+        if generation == self.claim_info_generation:
+            self.claim_info_cache.put(claim_id, claim_info)
+        return claim_info
 
     def put_claim_info(self, claim_id, claim_info):
         self.log_info("[+] Adding claim info for: {}".format(hash_to_str(claim_id)))
-        self.claim_cache[claim_id] = claim_info.serialized
+        serialized = claim_info.serialized
+        self.count_cache_entry(self.claim_cache, claim_id, 150 + len(serialized))
+        self.claim_cache[claim_id] = serialized
+        # cache what a read would return, fields change type when round tripped through msgpack
+        self.cache_claim_info(claim_id, ClaimInfo.from_serialized(serialized))
+        self.invalidate_certificate(claim_id)
+
+    def count_cache_entry(self, cache, key, size):
+        '''Adds size bytes to the unflushed claims total if key is new to cache.'''
+        if key not in cache:
+            self.claim_caches_size += size
+
+    def put_cached_row(self, cache, group, key, value):
+        rows = cache.get(group)
+        if rows is None:
+            rows = cache[group] = {}
+            self.claim_caches_size += 250 + len(group)
+        self.count_cache_entry(rows, key, 100 + len(key))
+        rows[key] = value
+
+    def cache_claim_info(self, claim_id, claim_info):
+        self.claim_info_generation += 1
+        self.claim_info_cache.put(claim_id, claim_info)
+
+def length_prefixed(value):
+    return struct.pack('>H', len(value)) + value
+
+
+def name_claim_id_key(name, claim_id):
+    return NAME_CLAIM_ID_PREFIX + length_prefixed(name) + claim_id
+
+
+def name_sequence_key(name, sequence):
+    return NAME_SEQUENCE_PREFIX + length_prefixed(name) + struct.pack('>I', sequence)
+
+
+def name_count_key(name):
+    return NAME_COUNT_PREFIX + length_prefixed(name)
+
+
+def signed_claim_key(cert_id, claim_id):
+    return SIGNED_CLAIM_PREFIX + length_prefixed(cert_id) + claim_id
+
+
+def split_signed_claim_key(key):
+    cert_id_length, = struct.unpack('>H', key[1:3])
+    return key[3:3 + cert_id_length], key[3 + cert_id_length:]
+
+
+def signed_count_key(cert_id):
+    return SIGNED_COUNT_PREFIX + length_prefixed(cert_id)
+
+
+def signed_name_prefix(cert_id):
+    return SIGNED_NAME_PREFIX + length_prefixed(cert_id)
+
+
+def signed_name_key(cert_id, name, claim_id):
+    return signed_name_prefix(cert_id) + length_prefixed(name) + claim_id
+
+
+def get_cached_row(cache, db, group, key):
+    '''Value of a row from a cache of group -> {key: value or None for deletes} over a DB.'''
+    rows = cache.get(group)
+    if rows and key in rows: return rows[key]
+    return db.get(key)
+
+
+def iterate_cached_rows(cache, db, group, prefix):
+    '''Yields (key, value) of the rows starting with prefix on DB, overlaid by the cached rows of group.'''
+    rows = cache.get(group)
+    if not rows:
+        yield from db.iterator(prefix=prefix)
+        return
+    merged = dict(db.iterator(prefix=prefix))
+    for key, value in rows.items():
+        if key.startswith(prefix):
+            if value is None:
+                merged.pop(key, None)
+            else:
+                merged[key] = value
+    for key in sorted(merged):
+        yield key, merged[key]
+
+
+def claim_undo_from_serialized(serialized):
+    '''Returns (claim undo, claimtrie undo, supports undo) of a claim undo record. Records written before the
+    claimtrie and supports were indexed only hold the claim undo.'''
+    record = msgpack.loads(serialized, use_list=False)
+    if record and record[0] == CLAIM_UNDO_VERSION:
+        return record[1:]
+    return record, (), ()
+
+
+def claimtrie_node_key(name):
+    return CLAIMTRIE_NODE_PREFIX + name
+
+
+def activation_key(height, name):
+    return ACTIVATION_PREFIX + struct.pack('>I', height) + name
+
+
+def support_outpoint_key(tx_hash, tx_idx):
+    return SUPPORT_OUTPOINT_PREFIX + tx_hash + struct.pack('>I', tx_idx)
+
+
+def signing_cert_id(name, value):
+    '''Returns the id of the certificate a claim says it's signed by, None for unsigned or invalid claims.'''
+    try:
+        parse_lbry_uri(name.decode())  # skip invalid names
+        return Claim.FromString(value).publisherSignature.certificateId[::-1] or None
+    except Exception:
+        return None
+
+
+def parse_raw_blocks(coin, raw_blocks, height):
+    '''Runs in worker processes. Deserializes consecutive raw blocks starting at height, returning their header and
+    transactions along with the claim ids of their new claims by outpoint and the certificate ids of their claims
+    by (name, value).'''
+    parsed_blocks = []
+    for raw_block in raw_blocks:
+        block = coin.block(raw_block, height)
+        claim_ids, cert_ids = {}, {}
+        for tx, txid in block.transactions:
+            if not tx.has_claims:
+                continue
+            for nout, output in enumerate(tx.outputs):
+                claim = output.claim
+                if isinstance(claim, NameClaim):
+                    claim_ids[(txid, nout)] = claim_id_hash(txid, nout)
+                if isinstance(claim, (NameClaim, ClaimUpdate)):
+                    cert_ids[(claim.name, claim.value)] = signing_cert_id(claim.name, claim.value)
+        parsed_blocks.append((block.header, block.transactions, claim_ids, cert_ids))
+        height += 1
+    return parsed_blocks
+
+
+@lru_cache(maxsize=1024)
+def decode_certificate(cert_value):
+    return smart_decode(cert_value)
+
+
+def claim_info_size(claim_info):
+    '''Approximate memory used by a cached ClaimInfo, or by None for a claim that doesn't exist.'''
+    if claim_info is None:
+        return 100
+    return 450 + len(claim_info.name) + len(claim_info.value)
+
+
+def validate_claim_signature(value, address, cert_value):
+    '''Runs in worker processes, so only takes and returns picklable values.
+    Certificates are cached by value in each worker, so they never go stale.'''
+    try:
+        certificate = decode_certificate(cert_value)
+        claim_dict = smart_decode(value)
+        claim_dict.validate_signature(address, certificate)
+        return True
+    except Exception:
+        return False
+
 
 def claim_id_hash(txid, n):
     # TODO: This should be in lbryschema
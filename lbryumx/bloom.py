@@ -0,0 +1,73 @@
+import math
+import os
+import struct
+from hashlib import blake2b
+
+
+class BloomFilter:
+    '''Set of byte strings answering membership with no false negatives and
+    false positives at about the configured error rate.
+
+    Items can't be removed, so once it holds more items than its capacity it
+    should be rebuilt from the source of truth.'''
+
+    HEADER = struct.Struct('>QQQB')
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(int(capacity), 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        h1, h2 = struct.unpack('<QQ', blake2b(item, digest_size=16).digest())
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def is_full(self):
+        return self.count > self.capacity
+
+    @property
+    def serialized(self):
+        return self.HEADER.pack(self.capacity, self.count, self.size, self.hashes) + bytes(self.bits)
+
+    @classmethod
+    def from_serialized(cls, serialized):
+        header_size = cls.HEADER.size
+        if len(serialized) < header_size:
+            raise ValueError('truncated bloom filter')
+        bloom_filter = cls.__new__(cls)
+        capacity, count, size, hashes = cls.HEADER.unpack(serialized[:header_size])
+        bloom_filter.capacity, bloom_filter.count, bloom_filter.size, bloom_filter.hashes = \
+            capacity, count, size, hashes
+        bloom_filter.bits = bytearray(serialized[header_size:])
+        if len(bloom_filter.bits) != (size + 7) // 8:
+            raise ValueError('truncated bloom filter')
+        return bloom_filter
+
+    def to_file(self, path):
+        '''Atomically replaces the file at path with this filter.'''
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as tmp_file:
+            tmp_file.write(self.serialized)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as filter_file:
+            return cls.from_serialized(filter_file.read())
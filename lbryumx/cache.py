@@ -0,0 +1,183 @@
+import json
+import threading
+from collections import OrderedDict
+
+# default for LRUCache.get telling a miss apart from a cached None
+NOT_CACHED = object()
+
+
+class LRUCache:
+    '''Mapping holding at most max_size items, evicting the least recently used one first.
+    If size_of is given it also keeps the sum of size_of(value) under max_bytes.
+    Counts lookup hits and misses so the size can be tuned. on_evict is called with the key and value of
+    every item evicted to make room.
+
+    Sync and the sessions both write some of them, so changes take a lock to keep the sizes consistent.'''
+
+    def __init__(self, max_size, max_bytes=None, size_of=None, on_evict=None):
+        self.max_size = max(int(max_size), 0)
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.on_evict = on_evict
+        self.items = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        try:
+            value = self.items[key]
+            # may race with an eviction from the flush thread
+            self.items.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if not self.max_size:
+            return
+        with self.lock:
+            self._pop(key)
+            self.items[key] = value
+            if self.size_of:
+                size = self.sizes[key] = self.size_of(value)
+                self.bytes += size
+            while len(self.items) > self.max_size or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                evicted, evicted_value = self.items.popitem(last=False)
+                self.bytes -= self.sizes.pop(evicted, 0)
+                if self.on_evict:
+                    self.on_evict(evicted, evicted_value)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self._pop(key, default)
+
+    def _pop(self, key, default=None):
+        self.bytes -= self.sizes.pop(key, 0)
+        return self.items.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def stats(self):
+        return {'size': len(self.items), 'max_size': self.max_size, 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate}
+
+
+class ResolveCache:
+    '''Resolve results shared by all the sessions, each stored with the claim names it was built from.
+    The block processor invalidates the names it changed once they are flushed, which drops their results.
+
+    Results are built on the event loop while flushes run in the executor, so a result is only stored if no
+    invalidation happened since the generation read before building it.'''
+
+    def __init__(self, max_size):
+        self.results = LRUCache(max_size, on_evict=self._forget)
+        self.keys_by_name = {}
+        self.generation = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        entry = self.results.get(key, NOT_CACHED)
+        return default if entry is NOT_CACHED else entry[0]
+
+    def put(self, key, result, names, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self._forget(key, self.results.pop(key))
+            self.results.put(key, (result, names))
+            if key in self.results:
+                for name in names:
+                    self.keys_by_name.setdefault(name, set()).add(key)
+
+    def invalidate(self, names):
+        '''Drops the results built from any of names.'''
+        with self.lock:
+            self.generation += 1
+            for name in names:
+                for key in self.keys_by_name.pop(name, ()):
+                    entry = self.results.pop(key)
+                    if entry is not None:
+                        self._forget(key, entry)
+                        self.invalidations += 1
+
+    def _forget(self, key, entry):
+        if entry is None:
+            return
+        for name in entry[1]:
+            keys = self.keys_by_name.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_name[name]
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def stats(self):
+        return dict(self.results.stats, names=len(self.keys_by_name), invalidations=self.invalidations)
+
+
+class ProofCache:
+    '''Name proofs by (name, block_hash). A proof at a given block hash never changes, so those are only evicted,
+    while proofs at the tip (block_hash None) are dropped by the block processor when their name is touched
+    by a flush or a reorg. Tip proofs are guarded by a generation like ResolveCache results.'''
+
+    def __init__(self, max_size, max_bytes):
+        self.proofs = LRUCache(max_size, max_bytes, proof_size)
+        self.generation = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, name, block_hash, default=None):
+        return self.proofs.get((name, block_hash), default)
+
+    def put(self, name, block_hash, proof, generation):
+        with self.lock:
+            if block_hash is None and generation != self.generation:
+                return
+            self.proofs.put((name, block_hash), proof)
+
+    def invalidate(self, names):
+        '''Drops the tip proofs of names.'''
+        with self.lock:
+            self.generation += 1
+            for name in names:
+                if self.proofs.pop((name, None)) is not None:
+                    self.invalidations += 1
+
+    def __len__(self):
+        return len(self.proofs)
+
+    @property
+    def stats(self):
+        return dict(self.proofs.stats, invalidations=self.invalidations)
+
+
+def proof_size(proof):
+    # roughly what the nested dicts of hex strings take, good enough to bound the cache
+    return 2 * len(json.dumps(proof))
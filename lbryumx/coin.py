@@ -35,6 +35,14 @@ class LBC(Coin):
     TX_PER_BLOCK = 1
     RPC_PORT = 9245
     REORG_LIMIT = 200
+    # claimtrie activation delay is 1 block for every 32 since the last takeover, up to 4032
+    CLAIMTRIE_PROPORTIONAL_DELAY_FACTOR = 32
+    CLAIMTRIE_MAX_DELAY = 4032
+    # claims and supports expire after CLAIM_EXPIRATION_TIME blocks, or EXTENDED_CLAIM_EXPIRATION_TIME if they
+    # hadn't expired yet at EXTENDED_CLAIM_EXPIRATION_FORK_HEIGHT
+    CLAIM_EXPIRATION_TIME = 262974
+    EXTENDED_CLAIM_EXPIRATION_TIME = 2102400
+    EXTENDED_CLAIM_EXPIRATION_FORK_HEIGHT = 400155
     PEERS = [
         'lbryum8.lbry.io t',
         'lbryum9.lbry.io t',
@@ -83,6 +91,12 @@ class LBC(Coin):
     def claim_address_handler(cls, script):
         '''Parse a claim script, returns the address
         '''
+        address_script = getattr(script, 'address_script', None)
+        if address_script is not None:
+            # decoded by the deserializer, standard P2PKH or P2SH
+            if len(address_script) == 25:
+                return cls.P2PKH_address_from_hash160(address_script[3:23])
+            return cls.P2SH_address_from_hash160(address_script[2:22])
         decoded = decode_claim_script(script)
         if not decoded:
             return None
@@ -120,6 +134,10 @@ class LBC(Coin):
             lbry_opcodes.OP_SUPPORT_CLAIM,
             lbry_opcodes.OP_UPDATE_CLAIM
         ]:
+            address_script = getattr(script, 'address_script', None)
+            if address_script is not None:
+                # same as the hashX of the address, which pays to this very script
+                return sha256(address_script).digest()[:cls.HASHX_LEN]
             return cls.address_to_hashX(cls.claim_address_handler(script))
         else:
             return sha256(script).digest()[:cls.HASHX_LEN]
@@ -132,3 +150,6 @@ class LBCRegTest(LBC):
     XPRV_VERBYTES = bytes.fromhex('04358394')
     P2PKH_VERBYTE = bytes.fromhex("6f")
     P2SH_VERBYTES = bytes.fromhex("c4")
+    CLAIM_EXPIRATION_TIME = 500
+    EXTENDED_CLAIM_EXPIRATION_TIME = 600
+    EXTENDED_CLAIM_EXPIRATION_FORK_HEIGHT = 800
@@ -1,8 +1,14 @@
-from functools import wraps
+import asyncio
+import time
+from collections import Counter, defaultdict
+from functools import partial, wraps
 
 from electrumx.server.daemon import Daemon, DaemonError
 from electrumx.lib.jsonrpc import RPCError
 
+from lbryumx.cache import LRUCache
+from lbryumx.metrics import Metrics, add_daemon_time
+
 
 def handles_errors(decorated_function):
     @wraps(decorated_function)
@@ -16,11 +22,167 @@ def handles_errors(decorated_function):
     return wrapper
 
 
+def coalesced(decorated_function):
+    '''Identical concurrent calls share one request to the daemon, and its result is reused by identical calls
+    for DAEMON_CACHE_SECONDS while the daemon height doesn't change.'''
+    method = decorated_function.__name__
+
+    @wraps(decorated_function)
+    async def wrapper(self, *args, **kwargs):
+        key = (method, args, tuple(sorted(kwargs.items())))
+        stats = self.method_stats[method]
+        stats['calls'] += 1
+        height = self.cached_height()
+        cached = self.result_cache.get(key)
+        if cached and cached[0] == height and time.time() - cached[1] < self.result_cache_seconds:
+            stats['cache_hits'] += 1
+            return cached[2]
+        request = self.requests_in_flight.get(key)
+        if request:
+            stats['coalesced'] += 1
+        else:
+            stats['requests'] += 1
+            request = asyncio.ensure_future(decorated_function(self, *args, **kwargs))
+            request.add_done_callback(partial(self.request_done, key, height))
+            self.requests_in_flight[key] = request
+        # a caller going away doesn't cancel the request for the others
+        start = time.perf_counter()
+        try:
+            return await asyncio.shield(request)
+        finally:
+            add_daemon_time(time.perf_counter() - start)
+    return wrapper
+
+
 class LBCDaemon(Daemon):
+
+    def __init__(self, env):
+        super().__init__(env)
+        self.requests_in_flight = {}
+        self.result_cache = LRUCache(env.integer('DAEMON_CACHE_SIZE', 10000))
+        self.result_cache_seconds = env.integer('DAEMON_CACHE_SECONDS', 2)
+        self.method_stats = defaultdict(Counter)
+        # latency of the RPCs, the time callers wait on them is added to their handler's metrics
+        self.metrics = Metrics('daemon', daemon_time=False)
+        # raw transactions never change, these are mostly the ones of winning claims
+        self.raw_tx_cache = LRUCache(env.integer('RAW_TX_CACHE_SIZE', 10000))
+        self.workqueue_semaphore = asyncio.Semaphore(max(env.integer('DAEMON_MAX_REQUESTS', 10), 1))
+        # single calls made within DAEMON_BATCH_MS of each other are sent as one vector request
+        self.batch_window = env.integer('DAEMON_BATCH_MS', 0) / 1000
+        self.batch_size = max(env.integer('DAEMON_BATCH_SIZE', 50), 1)
+        self.pending_calls = []
+        self.batch_timer = None
+        self.batch_stats = Counter()
+
+    def request_done(self, key, height, request):
+        del self.requests_in_flight[key]
+        if request.cancelled() or request.exception():
+            return
+        if self.result_cache_seconds:
+            self.result_cache.put(key, (height, time.time(), request.result()))
+
+    async def _send_single(self, method, params=None):
+        start = time.perf_counter()
+        error = True
+        try:
+            result = await self.send_single(method, params)
+            error = False
+            return result
+        finally:
+            self.observe(method, time.perf_counter() - start, error)
+
+    async def _send_vector(self, method, params_iterable, replace_errs=False):
+        start = time.perf_counter()
+        error = True
+        try:
+            result = await super()._send_vector(method, params_iterable, replace_errs=replace_errs)
+            error = False
+            return result
+        finally:
+            self.observe(method + '[]', time.perf_counter() - start, error)
+
+    def observe(self, method, seconds, error):
+        self.metrics.observe(method, seconds, error)
+        add_daemon_time(seconds)
+
+    async def send_single(self, method, params=None):
+        if not self.batch_window:
+            return await super()._send_single(method, params)
+        loop = asyncio.get_event_loop()
+        result = loop.create_future()
+        self.pending_calls.append((method, params, result))
+        if len(self.pending_calls) >= self.batch_size:
+            self.send_pending_calls()
+        elif len(self.pending_calls) == 1:
+            self.batch_timer = loop.call_later(self.batch_window, self.send_pending_calls)
+        return await result
+
+    def send_pending_calls(self):
+        if self.batch_timer:
+            self.batch_timer.cancel()
+            self.batch_timer = None
+        calls, self.pending_calls = self.pending_calls, []
+        if calls:
+            asyncio.ensure_future(self._send_calls(calls))
+
+    async def _send_calls(self, calls):
+        '''Sends calls of any method as one vector request, routing each result or error back to its caller.'''
+        self.batch_stats['requests'] += 1
+        self.batch_stats['calls'] += len(calls)
+        if len(calls) == 1:
+            method, params, result = calls[0]
+            try:
+                response = await super()._send_single(method, params)
+            except Exception as e:
+                if not result.done():
+                    result.set_exception(e)
+            else:
+                if not result.done():
+                    result.set_result(response)
+            return
+
+        def processor(items):
+            if any((item['error'] or {}).get('code') == self.WARMING_UP for item in items):
+                raise self.DaemonWarmingUpError
+            return {item['id']: item for item in items}
+
+        payload = []
+        for method, params, _ in calls:
+            request = {'method': method, 'id': self.next_req_id()}
+            if params:
+                request['params'] = params
+            payload.append(request)
+        try:
+            items = await self._send(payload, processor)
+        except Exception as e:
+            for _, _, result in calls:
+                if not result.done():
+                    result.set_exception(e)
+            return
+        for request, (_, _, result) in zip(payload, calls):
+            # the caller may have gone away
+            if result.done():
+                continue
+            item = items.get(request['id'])
+            if item is None:
+                result.set_exception(DaemonError({'code': self.RPC_MISC_ERROR, 'message': 'no response'}))
+            elif item['error']:
+                result.set_exception(DaemonError(item['error']))
+            else:
+                result.set_result(item['result'])
+
+    @coalesced
     @handles_errors
     async def getrawtransaction(self, hex_hash, verbose=False):
-        return await super().getrawtransaction(hex_hash=hex_hash, verbose=verbose)
+        if verbose:
+            return await super().getrawtransaction(hex_hash=hex_hash, verbose=verbose)
+        raw_tx = self.raw_tx_cache.get(hex_hash)
+        if raw_tx is None:
+            raw_tx = await super().getrawtransaction(hex_hash=hex_hash, verbose=verbose)
+            self.raw_tx_cache.put(hex_hash, raw_tx)
+        return raw_tx
 
+    @coalesced
     @handles_errors
     async def getclaimbyid(self, claim_id):
         '''Given a claim id, retrieves claim information.'''
@@ -31,21 +193,25 @@ class LBCDaemon(Daemon):
         '''Given a list of claim ids, batches calls to retrieve claim information.'''
         return await self._send_vector('getclaimbyid', ((claim_id,) for claim_id in claim_ids))
 
+    @coalesced
     @handles_errors
     async def getclaimsforname(self, name):
         '''Given a name, retrieves all claims matching that name.'''
         return await self._send_single('getclaimsforname', (name,))
 
+    @coalesced
     @handles_errors
     async def getclaimsfortx(self, txid):
         '''Given a txid, returns the claims it make.'''
         return await self._send_single('getclaimsfortx', (txid,))
 
+    @coalesced
     @handles_errors
     async def getnameproof(self, name, block_hash=None):
         '''Given a name and optional block_hash, returns a name proof and winner, if any.'''
         return await self._send_single('getnameproof', (name, block_hash,) if block_hash else (name,))
 
+    @coalesced
     @handles_errors
     async def getvalueforname(self, name):
         '''Given a name, returns the winning claim value.'''
@@ -0,0 +1,168 @@
+import asyncio
+import inspect
+import time
+import weakref
+from bisect import bisect_left
+from functools import partial, wraps
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# daemon time spent by the handler running in a task, see Metrics.timed and add_daemon_time
+task_timings = weakref.WeakKeyDictionary()
+
+
+class MethodMetrics:
+    '''Latency histogram, calls, errors and daemon time of a method.'''
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.daemon_seconds = 0.0
+
+    def observe(self, seconds, error=False, daemon_seconds=0.0):
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.calls += 1
+        self.errors += error
+        self.seconds += seconds
+        self.daemon_seconds += daemon_seconds
+
+    @property
+    def stats(self):
+        return {'calls': self.calls, 'errors': self.errors, 'seconds': self.seconds,
+                'buckets': dict(zip(LATENCY_BUCKETS + ('+Inf',), self.buckets))}
+
+    @property
+    def daemon_stats(self):
+        # waits overlap when a handler calls the daemon concurrently, local time is what's left of its latency:
+        # local index lookups and everything else besides waiting on the daemon
+        return dict(self.stats, daemon_seconds=self.daemon_seconds,
+                    local_seconds=max(self.seconds - self.daemon_seconds, 0.0))
+
+
+class Metrics:
+    '''Metrics of a group of methods by name, rendered as a dict or as Prometheus text.
+    With daemon_time the time the methods wait on the daemon is reported too.'''
+
+    def __init__(self, name, daemon_time=True):
+        self.name = name
+        self.daemon_time = daemon_time
+        self.methods = {}
+
+    def observe(self, method, seconds, error=False, daemon_seconds=0.0):
+        method_metrics = self.methods.get(method)
+        if method_metrics is None:
+            method_metrics = self.methods[method] = MethodMetrics()
+        method_metrics.observe(seconds, error, daemon_seconds)
+
+    def timed(self, method, function):
+        '''Wraps function to observe its calls as method. Coroutine functions also get the time their task
+        waits on the daemon.'''
+        if not inspect.iscoroutinefunction(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                error = True
+                try:
+                    result = function(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    self.observe(method, time.perf_counter() - start, error)
+            return wrapper
+
+        @wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            task = asyncio.Task.current_task()
+            timings = task_timings[task] = Timings()
+            start = time.perf_counter()
+            error = True
+            try:
+                result = await function(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                del task_timings[task]
+                self.observe(method, time.perf_counter() - start, error, timings.daemon_seconds)
+        return async_wrapper
+
+    @property
+    def stats(self):
+        return {method: method_metrics.daemon_stats if self.daemon_time else method_metrics.stats
+                for method, method_metrics in sorted(self.methods.items())}
+
+    def prometheus_lines(self):
+        name = 'lbryumx_{}'.format(self.name)
+        lines = ['# TYPE {}_seconds histogram'.format(name)]
+        for method, method_metrics in sorted(self.methods.items()):
+            count = 0
+            for bound, bucket in zip(LATENCY_BUCKETS + ('+Inf',), method_metrics.buckets):
+                count += bucket
+                lines.append('{}_seconds_bucket{{method="{}",le="{}"}} {}'.format(name, method, bound, count))
+            lines.append('{}_seconds_sum{{method="{}"}} {}'.format(name, method, method_metrics.seconds))
+            lines.append('{}_seconds_count{{method="{}"}} {}'.format(name, method, method_metrics.calls))
+        for counter in ('errors', 'daemon_seconds') if self.daemon_time else ('errors',):
+            lines.append('# TYPE {}_{}_total counter'.format(name, counter))
+            lines.extend('{}_{}_total{{method="{}"}} {}'.format(name, counter, method,
+                                                                getattr(method_metrics, counter))
+                         for method, method_metrics in sorted(self.methods.items()))
+        return lines
+
+
+class Timings:
+    __slots__ = ('daemon_seconds',)
+
+    def __init__(self):
+        self.daemon_seconds = 0.0
+
+
+def add_daemon_time(seconds):
+    '''Adds seconds waited on the daemon to the handler of the current task, if any.'''
+    task = asyncio.Task.current_task()
+    timings = task_timings.get(task) if task is not None else None
+    if timings is not None:
+        timings.daemon_seconds += seconds
+
+
+async def attributed(coroutine, task):
+    '''Runs coroutine in a new task counting its daemon time for the handler running in task.'''
+    timings = task_timings.get(task)
+    if timings is not None:
+        task_timings[asyncio.Task.current_task()] = timings
+    return await coroutine
+
+
+def cache_lines(caches):
+    '''Prometheus gauges of the stats of the caches, by name.'''
+    lines = []
+    for stat in ('size', 'bytes', 'hits', 'misses', 'hit_rate'):
+        lines.append('# TYPE lbryumx_cache_{} gauge'.format(stat))
+        lines.extend('lbryumx_cache_{}{{cache="{}"}} {}'.format(stat, name, stats[stat])
+                     for name, stats in sorted(caches.items()))
+    return lines
+
+
+async def serve_prometheus_text(get_text, reader, writer):
+    '''Answers any HTTP request with the Prometheus text of get_text.'''
+    try:
+        while (await reader.readline()).strip():
+            pass
+        body = get_text().encode()
+        writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+def serve_metrics(controller):
+    '''Adds the metrics RPC command, and serves the metrics as Prometheus text on PROMETHEUS_PORT if set.'''
+    block_processor = controller.bp
+    controller.rpc_handlers['metrics'] = block_processor.metrics_report
+    port = controller.env.integer('PROMETHEUS_PORT', None)
+    if port:
+        server = asyncio.start_server(partial(serve_prometheus_text, block_processor.prometheus_metrics),
+                                      controller.env.cs_host(for_rpc=True), port, loop=controller.loop)
+        asyncio.ensure_future(server, loop=controller.loop)
@@ -44,4 +44,85 @@ class LBRYTx(namedtuple("Tx", "version inputs outputs locktime")):
 
 
 class TxClaimOutput(namedtuple("TxClaimOutput", "value pk_script claim")):
-    pass
+
+    @property
+    def address_script(self):
+        '''Script paying to the output address, for claims it's the standard script after the claim.'''
+        return getattr(self.pk_script, 'address_script', self.pk_script)
+
+
+class ClaimScript(bytes):
+    '''pk_script of a claim output, keeping what was decoded from it so it's parsed only once.
+    address_script is the standard P2PKH or P2SH script after the claim, None for any other.'''
+
+    def __new__(cls, script, claim, address_script):
+        claim_script = super().__new__(cls, script)
+        claim_script.claim = claim
+        claim_script.address_script = address_script
+        return claim_script
+
+    def __reduce__(self):
+        return ClaimScript, (bytes(self), self.claim, self.address_script)
+
+
+class ClaimTrieNode(namedtuple("ClaimTrieNode", "last_takeover_height winning_claim_id claims supports expired")):
+    '''State of a name on the claimtrie as its stored on database.
+
+    claims maps claim_id -> [txid, nout, amount, height, valid_at_height]
+    supports maps outpoint -> [claim_id, amount, height, valid_at_height]
+    expired is set once an expired claim or support was removed from the name, nodes stored before it existed
+    don't have it
+    '''
+
+    def __new__(cls, last_takeover_height, winning_claim_id, claims, supports, expired=False):
+        return super().__new__(cls, last_takeover_height, winning_claim_id, claims, supports, expired)
+
+    @classmethod
+    def empty(cls):
+        return cls(None, None, {}, {})
+
+    @classmethod
+    def from_serialized(cls, serialized):
+        return cls(*msgpack.loads(serialized))
+
+    @property
+    def serialized(self):
+        return msgpack.dumps(self)
+
+    @property
+    def is_empty(self):
+        return not self.claims and not self.supports
+
+    def is_active(self, claim_id, height):
+        return claim_id in self.claims and self.claims[claim_id][4] <= height
+
+    def effective_amount(self, claim_id, height):
+        '''Claim amount plus the amount of its active supports, zero if the claim isn't active.'''
+        if not self.is_active(claim_id, height):
+            return 0
+        amount = self.claims[claim_id][2]
+        for support_claim_id, support_amount, _, valid_at_height in self.supports.values():
+            if support_claim_id == claim_id and valid_at_height <= height:
+                amount += support_amount
+        return amount
+
+    def best_claim_id(self, height):
+        '''Active claim with the biggest effective amount, ties go to the oldest claim then the lowest outpoint.'''
+        best, best_key = None, None
+        for claim_id, (txid, nout, _, claim_height, _) in self.claims.items():
+            if not self.is_active(claim_id, height):
+                continue
+            key = (-self.effective_amount(claim_id, height), claim_height, txid, nout)
+            if best_key is None or key < best_key:
+                best, best_key = claim_id, key
+        return best
+
+    def has_pending(self, height):
+        return any(claim[4] > height for claim in self.claims.values()) or \
+               any(support[3] > height for support in self.supports.values())
+
+    def activate_all(self, height):
+        for claim in self.claims.values():
+            claim[4] = min(claim[4], height)
+        for support in self.supports.values():
+            support[3] = min(support[3], height)
@@ -35,6 +35,18 @@ opcodes = Enumeration("Opcodes", [
 ])
 
 
+# OP_DUP OP_HASH160 <20 bytes> OP_EQUALVERIFY OP_CHECKSIG and OP_HASH160 <20 bytes> OP_EQUAL
+P2PKH_PREFIX = bytes((opcodes.OP_DUP, opcodes.OP_HASH160, 20))
+P2PKH_SUFFIX = bytes((opcodes.OP_EQUALVERIFY, opcodes.OP_CHECKSIG))
+P2SH_PREFIX = bytes((opcodes.OP_HASH160, 20))
+# plain ints for the claim script parser, enumeration attributes are looked up through __getattr__
+OP_CLAIM_NAME, OP_SUPPORT_CLAIM, OP_UPDATE_CLAIM = \
+    opcodes.OP_CLAIM_NAME, opcodes.OP_SUPPORT_CLAIM, opcodes.OP_UPDATE_CLAIM
+OP_PUSHDATA1, OP_PUSHDATA2, OP_PUSHDATA4 = opcodes.OP_PUSHDATA1, opcodes.OP_PUSHDATA2, opcodes.OP_PUSHDATA4
+OP_DROP, OP_2DROP = opcodes.OP_DROP, opcodes.OP_2DROP
+CLAIM_OPCODES = frozenset((OP_CLAIM_NAME, OP_SUPPORT_CLAIM, OP_UPDATE_CLAIM))
+
+
 def script_GetOp(bytes):
     i = 0
     while i < len(bytes):
@@ -62,6 +74,113 @@ def script_GetOp(bytes):
 
 
 def decode_claim_script(bytes_script):
+    decoded = decode_claim_script_ops(bytes_script)
+    if not decoded:
+        return decoded
+    claim, decoded_script, op = decoded
+    return claim, decoded_script[op:]
+
+
+def decode_claim_output_script(script):
+    '''Returns the claim of an output script and the script after it paying to the claim address, the latter is
+    only returned for standard P2PKH and P2SH scripts. Returns (None, None) for scripts that aren't claims.
+
+    Same results as decode_claim_script, but returns right away for scripts not starting with a claim opcode and
+    walks claim scripts in place.'''
+    size = len(script)
+    if not size or script[0] not in CLAIM_OPCODES:
+        return None, None
+    claim_type = script[0]
+    view = memoryview(script)
+    op = _read_op(script, 1, size)  # name
+    if not op or op[1] is None:
+        return None, None
+    name = bytes(view[op[1]:op[2]])
+    op = _read_op(script, op[2], size)  # value, or claim id for supports and updates
+    if not op or op[1] is None:
+        return None, None
+    value = claim_id = None
+    if claim_type == OP_CLAIM_NAME:
+        value = bytes(view[op[1]:op[2]])
+    else:
+        if op[2] - op[1] != 20:
+            return None, None
+        claim_id = bytes(view[op[1]:op[2]])
+    if claim_type == OP_UPDATE_CLAIM:
+        op = _read_op(script, op[2], size)
+        if not op or op[1] is None:
+            return None, None
+        value = bytes(view[op[1]:op[2]])
+    op = _read_op(script, op[2], size)
+    if not op or op[0] != OP_2DROP:
+        return None, None
+    op = _read_op(script, op[2], size)
+    if not op:
+        return None, None
+    if claim_type == OP_CLAIM_NAME and op[0] != OP_DROP:
+        return None, None
+    if claim_type == OP_UPDATE_CLAIM and op[0] != OP_2DROP:
+        return None, None
+    address_start = position = op[2]
+    # the rest has to parse too and hold at least 2 ops
+    tail_ops = 0
+    while position < size:
+        op = _read_op(script, position, size)
+        if not op:
+            return None, None
+        position = op[2]
+        tail_ops += 1
+    if tail_ops < 2:
+        return None, None
+    if claim_type == OP_CLAIM_NAME:
+        claim = NameClaim(name, value)
+    elif claim_type == OP_UPDATE_CLAIM:
+        claim = ClaimUpdate(name, claim_id, value)
+    else:
+        claim = ClaimSupport(name, claim_id)
+    return claim, standard_address_script(script[address_start:])
+
+
+def _read_op(script, position, size):
+    '''Returns (opcode, data start, data end) for the op at position, data start is None if it isn't a push and
+    data end is where the next op starts. Returns None at the end of the script or for truncated pushes.'''
+    if position >= size:
+        return None
+    opcode = script[position]
+    position += 1
+    if opcode > OP_PUSHDATA4:
+        return opcode, None, position
+    if opcode < OP_PUSHDATA1:
+        data_size = opcode
+    elif opcode == OP_PUSHDATA1:
+        if position + 1 > size:
+            return None
+        data_size = script[position]
+        position += 1
+    elif opcode == OP_PUSHDATA2:
+        if position + 2 > size:
+            return None
+        data_size, = struct.unpack_from('<H', script, position)
+        position += 2
+    else:
+        if position + 4 > size:
+            return None
+        data_size, = struct.unpack_from('<I', script, position)
+        position += 4
+    if position + data_size > size:
+        return None
+    return opcode, position, position + data_size
+
+
+def standard_address_script(script):
+    if len(script) == 25 and script[:3] == P2PKH_PREFIX and script[23:] == P2PKH_SUFFIX:
+        return script
+    if len(script) == 23 and script[:2] == P2SH_PREFIX and script[22] == opcodes.OP_EQUAL:
+        return script
+    return None
+
+
+def decode_claim_script_ops(bytes_script):
     try:
         decoded_script = [x for x in script_GetOp(bytes_script)]
     except Exception as e:
@@ -123,4 +242,4 @@ def decode_claim_script(bytes_script):
         if name is None or claim_id is None:
             return False
         claim = ClaimSupport(name, claim_id)
-    return claim, decoded_script[op:]
+    return claim, decoded_script, op
@@ -1,8 +1,7 @@
+import asyncio
 from binascii import unhexlify, hexlify
-from beaker.cache import CacheManager
-from beaker.util import parse_cache_config_options
 
-from electrumx.lib.hash import hash_to_str
+from electrumx.lib.hash import hash_to_str, hex_str_to_hash
 from electrumx.server.session import ElectrumX
 import electrumx.lib.util as util
 from electrumx.lib.jsonrpc import RPCError
@@ -10,26 +9,18 @@ from electrumx.lib.jsonrpc import RPCError
 from lbryschema.uri import parse_lbry_uri
 from lbryschema.error import URIParseError, DecodeError
 
-
-def setup_caching(data_dir):
-    cache_opts = {
-        'cache.type': 'dbm',
-        'cache.data_dir': data_dir,
-        'cache.lock_dir': data_dir,
-        'cache.regions': 'short_term, long_term',
-        'cache.short_term.type': 'dbm',
-    }
-
-    cache_manager = CacheManager(**parse_cache_config_options(cache_opts))
-    short_term_cache = cache_manager.get_cache('short_term', expire=240)
-    return short_term_cache
+from lbryumx.cache import NOT_CACHED
+from lbryumx.metrics import attributed
 
 
 class LBRYElectrumX(ElectrumX):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.cache = setup_caching(self.env.db_dir)
+        # claims are built from the local index, the daemon is only asked for what it doesn't have
+        self.claims_from_daemon = self.env.boolean('CLAIMS_FROM_DAEMON', False)
+        self.subscribed_names = set()
+        self.subscribed_claim_ids = set()
 
     def set_protocol_handlers(self, ptuple):
         super().set_protocol_handlers(ptuple)
@@ -48,8 +39,55 @@ class LBRYElectrumX(ElectrumX):
             'blockchain.claimtrie.getclaimssignedbyid': self.claimtrie_getclaimssignedbyid,
             'blockchain.block.get_server_height': self.get_server_height,
             'blockchain.block.get_block': self.get_block,
+            'blockchain.claimtrie.subscribe_name': self.claimtrie_subscribe_name,
+            'blockchain.claimtrie.subscribe_claim': self.claimtrie_subscribe_claim,
         }
         self.electrumx_handlers.update(handlers)
+        # wrapped once per session rather than on every request
+        self.timed_handlers = {method: self.bp.handler_metrics.timed(method, handler)
+                               for method, handler in self.electrumx_handlers.items()}
+
+    def request_handler(self, method):
+        return self.timed_handlers.get(method)
+
+    def sub_count(self):
+        return super().sub_count() + len(self.subscribed_names) + len(self.subscribed_claim_ids)
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        self.bp.claim_subscriptions.unsubscribe(self, self.subscribed_names, self.subscribed_claim_ids)
+
+    def check_subscription_limit(self):
+        if self.sub_count() >= self.max_subs:
+            raise RPCError('your subscription limit {:,d} reached'.format(self.max_subs))
+        self.controller.new_subscription()
+
+    async def claimtrie_subscribe_name(self, name):
+        '''Returns the value of name, then notifies its new value whenever a claim for it changes.'''
+        raw_name = name.encode('ISO-8859-1')
+        if raw_name not in self.subscribed_names:
+            self.check_subscription_limit()
+            self.subscribed_names.add(raw_name)
+            self.bp.claim_subscriptions.subscribe_name(self, raw_name)
+        return await self.claimtrie_getvalue(name)
+
+    async def claimtrie_subscribe_claim(self, claim_id):
+        '''Returns the claim, then notifies it whenever it is updated, supported, abandoned or reorged.'''
+        self.assert_claim_id(claim_id)
+        raw_claim_id = hex_str_to_hash(claim_id)
+        if raw_claim_id not in self.subscribed_claim_ids:
+            self.check_subscription_limit()
+            self.subscribed_claim_ids.add(raw_claim_id)
+            self.bp.claim_subscriptions.subscribe_claim(self, raw_claim_id)
+        return await self.claimtrie_getclaimbyid(claim_id)
+
+    async def name_notification(self, raw_name):
+        name = raw_name.decode('ISO-8859-1')
+        return name, await self.claimtrie_getvalue(name)
+
+    async def claim_notification(self, raw_claim_id):
+        claim_id = hash_to_str(raw_claim_id)
+        return claim_id, await self.claimtrie_getclaimbyid(claim_id)
 
     async def get_block(self, block_hash):
         return await self.daemon.deserialised_block(block_hash)
@@ -59,6 +97,10 @@ class LBRYElectrumX(ElectrumX):
 
     async def transaction_get_height(self, tx_hash):
         self.assert_tx_hash(tx_hash)
+        height = self.bp.get_tx_height(hex_str_to_hash(tx_hash))
+        if height is not None:
+            # same as db_height - confirmations, which the daemon path returns
+            return height - 1
         transaction_info = await self.daemon.getrawtransaction(tx_hash, True)
         if transaction_info and 'hex' in transaction_info and 'confirmations' in transaction_info:
             # an unconfirmed transaction from lbrycrdd will not have a 'confirmations' field
@@ -70,30 +112,41 @@ class LBRYElectrumX(ElectrumX):
         return None
 
     async def claimtrie_getclaimssignedby(self, name):
+        winning_claim_id = await self.get_winning_claim_id(name)
+        if winning_claim_id:
+            return await self.claimtrie_getclaimssignedbyid(hash_to_str(winning_claim_id))
+
+    async def get_winning_claim_id(self, name):
+        '''Raw id of the claim controlling name, from the daemon when the local claimtrie can't tell.'''
+        raw_name = name.encode('ISO-8859-1')
+        if self.bp.knows_winner(raw_name):
+            return self.bp.get_winning_claim_id(raw_name)
         winning_claim = await self.daemon.getvalueforname(name)
-        if winning_claim:
-            return await self.claimtrie_getclaimssignedbyid(winning_claim['claimId'])
+        return hex_str_to_hash(winning_claim['claimId']) if winning_claim else None
 
     async def claimtrie_getclaimssignedbyid(self, certificate_id):
+        return await self.get_claims_signed_by_id(certificate_id)
+
+    async def get_claims_signed_by_id(self, certificate_id, batch=None):
         claim_ids = self.get_claim_ids_signed_by(certificate_id)
+        if batch:
+            return await batch.once(('signed', certificate_id), self.batched_formatted_claims_from_daemon,
+                                    claim_ids, batch)
         return await self.batched_formatted_claims_from_daemon(claim_ids)
 
     def get_claim_ids_signed_by(self, certificate_id):
         raw_certificate_id = unhexlify(certificate_id)[::-1]
-        raw_claim_ids = self.bp.get_signed_claim_ids_by_cert_id(raw_certificate_id)
-        return list(map(hash_to_str, raw_claim_ids))
+        return list(map(hash_to_str, self.bp.iterate_signed_claim_ids_by_cert_id(raw_certificate_id)))
 
     def get_signed_claims_with_name_for_channel(self, channel_id, name):
-        claim_ids_for_name = list(self.bp.get_claims_for_name(name.encode('ISO-8859-1')).keys())
-        claim_ids_for_name = set(map(hash_to_str, claim_ids_for_name))
-        channel_claim_ids = set(self.get_claim_ids_signed_by(channel_id))
-        return claim_ids_for_name.intersection(channel_claim_ids)
+        raw_claim_ids = self.bp.get_signed_claim_ids_by_cert_id_and_name(unhexlify(channel_id)[::-1],
+                                                                         name.encode('ISO-8859-1'))
+        return list(map(hash_to_str, raw_claim_ids))
 
     async def claimtrie_getclaimssignedbynthtoname(self, name, n):
-        n = int(n)
-        for claim_id, sequence in self.bp.get_claims_for_name(name.encode('ISO-8859-1')).items():
-            if n == sequence:
-                return await self.claimtrie_getclaimssignedbyid(hash_to_str(claim_id))
+        claim_id = self.bp.get_claim_id_for_sequence(name.encode('ISO-8859-1'), int(n))
+        if claim_id:
+            return await self.claimtrie_getclaimssignedbyid(hash_to_str(claim_id))
 
     async def claimtrie_getclaimsintx(self, txid):
         # TODO: this needs further discussion.
@@ -101,39 +154,60 @@ class LBRYElectrumX(ElectrumX):
         claim_ids = [claim['claimId'] for claim in (await self.daemon.getclaimsfortx(txid)) if 'claimId' in claim]
         return await self.batched_formatted_claims_from_daemon(claim_ids)
 
+    async def get_name_proof(self, name, block_hash=None):
+        proof_cache = self.bp.proof_cache
+        raw_name = name.encode('ISO-8859-1')
+        proof = proof_cache.get(raw_name, block_hash, NOT_CACHED)
+        if proof is NOT_CACHED:
+            generation = proof_cache.generation
+            proof = await self.daemon.getnameproof(name, block_hash)
+            proof_cache.put(raw_name, block_hash, proof, generation)
+        return proof
+
     async def claimtrie_getvalue(self, name, block_hash=None):
-        proof = await self.daemon.getnameproof(name, block_hash)
+        proof = await self.get_name_proof(name, block_hash)
         result = {'proof': proof, 'supports': []}
 
         if proof_has_winning_claim(proof):
             tx_hash, nout = proof['txhash'], int(proof['nOut'])
-            transaction_info = await self.daemon.getrawtransaction(tx_hash, True)
-            result['transaction'] = transaction_info['hex']
-            result['height'] = (self.bp.db_height - transaction_info['confirmations']) + 1
-            raw_claim_id = self.bp.get_claim_id_from_outpoint(unhexlify(tx_hash)[::-1], nout)
-            sequence = self.bp.get_claims_for_name(name.encode('ISO-8859-1')).get(raw_claim_id)
+            raw_tx_hash = hex_str_to_hash(tx_hash)
+            raw_claim_id = self.bp.get_claim_id_from_outpoint(raw_tx_hash, nout)
+            claim_info = raw_claim_id and self.bp.get_claim_info(raw_claim_id)
+            if claim_info and claim_info.txid == raw_tx_hash:
+                height = claim_info.height
+            else:
+                height = self.bp.get_tx_height(raw_tx_hash)
+            if height is not None:
+                result['transaction'] = await self.daemon.getrawtransaction(tx_hash)
+                result['height'] = height
+            else:
+                transaction_info = await self.daemon.getrawtransaction(tx_hash, True)
+                result['transaction'] = transaction_info['hex']
+                result['height'] = (self.bp.db_height - transaction_info['confirmations']) + 1
+            sequence = self.bp.get_claim_sequence(name.encode('ISO-8859-1'), raw_claim_id)
             if sequence:
                 claim_id = hexlify(raw_claim_id[::-1]).decode()
-                claim_info = await self.daemon.getclaimbyid(claim_id)
-                if not claim_info or not claim_info.get('value'):
-                    claim_info = await self.slow_get_claim_by_id_using_name(claim_id)
                 result['claim_sequence'] = sequence
                 result['claim_id'] = claim_id
-                supports = self.format_supports_from_daemon(claim_info.get('supports', []))  # fixme: lbrycrd#124
-                result['supports'] = supports
+                daemon_claim = None if self.bp.supports_indexed else await self.daemon.getclaimbyid(claim_id)
+                result['supports'] = self.get_supports(raw_claim_id, daemon_claim)
             else:
                 self.log_warning('tx has no claims in db: {} {}'.format(tx_hash, nout))
         return result
 
     async def claimtrie_getnthclaimforname(self, name, n):
-        n = int(n)
-        for claim_id, sequence in self.bp.get_claims_for_name(name.encode('ISO-8859-1')).items():
-            if n == sequence:
-                return await self.claimtrie_getclaimbyid(hash_to_str(claim_id))
+        return await self.get_nth_claim_for_name(name, n)
+
+    async def get_nth_claim_for_name(self, name, n, batch=None):
+        claim_id = self.bp.get_claim_id_for_sequence(name.encode('ISO-8859-1'), int(n))
+        if claim_id:
+            return await self.get_claim_by_id(hash_to_str(claim_id), batch)
 
     async def claimtrie_getclaimsforname(self, name):
         claims = await self.daemon.getclaimsforname(name)
         if claims:
+            # the daemon shares its results between callers
+            claims = dict(claims)
             claims['claims'] = [self.format_claim_from_daemon(claim, name) for claim in claims['claims']]
             claims['supports_without_claims'] = claims['supports without claims']
             del claims['supports without claims']
@@ -142,16 +216,69 @@ class LBRYElectrumX(ElectrumX):
             return claims
         return {}
 
-    async def batched_formatted_claims_from_daemon(self, claim_ids):
-        claims = await self.daemon.getclaimsbyids(claim_ids)
-        result = []
-        for claim, claim_id in zip(claims, claim_ids):
-            if claim and claim.get('value'):
-                result.append(self.format_claim_from_daemon(claim))
-            else:
-                recovered_claim = await self.slow_get_claim_by_id_using_name(claim_id)
-                result.append(self.format_claim_from_daemon(recovered_claim))
-        return result
+    async def batched_formatted_claims_from_daemon(self, claim_ids, batch=None):
+        if not self.claims_from_daemon:
+            return await self.get_local_claims(claim_ids, batch)
+        claims = await self.get_daemon_claims(claim_ids, batch)
+        # claims lbrycrd failed to index are built from ours
+        missing_claim_ids = [claim_id for claim, claim_id in zip(claims, claim_ids)
+                             if not claim or not claim.get('value')]
+        local_claims = dict(zip(missing_claim_ids, await self.get_local_claims(missing_claim_ids, batch, False)))
+        return [local_claims[claim_id] if claim_id in local_claims else self.format_claim_from_daemon(claim)
+                for claim, claim_id in zip(claims, claim_ids)]
+
+    async def get_daemon_claims(self, claim_ids, batch=None):
+        prefetched = batch.claims if batch else {}
+        missing_claim_ids = [claim_id for claim_id in claim_ids if claim_id not in prefetched]
+        if missing_claim_ids:
+            prefetched = dict(prefetched)
+            prefetched.update(zip(missing_claim_ids, await self.daemon.getclaimsbyids(missing_claim_ids)))
+        return [prefetched[claim_id] for claim_id in claim_ids]
+
+    async def get_local_claims(self, claim_ids, batch=None, ask_daemon=True):
+        '''Formats claims from the local index. The daemon is only asked for the effective amount and activation
+        height of claims missing from the local claimtrie, and for supports when the local index lacks them.'''
+        claims, from_daemon = [], []
+        for claim_id in claim_ids:
+            raw_claim_id = unhexlify(claim_id)[::-1]
+            claim_info = self.bp.get_claim_info(raw_claim_id)
+            sequence = claim_info and self.bp.get_claim_sequence(claim_info.name, raw_claim_id)
+            if not sequence:
+                claims.append({})
+                continue
+            claimtrie_claim = self.bp.get_claimtrie_claim(claim_info.name, raw_claim_id)
+            if not claimtrie_claim or not self.bp.supports_indexed:
+                from_daemon.append(len(claims))
+            effective_amount, valid_at_height = claimtrie_claim or (None, None)
+            claims.append({
+                "name": claim_info.name.decode('ISO-8859-1'),
+                "claim_id": claim_id,
+                "txid": hash_to_str(claim_info.txid),
+                "nout": claim_info.nout,
+                "amount": claim_info.amount,
+                "depth": self.bp.db_height - claim_info.height,
+                "height": claim_info.height,
+                "value": hexlify(claim_info.value).decode(),
+                "claim_sequence": sequence,
+                "address": claim_info.address.decode(),
+                "supports": self.get_supports(raw_claim_id),
+                "effective_amount": effective_amount,
+                "valid_at_height": valid_at_height
+            })
+        if from_daemon and ask_daemon:
+            daemon_claims = await self.get_daemon_claims([claims[index]['claim_id'] for index in from_daemon],
+                                                         batch)
+            for index, daemon_claim in zip(from_daemon, daemon_claims):
+                daemon_claim = daemon_claim or {}
+                if not self.bp.supports_indexed:
+                    claims[index]['supports'] = self.format_supports_from_daemon(daemon_claim.get('supports', []))
+                if claims[index]['valid_at_height'] is not None:
+                    continue
+                claims[index]['effective_amount'] = get_from_possible_keys(
+                    daemon_claim, 'effective amount', 'nEffectiveAmount')
+                claims[index]['valid_at_height'] = get_from_possible_keys(
+                    daemon_claim, 'valid at height', 'nValidAtHeight')
+        return claims
 
     def format_claim_from_daemon(self, claim, name=None):
         '''Changes the returned claim data to the format expected by lbrynet and adds missing fields.'''
@@ -163,15 +290,19 @@ class LBRYElectrumX(ElectrumX):
             #raise RPCError("Lbrycrd has {} but not lbryumx, please submit a bug report.".format(claim_id))
             return {}
         address = self.bp.get_claim_info(raw_claim_id).address.decode()
-        sequence = self.bp.get_claims_for_name(name.encode('ISO-8859-1')).get(raw_claim_id)
+        sequence = self.bp.get_claim_sequence(name.encode('ISO-8859-1'), raw_claim_id)
         if not sequence:
             return {}
-        supports = self.format_supports_from_daemon(claim.get('supports', []))  # fixme: lbrycrd#124
+        supports = self.get_supports(raw_claim_id, claim)
 
         amount = get_from_possible_keys(claim, 'amount', 'nAmount')
         height = get_from_possible_keys(claim, 'height', 'nHeight')
-        effective_amount = get_from_possible_keys(claim, 'effective amount', 'nEffectiveAmount')
-        valid_at_height = get_from_possible_keys(claim, 'valid at height', 'nValidAtHeight')
+        claimtrie_claim = self.bp.get_claimtrie_claim(name.encode('ISO-8859-1'), raw_claim_id)
+        if claimtrie_claim:
+            effective_amount, valid_at_height = claimtrie_claim
+        else:
+            effective_amount = get_from_possible_keys(claim, 'effective amount', 'nEffectiveAmount')
+            valid_at_height = get_from_possible_keys(claim, 'valid at height', 'nValidAtHeight')
 
         return {
             "name": name,
@@ -184,20 +315,36 @@ class LBRYElectrumX(ElectrumX):
             "value": hexlify(claim['value'].encode('ISO-8859-1')).decode(),
             "claim_sequence": sequence,  # from index
             "address": address,  # from index
-            "supports": supports, # fixme: to be included in lbrycrd#124
-            "effective_amount": effective_amount,
-            "valid_at_height": valid_at_height  # TODO PR lbrycrd to include it
+            "supports": supports,  # from index, if synced with it
+            "effective_amount": effective_amount,  # from index, if synced with it
+            "valid_at_height": valid_at_height  # from index, if synced with it
         }
 
+    def get_supports(self, raw_claim_id, daemon_claim=None):
+        '''Supports of a claim from the local index, or from its daemon claim if the DB was synced without it.'''
+        if not self.bp.supports_indexed:
+            return self.format_supports_from_daemon((daemon_claim or {}).get('supports', []))
+        return [[hash_to_str(txid), nout, amount] for txid, nout, amount, _ in
+                self.bp.get_supports_for_claim_id(raw_claim_id)]
+
     def format_supports_from_daemon(self, supports):
         return [[support['txid'], support['n'], get_from_possible_keys(support, 'amount', 'nAmount')] for
-                 support in supports]
+                support in supports]
 
     async def claimtrie_getclaimbyid(self, claim_id):
+        return await self.get_claim_by_id(claim_id)
+
+    async def get_claim_by_id(self, claim_id, batch=None):
         self.assert_claim_id(claim_id)
-        claim = await self.daemon.getclaimbyid(claim_id)
+        if not self.claims_from_daemon:
+            return (await self.get_local_claims([claim_id], batch))[0]
+        if batch and claim_id in batch.claims:
+            claim = batch.claims[claim_id]
+        else:
+            claim = await self.daemon.getclaimbyid(claim_id)
         if not claim or not claim.get('value'):
-            claim = await self.slow_get_claim_by_id_using_name(claim_id)
+            # lbrycrd failed to index it, ours has it
+            return (await self.get_local_claims([claim_id], batch, False))[0]
         return self.format_claim_from_daemon(claim)
 
     async def claimtrie_getclaimsbyids(self, *claim_ids):
@@ -224,23 +371,22 @@ class LBRYElectrumX(ElectrumX):
             pass
         raise RPCError('{} should be a claim id hash'.format(value))
 
-    async def slow_get_claim_by_id_using_name(self, claim_id):
-        # TODO: temporary workaround for a lbrycrd bug on indexing. Should be removed when it gets stable
-        raw_claim_id = unhexlify(claim_id)[::-1]
-        claim = self.bp.get_claim_info(raw_claim_id)
-        if claim:
-            name = claim.name.decode('ISO-8859-1')
-            claims = await self.daemon.getclaimsforname(name)
-            for claim in claims['claims']:
-                if claim['claimId'] == claim_id:
-                    claim['name'] = name
-                    self.log_warning('Recovered a claim missing from lbrycrd index: {} {}'.format(name, claim_id))
-                    return claim
-
     async def claimtrie_getvalueforuri(self, block_hash, uri):
-        key = str((block_hash, uri))
-        if key in self.cache:
-            return self.cache[key]
+        return await self.get_value_for_uri(block_hash, uri)
+
+    async def get_value_for_uri(self, block_hash, uri, batch=None):
+        # results are shared by all sessions and dropped by the block processor when their names change
+        resolve_cache = self.bp.resolve_cache
+        key = (block_hash, uri)
+        result = resolve_cache.get(key, NOT_CACHED)
+        if result is not NOT_CACHED:
+            return refresh_depths(result, self.bp.db_height)
+        generation = resolve_cache.generation
+        result = await self.resolve_uri(block_hash, uri, batch)
+        resolve_cache.put(key, result, resolved_names(uri, result), generation)
+        return result
+
+    async def resolve_uri(self, block_hash, uri, batch=None):
         # TODO: this thing is huge, refactor
         CLAIM_ID = "claim_id"
         WINNING = "winning"
@@ -258,15 +404,16 @@ class LBRYElectrumX(ElectrumX):
 
             # TODO: this is also done on the else, refactor
             if parsed_uri.claim_id:
-                certificate_info = await self.claimtrie_getclaimbyid(parsed_uri.claim_id)
+                certificate_info = await self.get_claim_by_id(parsed_uri.claim_id, batch)
                 if certificate_info and certificate_info['name'] == parsed_uri.name:
                     certificate = {'resolution_type': CLAIM_ID, 'result': certificate_info}
             elif parsed_uri.claim_sequence:
-                certificate_info = await self.claimtrie_getnthclaimforname(parsed_uri.name, parsed_uri.claim_sequence)
+                certificate_info = await self.get_nth_claim_for_name(
+                    parsed_uri.name, parsed_uri.claim_sequence, batch)
                 if certificate_info:
                     certificate = {'resolution_type': SEQUENCE, 'result': certificate_info}
             else:
-                certificate_info = await self.claimtrie_getvalue(parsed_uri.name, block_hash)
+                certificate_info = await self.get_value(parsed_uri.name, block_hash, batch)
                 if certificate_info:
                     certificate = {'resolution_type': WINNING, 'result': certificate_info}
 
@@ -276,14 +423,14 @@ class LBRYElectrumX(ElectrumX):
             if certificate and not parsed_uri.path:
                 result['certificate'] = certificate
                 channel_id = certificate['result']['claim_id']
-                claims_in_channel = await self.claimtrie_getclaimssignedbyid(channel_id)
+                claims_in_channel = await self.get_claims_signed_by_id(channel_id, batch)
                 result['unverified_claims_in_channel'] = {claim['claim_id']: (claim['name'], claim['height'])
                                                           for claim in claims_in_channel if claim}
             elif certificate:
                 result['certificate'] = certificate
                 channel_id = certificate['result']['claim_id']
                 claim_ids_matching_name = self.get_signed_claims_with_name_for_channel(channel_id, parsed_uri.path)
-                claims = await self.batched_formatted_claims_from_daemon(claim_ids_matching_name)
+                claims = await self.batched_formatted_claims_from_daemon(claim_ids_matching_name, batch)
 
                 claims_in_channel = {claim['claim_id']: (claim['name'], claim['height'])
                                      for claim in claims}
@@ -291,15 +438,16 @@ class LBRYElectrumX(ElectrumX):
         else:
             claim = None
             if parsed_uri.claim_id:
-                claim_info = await self.claimtrie_getclaimbyid(parsed_uri.claim_id)
+                claim_info = await self.get_claim_by_id(parsed_uri.claim_id, batch)
                 if claim_info and claim_info['name'] == parsed_uri.name:
                     claim = {'resolution_type': CLAIM_ID, 'result': claim_info}
             elif parsed_uri.claim_sequence:
-                claim_info = await self.claimtrie_getnthclaimforname(parsed_uri.name, parsed_uri.claim_sequence)
+                claim_info = await self.get_nth_claim_for_name(
+                    parsed_uri.name, parsed_uri.claim_sequence, batch)
                 if claim_info:
                     claim = {'resolution_type': SEQUENCE, 'result': claim_info}
             else:
-                claim_info = await self.claimtrie_getvalue(parsed_uri.name, block_hash)
+                claim_info = await self.get_value(parsed_uri.name, block_hash, batch)
                 if claim_info:
                     claim = {'resolution_type': WINNING, 'result': claim_info}
             if (claim and
@@ -309,27 +457,129 @@ class LBRYElectrumX(ElectrumX):
                 raw_certificate_id = self.bp.get_claim_info(raw_claim_id).cert_id
                 if raw_certificate_id:
                     certificate_id = hash_to_str(raw_certificate_id)
-                    certificate = await self.claimtrie_getclaimbyid(certificate_id)
+                    certificate = await self.get_claim_by_id(certificate_id, batch)
                     if certificate:
                         certificate = {'resolution_type': CLAIM_ID,
                                        'result': certificate}
                         result['certificate'] = certificate
                 result['claim'] = claim
-        self.cache[key] = result
         return result
 
+    async def get_value(self, name, block_hash=None, batch=None):
+        '''claimtrie_getvalue, running once per name in a batch.'''
+        if not batch:
+            return await self.claimtrie_getvalue(name, block_hash)
+        return await batch.once(('value', name), self.claimtrie_getvalue, name, block_hash)
+
     async def claimtrie_getvalueforuris(self, block_hash, *uris):
         MAX_BATCH_URIS = 500
         if len(uris) > MAX_BATCH_URIS:
             raise Exception("Exceeds max batch uris of {}".format(MAX_BATCH_URIS))
 
-        return {uri: await self.claimtrie_getvalueforuri(block_hash, uri) for uri in uris}
-
-        # TODO: get it all concurrently when lbrycrd pending changes goes into a stable release
-        #async def getvalue(uri):
-        #    value = await self.claimtrie_getvalueforuri(block_hash, uri)
-        #    return uri, value,
-        #return dict([await asyncio.gather(*tuple(getvalue(uri) for uri in uris))][0])
+        uris = list(dict.fromkeys(uris))
+        resolve_cache = self.bp.resolve_cache
+        claim_ids = self.get_claim_ids_for_uris(uri for uri in uris if (block_hash, uri) not in resolve_cache)
+        claims = await self.daemon.getclaimsbyids(claim_ids) if claim_ids else []
+        batch = ResolveBatch(dict(zip(claim_ids, claims)))
+        semaphore = asyncio.Semaphore(self.env.integer('MAX_CONCURRENT_RESOLVES', 10))
+        task = asyncio.Task.current_task()
+
+        async def getvalue(uri):
+            async with semaphore:
+                return await self.get_value_for_uri(block_hash, uri, batch)
+        return dict(zip(uris, await asyncio.gather(*(attributed(getvalue(uri), task) for uri in uris))))
+
+    def get_claim_ids_for_uris(self, uris):
+        '''Ids of the claims resolving uris will look up by id, as far as the local index knows them.'''
+        claim_ids = set()
+        for uri in uris:
+            try:
+                parsed_uri = parse_lbry_uri(uri)
+            except URIParseError:
+                continue
+            name = parsed_uri.name.encode('ISO-8859-1')
+            raw_claim_id = None
+            if parsed_uri.claim_id:
+                try:
+                    self.assert_claim_id(parsed_uri.claim_id)
+                except RPCError:
+                    continue
+                raw_claim_id = unhexlify(parsed_uri.claim_id)[::-1]
+                claim_ids.add(raw_claim_id)
+            elif parsed_uri.claim_sequence:
+                raw_claim_id = self.bp.get_claim_id_for_sequence(name, int(parsed_uri.claim_sequence))
+                if raw_claim_id:
+                    claim_ids.add(raw_claim_id)
+            else:
+                # the winner itself comes with the name proof
+                raw_claim_id = self.bp.knows_winner(name) and self.bp.get_winning_claim_id(name)
+            if not raw_claim_id:
+                continue
+            claim_info = self.bp.get_claim_info(raw_claim_id)
+            if claim_info and claim_info.cert_id:
+                claim_ids.add(claim_info.cert_id)
+            if parsed_uri.is_channel and parsed_uri.path:
+                claim_ids.update(self.bp.get_signed_claim_ids_by_cert_id_and_name(
+                    raw_claim_id, parsed_uri.path.encode('ISO-8859-1')))
+            elif parsed_uri.is_channel:
+                claim_ids.update(self.bp.iterate_signed_claim_ids_by_cert_id(raw_claim_id))
+        if not self.claims_from_daemon:
+            # the rest is built from the local index
+            claim_ids = [claim_id for claim_id in claim_ids if self.is_off_local_claimtrie(claim_id)]
+        return [hash_to_str(claim_id) for claim_id in claim_ids]
+
+    def is_off_local_claimtrie(self, raw_claim_id):
+        claim_info = self.bp.get_claim_info(raw_claim_id)
+        return bool(claim_info) and not self.bp.get_claimtrie_claim(claim_info.name, raw_claim_id)
+
+
+class ResolveBatch:
+    '''Claims prefetched for a batch of uris and the lookups its uris share, which run once.'''
+
+    def __init__(self, claims):
+        self.claims = claims
+        self.lookups = {}
+
+    def once(self, key, coroutine_function, *args):
+        if key not in self.lookups:
+            self.lookups[key] = asyncio.ensure_future(attributed(coroutine_function(*args),
+                                                                 asyncio.Task.current_task()))
+        return self.lookups[key]
+
+
+def resolved_names(uri, result):
+    '''Names of the claims a resolve result was built from, encoded like the block processor stores them.'''
+    names = set()
+    try:
+        names.add(parse_lbry_uri(uri).name.encode('ISO-8859-1'))
+    except URIParseError:
+        pass
+    add_claim_names(result, names)
+    return names
+
+
+def add_claim_names(value, names):
+    if not isinstance(value, dict):
+        return
+    if isinstance(value.get('name'), str):
+        names.add(value['name'].encode('ISO-8859-1'))
+    for key, item in value.items():
+        if key.startswith('unverified_claims'):
+            names.update(name.encode('ISO-8859-1') for name, _ in item.values())
+        else:
+            add_claim_names(item, names)
+
+
+def refresh_depths(value, db_height):
+    '''Copy of a cached result with the depth of its claims at the current height, the cached one is shared by
+    the sessions.'''
+    if isinstance(value, dict):
+        value = {key: refresh_depths(item, db_height) for key, item in value.items()}
+        if 'depth' in value and 'height' in value:
+            value['depth'] = db_height - value['height']
+    elif isinstance(value, list):
+        value = [refresh_depths(item, db_height) for item in value]
+    return value
 
 
 def proof_has_winning_claim(proof):
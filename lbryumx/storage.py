@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+
+
+class KeySpace:
+    '''Splits one DB into prefixed views, whose writes can be joined into a single batch.
+
+    get_db returns the underlying DB, it is called on every access as electrumx re-opens its DBs
+    when switching between sync and serving.'''
+
+    def __init__(self, get_db):
+        self.get_db = get_db
+        self.batch = None
+
+    def view(self, prefix):
+        return PrefixedDB(self, prefix)
+
+    @contextmanager
+    def joined_batch(self, batch):
+        '''Sends the writes of every view to batch until the block exits, leaving the commit to its owner.'''
+        self.batch = batch
+        try:
+            yield batch
+        finally:
+            self.batch = None
+
+
+class PrefixedDB:
+    '''Storage-like view of the keys of a KeySpace starting with prefix, which is hidden from callers.'''
+
+    def __init__(self, key_space, prefix):
+        self.key_space = key_space
+        self.prefix = prefix
+
+    @property
+    def for_sync(self):
+        return self.key_space.get_db().for_sync
+
+    def get(self, key):
+        return self.key_space.get_db().get(self.prefix + key)
+
+    def put(self, key, value):
+        self.key_space.get_db().put(self.prefix + key, value)
+
+    def iterator(self, prefix=b'', reverse=False):
+        prefix_size = len(self.prefix)
+        for key, value in self.key_space.get_db().iterator(prefix=self.prefix + prefix, reverse=reverse):
+            yield key[prefix_size:], value
+
+    @contextmanager
+    def write_batch(self):
+        if self.key_space.batch is not None:
+            yield PrefixedBatch(self.key_space.batch, self.prefix)
+        else:
+            with self.key_space.get_db().write_batch() as batch:
+                yield PrefixedBatch(batch, self.prefix)
+
+    def close(self):
+        '''The underlying DB is owned and closed by electrumx.'''
+
+
+class PrefixedBatch:
+
+    def __init__(self, batch, prefix):
+        self.batch = batch
+        self.prefix = prefix
+
+    def put(self, key, value):
+        self.batch.put(self.prefix + key, value)
+
+    def delete(self, key):
+        self.batch.delete(self.prefix + key)
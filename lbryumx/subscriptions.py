@@ -0,0 +1,60 @@
+import asyncio
+
+import electrumx.lib.util as util
+
+
+class ClaimSubscriptions:
+    '''Sessions subscribed to names and claim ids, indexed by what they follow so that each name or claim
+    changed by a flush is looked up once and the result sent to all of its subscribers.
+
+    The block processor reports the changes from its flush thread, they are handed over to the event loop.'''
+
+    def __init__(self, loop=None):
+        self.logger = util.class_logger(__name__, self.__class__.__name__)
+        self.loop = loop or asyncio.get_event_loop()
+        self.sessions_by_name = {}
+        self.sessions_by_claim_id = {}
+        self.notifications = 0
+
+    def subscribe_name(self, session, name):
+        self.sessions_by_name.setdefault(name, set()).add(session)
+
+    def subscribe_claim(self, session, claim_id):
+        self.sessions_by_claim_id.setdefault(claim_id, set()).add(session)
+
+    def unsubscribe(self, session, names=(), claim_ids=()):
+        for subscriptions, keys in ((self.sessions_by_name, names), (self.sessions_by_claim_id, claim_ids)):
+            for key in keys:
+                sessions = subscriptions.get(key)
+                if sessions is not None:
+                    sessions.discard(session)
+                    if not sessions:
+                        del subscriptions[key]
+
+    def changed(self, names, claim_ids):
+        '''Called by the block processor once the changes to names and claim ids are flushed.'''
+        if self:
+            self.loop.call_soon_threadsafe(self.notify, names, claim_ids)
+
+    def notify(self, names, claim_ids):
+        for name in names.intersection(self.sessions_by_name):
+            sessions = list(self.sessions_by_name[name])
+            self.loop.create_task(self.notify_sessions(sessions, 'blockchain.claimtrie.subscribe_name',
+                                                       sessions[0].name_notification, name))
+        for claim_id in claim_ids.intersection(self.sessions_by_claim_id):
+            sessions = list(self.sessions_by_claim_id[claim_id])
+            self.loop.create_task(self.notify_sessions(sessions, 'blockchain.claimtrie.subscribe_claim',
+                                                       sessions[0].claim_notification, claim_id))
+
+    async def notify_sessions(self, sessions, method, get_notification, key):
+        try:
+            notification = await get_notification(key)
+        except Exception:
+            self.logger.exception('failed to build the {} notification of {}'.format(method, key))
+            return
+        for session in sessions:
+            session.send_notification(method, notification)
+        self.notifications += len(sessions)
+
+    def __len__(self):
+        return len(self.sessions_by_name) + len(self.sessions_by_claim_id)
@@ -1,6 +1,6 @@
 from electrumx.lib.tx import Deserializer
-from lbryumx.opcodes import decode_claim_script
-from lbryumx.model import TxClaimOutput, LBRYTx
+from lbryumx.opcodes import decode_claim_output_script
+from lbryumx.model import TxClaimOutput, LBRYTx, ClaimScript
 
 
 class LBRYDeserializer(Deserializer):
@@ -8,8 +8,10 @@ class LBRYDeserializer(Deserializer):
     def _read_output(self):
         value = self._read_le_int64()
         script = self._read_varbytes()  # pk_script
-        claim = decode_claim_script(script)
-        claim = claim[0] if claim else None
+        claim, address_script = decode_claim_output_script(script)
+        if claim:
+            # hashX and address are derived from the script, keep what we decoded for them
+            script = ClaimScript(script, claim, address_script)
         return TxClaimOutput(value, script, claim)
 
     def read_tx(self):
@@ -10,6 +10,7 @@ from electrumx.server.env import Env
 from electrumx.server.controller import Controller
 
 from lbryumx.coin import LBC
+from lbryumx.metrics import serve_metrics
 
 def main():
     '''Set up logging and run the server.'''
@@ -18,6 +19,7 @@ def main():
     logging.info('LbryumX server starting')
     try:
         controller = Controller(Env(LBC))
+        serve_metrics(controller)
         controller.run()
     except Exception:
         traceback.print_exc()
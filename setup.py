@@ -24,7 +24,6 @@ setup(
     python_requires='>=3.6',
     install_requires=(
         'msgpack',
-        'beaker',
         'lbryschema',
         'electrumx',
     ),
@@ -32,9 +32,26 @@ def ensure_lbrycrdd():
 
 @pytest.fixture()
 def block_processor(tmpdir_factory):
+    yield from make_block_processor(tmpdir_factory)
+
+
+@pytest.fixture()
+def single_key_space_block_processor(tmpdir_factory):
+    yield from make_block_processor(tmpdir_factory, SINGLE_CLAIM_KEYSPACE='1')
+
+
+@pytest.fixture()
+def parallel_parsing_block_processor(tmpdir_factory):
+    for bp in make_block_processor(tmpdir_factory, BLOCK_PARSE_WORKERS='2'):
+        yield bp
+        bp.block_parse_executor.shutdown()
+
+
+def make_block_processor(tmpdir_factory, **extra_env):
     environ.clear()
     environ['DB_DIRECTORY'] = tmpdir_factory.mktemp('db', numbered=True).strpath
     environ['DAEMON_URL'] = ''
+    environ.update(extra_env)
     env = Env(LBC)
     bp = LBC.BLOCK_PROCESSOR(env, None, None)
     yield bp
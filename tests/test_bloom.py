@@ -0,0 +1,29 @@
+from os import urandom
+
+from lbryumx.bloom import BloomFilter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom_filter = BloomFilter(1000)
+    items = [urandom(36) for _ in range(1000)]
+    for item in items:
+        bloom_filter.add(item)
+    assert all(item in bloom_filter for item in items)
+    assert not bloom_filter.is_full
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom_filter = BloomFilter(1000, error_rate=0.01)
+    for _ in range(1000):
+        bloom_filter.add(urandom(36))
+    false_positives = sum(urandom(36) in bloom_filter for _ in range(10000))
+    assert false_positives < 300
+
+
+def test_bloom_filter_serialization():
+    bloom_filter = BloomFilter(100)
+    bloom_filter.add(b'item')
+    restored = BloomFilter.from_serialized(bloom_filter.serialized)
+    assert b'item' in restored
+    assert restored.count == 1
+    assert restored.serialized == bloom_filter.serialized
@@ -0,0 +1,99 @@
+import threading
+
+from lbryumx.cache import LRUCache, NOT_CACHED, ProofCache, ResolveCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put(b'a', 1)
+    cache.put(b'b', 2)
+    assert cache.get(b'a') == 1
+    cache.put(b'c', 3)
+    assert b'b' not in cache
+    assert cache.get(b'b') is None
+    assert (cache.get(b'a'), cache.get(b'c')) == (1, 3)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_lru_cache_pop_and_zero_size():
+    cache = LRUCache(2)
+    cache.put(b'a', 1)
+    assert cache.pop(b'a') == 1
+    assert cache.pop(b'a') is None
+    disabled = LRUCache(0)
+    disabled.put(b'a', 1)
+    assert len(disabled) == 0
+
+
+def test_lru_cache_keeps_size_under_max_bytes():
+    cache = LRUCache(10, max_bytes=10, size_of=len)
+    cache.put(b'a', b'1234')
+    cache.put(b'b', b'1234')
+    cache.put(b'a', b'123456')
+    assert cache.bytes == 10
+    cache.put(b'c', b'1')
+    assert b'b' not in cache
+    assert cache.bytes == 7
+
+
+def test_lru_cache_sizes_stay_consistent_when_written_from_threads():
+    cache = LRUCache(50, max_bytes=200, size_of=len)
+
+    def write():
+        for index in range(2000):
+            key = index % 60
+            cache.put(key, b'x' * (index % 7))
+            if index % 5 == 0:
+                cache.pop(key + 1)
+
+    threads = [threading.Thread(target=write) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.bytes == sum(len(value) for value in cache.items.values()) <= 200
+    assert cache.sizes.keys() == cache.items.keys()
+
+
+def test_resolve_cache_invalidates_results_by_name():
+    cache = ResolveCache(10)
+    cache.put('a', 1, {b'name', b'@channel'}, cache.generation)
+    cache.put('b', 2, {b'@channel'}, cache.generation)
+    cache.put('c', 3, {b'other'}, cache.generation)
+    cache.invalidate({b'name'})
+    assert cache.get('a') is None
+    assert cache.get('b', NOT_CACHED) == 2
+    assert cache.keys_by_name == {b'@channel': {'b'}, b'other': {'c'}}
+    cache.invalidate({b'@channel'})
+    assert len(cache) == 1
+    assert cache.stats['invalidations'] == 2
+
+
+def test_resolve_cache_skips_results_built_across_an_invalidation():
+    cache = ResolveCache(1)
+    generation = cache.generation
+    cache.invalidate({b'name'})
+    cache.put('a', 1, {b'name'}, generation)
+    assert 'a' not in cache
+
+    cache.put('a', 1, {b'name'}, cache.generation)
+    cache.put('b', 2, {b'other'}, cache.generation)
+    assert 'a' not in cache
+    assert cache.keys_by_name == {b'other': {'b'}}
+
+
+def test_proof_cache_only_invalidates_tip_proofs():
+    cache = ProofCache(10, 10 ** 6)
+    generation = cache.generation
+    cache.put(b'name', None, {'nodes': []}, generation)
+    cache.put(b'name', 'abcd', {'nodes': [], 'txhash': 'ef'}, generation)
+    assert cache.stats['bytes'] > 0
+
+    cache.invalidate({b'name'})
+    assert cache.get(b'name', None, NOT_CACHED) is NOT_CACHED
+    assert cache.get(b'name', 'abcd') == {'nodes': [], 'txhash': 'ef'}
+    assert cache.stats['invalidations'] == 1
+
+    # a tip proof fetched before the invalidation may be stale already
+    cache.put(b'name', None, {'nodes': []}, generation)
+    assert len(cache) == 1
@@ -1,8 +1,15 @@
 import json
+import os
+import struct
 from binascii import hexlify
+from unittest.mock import MagicMock
+
+import msgpack
 
 from electrumx.lib.hash import hash_to_str
+from electrumx.server.storage import Storage
 
+from lbryumx.block_processor import CLAIM_OUTPOINT_FILTER_FILE, signed_claim_key, signed_count_key
 from lbryumx.model import ClaimInfo
 
 
@@ -14,6 +21,37 @@ def test_claim_sequence_remove_reorders(block_processor):
     db.remove_claim_for_name(name, b'id2')
 
     assert db.get_claims_for_name(name) == {b'id1': 1, b'id3': 2}
+    assert db.get_claim_id_for_sequence(name, 2) == b'id3'
+    assert db.get_claim_id_for_sequence(name, 3) is None
+    assert db.get_claims_count_for_name(name) == 2
+
+
+def test_claim_sequence_lookups_after_flush(block_processor):
+    name, db = b'name', block_processor
+    db.put_claim_for_name(name, b'id1')
+    db.put_claim_for_name(name, b'id2')
+    db.put_claim_for_name(b'name2', b'id3')
+    db.batched_flush_claims()
+    db.put_claim_for_name(name, b'id4')
+    db.remove_claim_for_name(name, b'id1')
+
+    assert db.get_claims_for_name(name) == {b'id2': 1, b'id4': 2}
+    assert db.get_claim_sequence(name, b'id4') == 2
+    assert db.get_claim_id_for_sequence(name, 1) == b'id2'
+    assert db.get_claims_for_name(b'name2') == {b'id3': 1}
+    db.batched_flush_claims()
+    assert db.get_claims_for_name(name) == {b'id2': 1, b'id4': 2}
+
+
+def test_names_db_upgrade(block_processor):
+    db = block_processor
+    with db.names_db.write_batch() as batch:
+        batch.delete(b'\x00version')
+        batch.put(b'name', msgpack.dumps({b'id1': 1, b'id2': 2}))
+    db.upgrade_names_db()
+    assert db.names_db.get(b'name') is None
+    assert db.get_claims_for_name(b'name') == {b'id1': 1, b'id2': 2}
+    assert db.get_claim_id_for_sequence(b'name', 2) == b'id2'
 
 
 def test_cert_to_claims_storage(block_processor):
@@ -37,6 +75,93 @@ def test_cert_to_claims_storage_removal_of_claim_id(block_processor):
     db.put_claim_id_signed_by_cert_id(b'certificate_id', b'claim_id2')
     db.remove_claim_from_certificate_claims(b'certificate_id', b'claim_id1')
     assert db.get_signed_claim_ids_by_cert_id(b'certificate_id') == [b'claim_id2']
+    assert db.get_signed_claims_count(b'certificate_id') == 1
+
+
+def test_cert_to_claims_storage_after_flush(block_processor):
+    db = block_processor
+    db.put_claim_id_signed_by_cert_id(b'certificate_id', b'claim_id1')
+    db.put_claim_id_signed_by_cert_id(b'certificate_id', b'claim_id2')
+    db.put_claim_id_signed_by_cert_id(b'certificate_id2', b'claim_id3')
+    db.batched_flush_claims()
+    db.put_claim_id_signed_by_cert_id(b'certificate_id', b'claim_id4')
+    db.put_claim_id_signed_by_cert_id(b'certificate_id', b'claim_id4')
+    db.remove_claim_from_certificate_claims(b'certificate_id', b'claim_id1')
+    assert db.get_signed_claim_ids_by_cert_id(b'certificate_id') == [b'claim_id2', b'claim_id4']
+    assert db.get_signed_claims_count(b'certificate_id') == 2
+    db.batched_flush_claims()
+    assert db.get_signed_claim_ids_by_cert_id(b'certificate_id') == [b'claim_id2', b'claim_id4']
+    db.remove_certificate(b'certificate_id')
+    db.batched_flush_claims()
+    assert db.get_signed_claim_ids_by_cert_id(b'certificate_id') == []
+    assert db.get_signed_claims_count(b'certificate_id') == 0
+    assert db.get_signed_claim_ids_by_cert_id(b'certificate_id2') == [b'claim_id3']
+
+
+def test_cert_and_name_to_claims_storage(block_processor):
+    db = block_processor
+    db.put_claim_id_signed_by_cert_id(b'certificate_id', b'claim_id1', b'name')
+    db.put_claim_id_signed_by_cert_id(b'certificate_id', b'claim_id2', b'name')
+    db.put_claim_id_signed_by_cert_id(b'certificate_id', b'claim_id3', b'other_name')
+    db.put_claim_id_signed_by_cert_id(b'certificate_id2', b'claim_id4', b'name')
+    db.batched_flush_claims()
+    db.remove_claim_from_certificate_claims(b'certificate_id', b'claim_id1', b'name')
+    assert db.get_signed_claim_ids_by_cert_id_and_name(b'certificate_id', b'name') == [b'claim_id2']
+    assert db.get_signed_claim_ids_by_cert_id_and_name(b'certificate_id', b'other_name') == [b'claim_id3']
+    db.remove_certificate(b'certificate_id')
+    assert db.get_signed_claim_ids_by_cert_id_and_name(b'certificate_id', b'name') == []
+    assert db.get_signed_claim_ids_by_cert_id_and_name(b'certificate_id2', b'name') == [b'claim_id4']
+
+
+def test_signatures_db_upgrade(block_processor):
+    db = block_processor
+    with db.signatures_db.write_batch() as batch:
+        batch.delete(b'\x00version')
+        batch.put(b'certificate_id', msgpack.dumps([b'claim_id1', b'claim_id2']))
+    db.put_claim_info(b'claim_id1', ClaimInfo(b'name', b'value', b'txid', 0, 1, b'address', 1, b'certificate_id'))
+    db.upgrade_signatures_db()
+    assert db.signatures_db.get(b'certificate_id') is None
+    assert db.get_signed_claim_ids_by_cert_id(b'certificate_id') == [b'claim_id1', b'claim_id2']
+    assert db.get_signed_claims_count(b'certificate_id') == 2
+    assert db.get_signed_claim_ids_by_cert_id_and_name(b'certificate_id', b'name') == [b'claim_id1']
+
+
+def test_reopening_a_v1_signatures_db_with_signed_claims(block_processor):
+    block_processor.put_claim_info(b'claim_id1', ClaimInfo(b'name', b'value', b'txid', 0, 1, b'address', 1,
+                                                           b'certificate_id'))
+    block_processor.batched_flush_claims()
+    with block_processor.signatures_db.write_batch() as batch:
+        for key, _ in block_processor.signatures_db.iterator():
+            batch.delete(key)
+        batch.put(signed_claim_key(b'certificate_id', b'claim_id1'), b'')
+        batch.put(signed_count_key(b'certificate_id'), struct.pack('>I', 1))
+        batch.put(b'\x00version', struct.pack('>I', 1))
+    close_dbs(block_processor)
+
+    reopened = block_processor.__class__(block_processor.env, None, None)
+    try:
+        assert reopened.get_signed_claim_ids_by_cert_id_and_name(b'certificate_id', b'name') == [b'claim_id1']
+    finally:
+        close_dbs(reopened)
+
+
+def close_dbs(block_processor):
+    for attr in dir(block_processor):
+        db = getattr(block_processor, attr)
+        if isinstance(db, Storage):
+            db.close()
+
+
+def test_claimtrie_index_version_marks_new_dbs_only(block_processor):
+    assert block_processor.claimtrie_indexed and block_processor.supports_indexed
+    assert block_processor.claimtrie_db.get(b'\x00version')
+    assert block_processor.supports_db.get(b'\x00version')
+
+    with block_processor.claimtrie_db.write_batch() as batch:
+        batch.delete(b'\x00version')
+    block_processor.db_height = 10
+    assert not block_processor.check_index_version(block_processor.claimtrie_db, b'\x00version', 1, 'claimtrie')
+    assert block_processor.claimtrie_db.get(b'\x00version') is None
 
 
 def test_claim_id_outpoint_retrieval(block_processor):
@@ -49,5 +174,157 @@ def test_pending_abandons_trigger(block_processor):
     block_processor.abandon_spent(b'inexistent_tx', 2)
     assert not block_processor.pending_abandons
     block_processor.put_claim_id_for_outpoint(b'existing_tx', tx_idx=4, claim_id=b'1337')
+    caches_size = block_processor.claim_caches_size
     block_processor.abandon_spent(b'existing_tx', 4)
     assert b'1337' in block_processor.pending_abandons
+    assert block_processor.claim_caches_size == caches_size + 150
+
+
+def test_supports_storage(block_processor):
+    db = block_processor
+    db.put_support_for_claim_id(b'claim_id', b'txid1', 0, 10, 100)
+    db.put_support_for_claim_id(b'claim_id', b'txid2', 1, 20, 101)
+    db.put_support_for_claim_id(b'claim_id2', b'txid3', 0, 30, 102)
+    assert db.get_supports_for_claim_id(b'claim_id') == [[b'txid1', 0, 10, 100], [b'txid2', 1, 20, 101]]
+    db.remove_support_for_claim_id(b'claim_id', b'txid1', 0)
+    assert db.get_supports_for_claim_id(b'claim_id') == [[b'txid2', 1, 20, 101]]
+
+
+def test_claim_outpoint_filter_skips_db_lookups(block_processor):
+    db = block_processor
+    db.outpoint_to_claim_id_db.put(b'unfiltered_tx' + struct.pack('>I', 1), b'claim_id')
+    assert db.get_claim_id_from_outpoint(b'unfiltered_tx', 1) is None
+    db.rebuild_claim_outpoint_filter()
+    assert db.get_claim_id_from_outpoint(b'unfiltered_tx', 1) == b'claim_id'
+
+
+def test_claim_outpoint_filter_persistence(block_processor):
+    db = block_processor
+    db.put_claim_id_for_outpoint(b'txid bytes', tx_idx=2, claim_id=b'400cafe800')
+    db.batched_flush_claims()
+    assert not os.path.exists(CLAIM_OUTPOINT_FILTER_FILE)
+    db.save_claim_outpoint_filter()
+    db.claim_outpoint_filter = None
+    db.open_claim_outpoint_filter()
+    assert db.claim_outpoint_filter.count == 1
+    assert db.get_claim_id_from_outpoint(b'txid bytes', tx_idx=2) == b'400cafe800'
+
+    # a crash leaves no filter, it's rebuilt
+    assert not os.path.exists(CLAIM_OUTPOINT_FILTER_FILE)
+    db.claim_outpoint_filter = None
+    db.open_claim_outpoint_filter()
+    assert db.get_claim_id_from_outpoint(b'txid bytes', tx_idx=2) == b'400cafe800'
+
+
+def test_claim_undo_pruned_beyond_reorg_limit(block_processor):
+    reorg_limit = block_processor.env.reorg_limit
+    with block_processor.claim_undo_db.write_batch() as batch:
+        for height in range(reorg_limit + 10):
+            batch.put(struct.pack('>I', height), msgpack.dumps(([], [], [])))
+
+    block_processor.db_height = reorg_limit + 4
+    block_processor.clear_excess_claim_undo_info()
+    heights = [struct.unpack('>I', key)[0] for key, _ in block_processor.claim_undo_db.iterator()]
+    assert heights == list(range(5, reorg_limit + 10))
+
+    block_processor.height = reorg_limit + 9
+    block_processor.batched_flush_claims()
+    heights = [struct.unpack('>I', key)[0] for key, _ in block_processor.claim_undo_db.iterator()]
+    assert heights == list(range(10, reorg_limit + 10))
+
+
+def test_backing_up_claim_undo_written_before_the_claimtrie_index(block_processor):
+    # baseline records are a plain list of (claim_id, claim info) pairs, three of them look like a new record
+    claim_ids = [b'id1', b'id2', b'id3']
+    for index, claim_id in enumerate(claim_ids):
+        claim_info = ClaimInfo(b'name', b'value', b'txid', index, 10, b'address', 1, None)
+        block_processor.put_claim_info(claim_id, claim_info)
+        block_processor.put_claim_for_name(b'name', claim_id)
+        block_processor.put_claim_id_for_outpoint(b'txid', index, claim_id)
+    block_processor.batched_flush_claims()
+    for record in ([(b'id1', None)], [(claim_id, None) for claim_id in claim_ids]):
+        with block_processor.claim_undo_db.write_batch() as batch:
+            batch.put(struct.pack('>I', 1), msgpack.dumps(record))
+        block_processor.height = 1
+        block_processor.backup_claim_txs()
+    assert block_processor.pending_abandons.keys() == set(claim_ids)
+
+
+def test_claim_info_cache_follows_claim_changes(block_processor):
+    claim_id = b'1337'
+    assert block_processor.get_claim_info(claim_id) is None
+    assert block_processor.get_claim_info(claim_id) is None
+    assert block_processor.claim_info_cache.hits == 1
+
+    claim_info = ClaimInfo(b'name', b'value', b'txid', 4, 10, b'address', 1, None)
+    block_processor.put_claim_info(claim_id, claim_info)
+    block_processor.put_claim_for_name(b'name', claim_id)
+    block_processor.put_claim_id_for_outpoint(b'txid', 4, claim_id)
+    assert block_processor.get_claim_info(claim_id) == claim_info
+    block_processor.batched_flush_claims()
+    assert block_processor.get_claim_info(claim_id) == claim_info
+
+    block_processor.abandon_spent(b'txid', 4)
+    block_processor.batched_flush_claims()
+    assert block_processor.get_claim_info(claim_id) is None
+    block_processor.claim_info_cache.clear()
+    assert block_processor.get_claim_info(claim_id) is None
+
+
+def test_claim_infos_read_while_a_flush_commits_are_dropped(block_processor):
+    claim_id = b'1337'
+    claim_info = ClaimInfo(b'name', b'value', b'txid', 4, 10, b'address', 1, None)
+    block_processor.put_claim_info(claim_id, claim_info)
+    flush_claims = block_processor.flush_claims
+
+    def flush_claims_then_read(*batches):
+        flush_claims(*batches)
+        # a session reading before the batches are committed
+        block_processor.claim_info_cache.clear()
+        assert block_processor.get_claim_info(claim_id) is None
+
+    block_processor.flush_claims = flush_claims_then_read
+    block_processor.batched_flush_claims()
+    block_processor.invalidate_flushed_claim_infos()
+    assert block_processor.get_claim_info(claim_id) == claim_info
+
+
+def test_claim_caches_size_counts_towards_flush(block_processor):
+    block_processor.daemon = MagicMock()
+    block_processor.daemon.cached_height.return_value = 0
+    block_processor.cache_MB = 1
+    for index in range(2000):
+        claim_id = struct.pack('>I', index) * 5
+        claim_info = ClaimInfo(b'name', b'v' * 500, b'txid', index, 10, b'address', 1, None)
+        block_processor.put_claim_info(claim_id, claim_info)
+        block_processor.put_claim_for_name(b'name', claim_id)
+    assert block_processor.claim_caches_size > 1000 * 1000
+
+    block_processor.flush = MagicMock()
+    block_processor.check_cache_size()
+    block_processor.flush.assert_called_once()
+
+    block_processor.batched_flush_claims()
+    assert block_processor.claim_caches_size == 0
+
+
+def test_resolve_cache_drops_names_changed_by_a_flush(block_processor):
+    resolve_cache = block_processor.resolve_cache
+    resolve_cache.put((None, 'lbry://name'), {'claim': 1}, {b'name'}, resolve_cache.generation)
+    resolve_cache.put((None, 'lbry://other'), {'claim': 2}, {b'other'}, resolve_cache.generation)
+    proof_cache = block_processor.proof_cache
+    proof_cache.put(b'name', None, {'nodes': []}, proof_cache.generation)
+    proof_cache.put(b'name', 'abcd', {'nodes': []}, proof_cache.generation)
+
+    claim_info = ClaimInfo(b'name', b'value', b'txid', 4, 10, b'address', 1, None)
+    block_processor.put_claim_info(b'1337', claim_info)
+    block_processor.put_claim_for_name(b'name', b'1337')
+    block_processor.batched_flush_claims()
+    # only dropped once the flush is written
+    assert (None, 'lbry://name') in resolve_cache
+
+    block_processor.invalidate_name_caches()
+    assert resolve_cache.get((None, 'lbry://name')) is None
+    assert resolve_cache.get((None, 'lbry://other')) == {'claim': 2}
+    assert proof_cache.get(b'name', None) is None
+    assert proof_cache.get(b'name', 'abcd') == {'nodes': []}
@@ -10,7 +10,7 @@ from lbryschema.signer import get_signer
 
 from lbryumx.block_processor import claim_id_hash
 from lbryumx.coin import LBC
-from lbryumx.model import NameClaim, TxClaimOutput, ClaimInfo, ClaimUpdate, ClaimSupport
+from lbryumx.model import NameClaim, TxClaimOutput, ClaimInfo, ClaimUpdate, ClaimSupport, LBRYTx
 
 from .data import claim_data
 
@@ -40,6 +40,18 @@ def test_signed_claim_info_advance(block_processor):
     block_processor.get_signed_claim_ids_by_cert_id(cert_claim_id) == [signed_claim_id]
 
 
+def test_signed_claim_is_indexed_by_channel_and_name(block_processor):
+    cert, privkey = create_cert()
+    cert_claim_id, _ = make_claim(block_processor, b'@channel', cert.serialized)
+    value = ClaimDict.load_dict(claim_data.test_claim_dict).serialized
+    signed_claim_id, _ = make_claim(block_processor, b'signed-claim', value, privkey, cert_claim_id)
+    assert block_processor.get_signed_claim_ids_by_cert_id_and_name(cert_claim_id, b'signed-claim') == \
+        [signed_claim_id]
+
+    update_claim(block_processor, b'signed-claim', value, claim_id=signed_claim_id)
+    assert block_processor.get_signed_claim_ids_by_cert_id_and_name(cert_claim_id, b'signed-claim') == []
+
+
 def test_claim_sequence_incremented_on_claim_name_advance(block_processor):
     claim_ids = []
     for idx in range(1, 3):
@@ -82,6 +94,69 @@ def test_claim_update_validator(block_processor):
     assert block_processor.get_update_input(claim, [input])
 
 
+def test_signatures_validated_ahead_see_certificates_from_the_same_batch(block_processor):
+    block_processor.should_validate_signatures = True
+    address = 'bTZito1AqWPig64GBioom11mHpoegMfXHx'
+    cert, privkey = create_cert()
+    cert_txid = bytes(getrandbits(8) for _ in range(32))
+    cert_claim_id = claim_id_hash(cert_txid, 0)
+    cert_output = create_claim_output(address, b'@channel', cert.serialized)
+    value = ClaimDict.load_dict(claim_data.test_claim_dict).serialized
+    signed_output = create_claim_output(address, b'signed-claim', value, privkey, cert_claim_id)
+    bad_output = create_claim_output(address, b'bad-claim', signed_output.claim.value, privkey, b'x' * 20)
+
+    coinbase = TxInput(bytes(32), 0xffffffff, b'', 0)
+    blocks = [Block([(LBRYTx(1, [coinbase], [cert_output], 0), cert_txid)]),
+              Block([(LBRYTx(1, [coinbase], [signed_output, bad_output], 0), b's' * 32)])]
+    block_processor.prevalidate_signatures(blocks)
+    assert list(block_processor.signature_results.values()) == [True]
+
+    block_processor.advance_claim_name_transaction(cert_output, 1, cert_txid, 0)
+    assert block_processor._checksig(b'signed-claim', signed_output.claim.value, address) == cert_claim_id
+
+
+def test_decoded_certificates_are_cached_until_the_certificate_changes(block_processor):
+    block_processor.should_validate_signatures = True
+    cert, privkey = create_cert()
+    cert_claim_id, _ = make_claim(block_processor, b'@channel', cert.serialized)
+    value = ClaimDict.load_dict(claim_data.test_claim_dict).serialized
+    for _ in range(3):
+        _, signed_claim_info = make_claim(block_processor, b'signed-claim', value, privkey, cert_claim_id)
+        assert block_processor.get_claim_info(claim_id_hash(signed_claim_info.txid, signed_claim_info.nout)).cert_id
+    assert (block_processor.certificate_cache.misses, block_processor.certificate_cache.hits) == (1, 2)
+
+    new_cert, new_privkey = create_cert()
+    update_claim(block_processor, b'@channel', new_cert.serialized, claim_id=cert_claim_id)
+    assert cert_claim_id not in block_processor.certificate_cache
+    signed_claim_id, _ = make_claim(block_processor, b'signed-claim', value, privkey, cert_claim_id)
+    assert not block_processor.get_claim_info(signed_claim_id).cert_id
+    signed_claim_id, _ = make_claim(block_processor, b'signed-claim', value, new_privkey, cert_claim_id)
+    assert block_processor.get_claim_info(signed_claim_id).cert_id == cert_claim_id
+
+
+def test_abandoned_certificate_stops_validating_after_the_flush(block_processor):
+    block_processor.should_validate_signatures = True
+    cert, privkey = create_cert()
+    cert_claim_id, cert_claim_info = make_claim(block_processor, b'@channel', cert.serialized)
+    block_processor.batched_flush_claims()
+    value = ClaimDict.load_dict(claim_data.test_claim_dict).serialized
+
+    block_processor.abandon_spent(cert_claim_info.txid, cert_claim_info.nout)
+    # the abandon only applies on flush, a claim signed in the meantime caches the certificate again
+    signed_claim_id, _ = make_claim(block_processor, b'signed-claim', value, privkey, cert_claim_id)
+    assert block_processor.get_claim_info(signed_claim_id).cert_id == cert_claim_id
+    block_processor.batched_flush_claims()
+
+    assert block_processor.get_claim_info(cert_claim_id) is None
+    signed_claim_id, _ = make_claim(block_processor, b'signed-claim', value, privkey, cert_claim_id)
+    assert block_processor.get_claim_info(signed_claim_id).cert_id is None
+
+
+class Block:
+    def __init__(self, transactions):
+        self.transactions = transactions
+
+
 def update_claim(*args, **kwargs):
     kwargs['is_update'] = True
     return make_claim(*args, **kwargs)
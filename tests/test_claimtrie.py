@@ -0,0 +1,279 @@
+import asyncio
+import os
+from binascii import unhexlify
+from random import getrandbits
+from unittest.mock import MagicMock
+
+from lbryumx.block_processor import activation_key
+from lbryumx.coin import LBC, LBCRegTest
+from lbryumx.model import NameClaim, ClaimUpdate, ClaimSupport, TxClaimOutput
+
+from .data.regtest_chain import hex_blocks, expected_claims
+
+
+ADDRESS = 'bTZito1AqWPig64GBioom11mHpoegMfXHx'
+
+
+def random_txid():
+    return bytes(getrandbits(8) for _ in range(32))
+
+
+def claim(block_processor, height, amount, name=b'name'):
+    txid = random_txid()
+    output = TxClaimOutput(amount, LBC.pay_to_address_script(ADDRESS), NameClaim(name, b'value'))
+    return block_processor.advance_claim_name_transaction(output, height, txid, 0)[0]
+
+
+def update(block_processor, height, amount, claim_id, name=b'name'):
+    txid = random_txid()
+    output = TxClaimOutput(amount, LBC.pay_to_address_script(ADDRESS), ClaimUpdate(name, claim_id, b'value2'))
+    block_processor.advance_update_claim(output, height, txid, 0)
+
+
+def support(block_processor, height, amount, claim_id, name=b'name'):
+    txid = random_txid()
+    block_processor.advance_support(ClaimSupport(name, claim_id), txid, 0, height, amount)
+    return txid, 0
+
+
+def test_first_claim_takes_over_immediately(block_processor):
+    claim_id = claim(block_processor, 10, 5)
+    block_processor.update_claimtrie(10)
+    block_processor.height = 10
+
+    node = block_processor.get_claimtrie_node(b'name')
+    assert node.winning_claim_id == claim_id
+    assert node.last_takeover_height == 10
+    assert block_processor.get_claimtrie_claim(b'name', claim_id) == (5, 10)
+
+
+def test_bigger_claim_waits_for_activation_delay(block_processor):
+    first_claim_id = claim(block_processor, 10, 5)
+    block_processor.update_claimtrie(10)
+
+    second_claim_id = claim(block_processor, 10 + 64, 50)
+    block_processor.update_claimtrie(10 + 64)
+    block_processor.height = 10 + 64
+    assert block_processor.get_winning_claim_id(b'name') == first_claim_id
+    assert block_processor.get_claimtrie_claim(b'name', second_claim_id) == (0, 10 + 64 + 2)
+
+    block_processor.update_claimtrie(10 + 65)
+    assert block_processor.get_winning_claim_id(b'name') == first_claim_id
+
+    block_processor.update_claimtrie(10 + 66)
+    node = block_processor.get_claimtrie_node(b'name')
+    assert node.winning_claim_id == second_claim_id
+    assert node.last_takeover_height == 10 + 66
+
+
+def test_takeover_activates_everything_pending(block_processor):
+    first_claim_id = claim(block_processor, 10, 5)
+    block_processor.update_claimtrie(10)
+    second_claim_id = claim(block_processor, 10 + 320, 6)
+    support(block_processor, 10 + 320, 10, second_claim_id)
+    support(block_processor, 10 + 320, 1, first_claim_id)
+    block_processor.update_claimtrie(10 + 320)
+    block_processor.height = 10 + 320
+    assert block_processor.get_winning_claim_id(b'name') == first_claim_id
+    assert block_processor.get_claimtrie_claim(b'name', first_claim_id) == (6, 10)
+
+    # abandoning the winner is a takeover, so the pending claim and its support activate right away
+    block_processor.remove_claim_from_claimtrie(b'name', first_claim_id, 10 + 321)
+    block_processor.update_claimtrie(10 + 321)
+    block_processor.height = 10 + 321
+    node = block_processor.get_claimtrie_node(b'name')
+    assert node.winning_claim_id == second_claim_id
+    assert node.last_takeover_height == 10 + 321
+    assert block_processor.get_claimtrie_claim(b'name', second_claim_id) == (16, 10 + 321)
+
+
+def test_controlling_claim_update_is_not_a_takeover(block_processor):
+    claim_id = claim(block_processor, 10, 5)
+    block_processor.update_claimtrie(10)
+    update(block_processor, 500, 7, claim_id)
+    block_processor.update_claimtrie(500)
+    block_processor.height = 500
+
+    node = block_processor.get_claimtrie_node(b'name')
+    assert node.winning_claim_id == claim_id
+    assert node.last_takeover_height == 10
+    assert block_processor.get_claimtrie_claim(b'name', claim_id) == (7, 500)
+
+
+def test_spent_support_stops_counting(block_processor):
+    claim_id = claim(block_processor, 10, 5)
+    txid, nout = support(block_processor, 10, 3, claim_id)
+    block_processor.update_claimtrie(10)
+    block_processor.height = 10
+    assert block_processor.get_claimtrie_claim(b'name', claim_id) == (8, 10)
+
+    block_processor.spend_support(txid, nout, 11)
+    block_processor.update_claimtrie(11)
+    block_processor.height = 11
+    assert block_processor.get_claimtrie_claim(b'name', claim_id) == (5, 10)
+
+
+def test_names_stay_unknown_once_an_expired_claim_is_spent(block_processor):
+    first_claim_id = claim(block_processor, 10, 5)
+    second_claim_id = claim(block_processor, 20, 1)
+    block_processor.update_claimtrie(10)
+    block_processor.update_claimtrie(20)
+    block_processor.height = 20
+    assert block_processor.knows_winner(b'name')
+
+    expired_height = block_processor.expiration_height(10)
+    block_processor.height = expired_height
+    assert not block_processor.knows_winner(b'name')
+
+    # the node never saw the takeover the expiration caused, spending the expired claim doesn't tell it
+    block_processor.remove_claim_from_claimtrie(b'name', first_claim_id, expired_height)
+    block_processor.update_claimtrie(expired_height)
+    assert block_processor.get_claimtrie_node(b'name').expired
+    assert not block_processor.knows_winner(b'name')
+    assert block_processor.get_claimtrie_claim(b'name', second_claim_id) is None
+
+    # until the name starts over
+    block_processor.remove_claim_from_claimtrie(b'name', second_claim_id, expired_height)
+    block_processor.update_claimtrie(expired_height)
+    claim(block_processor, expired_height + 1, 1)
+    block_processor.update_claimtrie(expired_height + 1)
+    assert block_processor.knows_winner(b'name')
+
+
+def test_claimtrie_backup(block_processor):
+    daemon_mock = MagicMock()
+    daemon_mock.cached_height.return_value = 0
+    block_processor.coin = LBCRegTest
+    block_processor.daemon = daemon_mock
+
+    raw_blocks = list(map(unhexlify, hex_blocks))
+    blocks = [LBCRegTest.block(raw_block, i) for (i, raw_block) in enumerate(raw_blocks)]
+
+    block_processor.advance_blocks(blocks)
+    block_processor.flush(True)
+    assert not block_processor.get_claimtrie_node(b'first_claim')
+
+    block_processor.backup_blocks(list(reversed(raw_blocks[104:])))
+    block_processor.flush(True)
+
+    first_claim_id = unhexlify(expected_claims[b'first_claim'][0])[::-1]
+    assert block_processor.get_winning_claim_id(b'first_claim') == first_claim_id
+
+
+def test_support_index_follows_supports(block_processor):
+    claim_id = claim(block_processor, 10, 5)
+    txid, nout = support(block_processor, 10, 3, claim_id)
+    assert block_processor.get_supports_for_claim_id(claim_id) == [[txid, nout, 3, 10]]
+
+    block_processor.spend_support(txid, nout, 11)
+    assert block_processor.get_supports_for_claim_id(claim_id) == []
+
+
+def test_claimtrie_backup_with_single_key_space(single_key_space_block_processor):
+    block_processor = single_key_space_block_processor
+    daemon_mock = MagicMock()
+    daemon_mock.cached_height.return_value = 0
+    block_processor.coin = LBCRegTest
+    block_processor.daemon = daemon_mock
+
+    raw_blocks = list(map(unhexlify, hex_blocks))
+    blocks = [LBCRegTest.block(raw_block, i) for (i, raw_block) in enumerate(raw_blocks)]
+
+    block_processor.advance_blocks(blocks)
+    block_processor.flush(True)
+    block_processor.assert_flushed()
+    assert list(block_processor.utxo_db.iterator(prefix=b'Lu'))
+    assert not os.path.isdir('claims')
+
+    block_processor.backup_blocks(list(reversed(raw_blocks[104:])))
+    block_processor.assert_flushed()
+
+    first_claim_id = unhexlify(expected_claims[b'first_claim'][0])[::-1]
+    assert block_processor.get_winning_claim_id(b'first_claim') == first_claim_id
+
+
+def test_blocks_parsed_in_worker_processes_advance_like_inline_ones(parallel_parsing_block_processor):
+    block_processor = parallel_parsing_block_processor
+    daemon_mock = MagicMock()
+    daemon_mock.cached_height.return_value = 0
+    block_processor.coin = LBCRegTest
+    block_processor.daemon = daemon_mock
+
+    raw_blocks = list(map(unhexlify, hex_blocks))
+    blocks = asyncio.get_event_loop().run_until_complete(block_processor.parse_blocks(raw_blocks, 0))
+    assert blocks == [LBCRegTest.block(raw_block, i) for (i, raw_block) in enumerate(raw_blocks)]
+    assert block_processor.parsed_claim_ids
+
+    block_processor.advance_blocks(blocks)
+    assert not block_processor.parsed_claim_ids
+    for name, (claim_id, *_) in expected_claims.items():
+        assert block_processor.get_claim_info(unhexlify(claim_id)[::-1]).name == name
+
+
+def test_backing_up_blocks_at_once_restores_the_claimtrie(block_processor):
+    daemon_mock = MagicMock()
+    daemon_mock.cached_height.return_value = 0
+    block_processor.coin = LBCRegTest
+    block_processor.daemon = daemon_mock
+
+    raw_blocks = list(map(unhexlify, hex_blocks))
+    blocks = [LBCRegTest.block(raw_block, i) for (i, raw_block) in enumerate(raw_blocks)]
+    block_processor.advance_blocks(blocks[:104])
+    block_processor.flush(True)
+    claimtrie = list(block_processor.claimtrie_db.iterator())
+    supports = list(block_processor.supports_db.iterator())
+
+    block_processor.advance_blocks(blocks[104:])
+    block_processor.flush(True)
+    assert list(block_processor.claimtrie_db.iterator()) != claimtrie
+
+    block_processor.backup_blocks(list(reversed(raw_blocks[104:])))
+    block_processor.assert_flushed()
+    assert not block_processor.claimtrie_undo
+    assert list(block_processor.claimtrie_db.iterator()) == claimtrie
+    assert list(block_processor.supports_db.iterator()) == supports
+
+
+def test_tx_heights_are_found_in_the_utxo_index(block_processor):
+    daemon_mock = MagicMock()
+    daemon_mock.cached_height.return_value = 0
+    block_processor.coin = LBCRegTest
+    block_processor.daemon = daemon_mock
+
+    raw_blocks = list(map(unhexlify, hex_blocks))
+    blocks = [LBCRegTest.block(raw_block, i) for (i, raw_block) in enumerate(raw_blocks)]
+    block_processor.advance_blocks(blocks)
+    block_processor.flush(True)
+
+    for height in (len(blocks) - 1, len(blocks) - 2):
+        _, coinbase_hash = blocks[height].transactions[0]
+        assert block_processor.get_tx_height(coinbase_hash) == height
+    assert block_processor.get_tx_height(random_txid()) is None
+
+
+def test_activation_rows_are_deleted_once_applied(block_processor):
+    first_claim_id = claim(block_processor, 10, 5)
+    block_processor.update_claimtrie(10)
+    second_claim_id = claim(block_processor, 10 + 64, 50)
+    block_processor.update_claimtrie(10 + 64)
+    key = activation_key(10 + 66, b'name')
+    assert block_processor.get_claimtrie_value(key) == b''
+
+    block_processor.update_claimtrie(10 + 65)
+    assert block_processor.get_winning_claim_id(b'name') == first_claim_id
+    block_processor.update_claimtrie(10 + 66)
+    assert block_processor.get_winning_claim_id(b'name') == second_claim_id
+    assert block_processor.get_claimtrie_value(key) is None
+
+
+def test_results_built_during_a_flush_with_cold_caches_are_not_stored(block_processor):
+    resolve_generation = block_processor.resolve_cache.generation
+    proof_generation = block_processor.proof_cache.generation
+    claim(block_processor, 10, 5)
+    block_processor.update_claimtrie(10)
+    block_processor.batched_flush_claims()
+    block_processor.invalidate_name_caches()
+
+    block_processor.resolve_cache.put('lbry://name', {}, {b'name'}, resolve_generation)
+    block_processor.proof_cache.put(b'name', None, {}, proof_generation)
+    assert not len(block_processor.resolve_cache) and not len(block_processor.proof_cache)
@@ -1,10 +1,13 @@
+import pickle
 from binascii import unhexlify, hexlify
 
 from electrumx.lib.hash import hex_str_to_hash
 
-from lbryumx.coin import LBC
+from lbryumx.coin import LBC, LBCRegTest
 from lbryumx.model import NameClaim, ClaimUpdate
 
+from .data.regtest_chain import hex_blocks
+
 
 def test_block(block_infos):
     # From electrumx test_block 342930
@@ -47,6 +50,24 @@ def test_handler_for_claim_script_address_extraction(block_infos):
     assert LBC.address_from_script(outputs[0].pk_script) == 'bPNQ1zwYeeEFsCBYzQ9F4qLEHv5ZWCf8YB'
 
 
+def test_decoded_claim_scripts_give_same_hashX_and_address(block_infos):
+    raw_blocks = [(LBC, unhexlify(block_info['block'])) for block_info in block_infos.values()]
+    raw_blocks += [(LBCRegTest, unhexlify(hex_block)) for hex_block in hex_blocks]
+    claim_outputs = 0
+    for coin, raw_block in raw_blocks:
+        for tx, _ in coin.DESERIALIZER(raw_block, start=coin.BASIC_HEADER_SIZE).read_tx_block():
+            for output in tx.outputs:
+                if not output.claim:
+                    continue
+                claim_outputs += 1
+                plain_script = bytes(output.pk_script)
+                assert output.pk_script.address_script is not None
+                assert coin.hashX_from_script(output.pk_script) == coin.hashX_from_script(plain_script)
+                assert coin.address_from_script(output.pk_script) == coin.address_from_script(plain_script)
+                assert pickle.loads(pickle.dumps(output)).pk_script.claim == output.claim
+    assert claim_outputs
+
+
 def _filter_tx_output_claims_by_type(block_info, claim_type):
     return [output.claim for output in _filter_tx_output_by_type(block_info, claim_type)]
 
@@ -0,0 +1,83 @@
+import random
+from binascii import unhexlify
+
+from lbryumx.coin import LBC, LBCRegTest
+from lbryumx.opcodes import decode_claim_output_script, decode_claim_script_ops, standard_address_script, \
+    opcodes
+
+from .data.regtest_chain import hex_blocks
+
+ADDRESS_SCRIPT = LBC.pay_to_address_script('bTZito1AqWPig64GBioom11mHpoegMfXHx')
+
+
+def reference_decode(script):
+    '''What decode_claim_output_script returned when built on the op list decoder.'''
+    decoded = decode_claim_script_ops(script)
+    if not decoded:
+        return None, None
+    claim, decoded_script, op = decoded
+    return claim, standard_address_script(script[decoded_script[op - 1][2]:])
+
+
+def push(data):
+    if len(data) < opcodes.OP_PUSHDATA1:
+        return bytes((len(data),)) + data
+    if len(data) <= 0xff:
+        return bytes((opcodes.OP_PUSHDATA1, len(data))) + data
+    return bytes((opcodes.OP_PUSHDATA2,)) + len(data).to_bytes(2, 'little') + data
+
+
+def claim_scripts():
+    scripts = [
+        bytes((opcodes.OP_CLAIM_NAME,)) + push(b'name') + push(b'value' * 80) +
+        bytes((opcodes.OP_2DROP, opcodes.OP_DROP)) + ADDRESS_SCRIPT,
+        bytes((opcodes.OP_SUPPORT_CLAIM,)) + push(b'name') + push(b'c' * 20) +
+        bytes((opcodes.OP_2DROP, opcodes.OP_DROP)) + ADDRESS_SCRIPT,
+        bytes((opcodes.OP_UPDATE_CLAIM,)) + push(b'n' * 100) + push(b'c' * 20) + push(b'v' * 300) +
+        bytes((opcodes.OP_2DROP, opcodes.OP_2DROP)) + ADDRESS_SCRIPT,
+        bytes((opcodes.OP_CLAIM_NAME,)) + push(b'') + push(b'') +
+        bytes((opcodes.OP_2DROP, opcodes.OP_DROP, opcodes.OP_HASH160)) + push(b'h' * 20) + bytes((opcodes.OP_EQUAL,)),
+    ]
+    for hex_block in hex_blocks:
+        for tx, _ in LBCRegTest.DESERIALIZER(unhexlify(hex_block), start=LBC.BASIC_HEADER_SIZE).read_tx_block():
+            scripts.extend(bytes(output.pk_script) for output in tx.outputs)
+    return scripts
+
+
+def mutate(rand, script):
+    script = bytearray(script)
+    for _ in range(rand.randint(1, 3)):
+        choice = rand.random()
+        position = rand.randrange(len(script) + 1)
+        if choice < 0.4 and script:
+            script[min(position, len(script) - 1)] = rand.randrange(256)
+        elif choice < 0.6:
+            del script[position:]
+        elif choice < 0.8:
+            script[position:position] = bytes(rand.randrange(256) for _ in range(rand.randint(1, 4)))
+        else:
+            del script[position:position + rand.randint(1, 4)]
+    return bytes(script)
+
+
+def test_fast_claim_decoder_matches_op_list_decoder():
+    rand = random.Random(42)
+    scripts = claim_scripts()
+    claims = 0
+    for script in scripts:
+        assert decode_claim_output_script(script) == reference_decode(script)
+        claims += decode_claim_output_script(script)[0] is not None
+    assert claims > 4
+    for _ in range(20000):
+        script = mutate(rand, rand.choice(scripts))
+        assert decode_claim_output_script(script) == reference_decode(script), script.hex()
+    for _ in range(5000):
+        script = bytes((rand.choice((opcodes.OP_CLAIM_NAME, opcodes.OP_SUPPORT_CLAIM, opcodes.OP_UPDATE_CLAIM)),))
+        script += bytes(rand.randrange(256) for _ in range(rand.randint(0, 40)))
+        assert decode_claim_output_script(script) == reference_decode(script), script.hex()
+
+
+def test_fast_claim_decoder_skips_other_scripts():
+    assert decode_claim_output_script(b'') == (None, None)
+    assert decode_claim_output_script(ADDRESS_SCRIPT) == (None, None)
+    assert decode_claim_output_script(bytes((opcodes.OP_CLAIM_NAME, opcodes.OP_PUSHDATA2, 1))) == (None, None)
@@ -0,0 +1,205 @@
+import asyncio
+from unittest.mock import MagicMock
+
+from aiorpcx.util import signature_info
+from electrumx.lib.hash import hash_to_str
+
+from lbryumx.coin import LBC
+from lbryumx.model import ClaimInfo
+from lbryumx.session import LBRYElectrumX
+
+
+class FakeDaemon:
+
+    def __init__(self, claims):
+        self.claims = claims
+        self.calls = []
+
+    async def getclaimbyid(self, claim_id):
+        self.calls.append(('getclaimbyid', claim_id))
+        return self.claims.get(claim_id)
+
+    async def getclaimsbyids(self, claim_ids):
+        self.calls.append(('getclaimsbyids', sorted(claim_ids)))
+        return [self.claims.get(claim_id) for claim_id in claim_ids]
+
+    async def getvalueforname(self, name):
+        self.calls.append(('getvalueforname', name))
+        return next((claim for claim in self.claims.values() if claim['name'] == name), {})
+
+    async def getnameproof(self, name, block_hash=None):
+        self.calls.append(('getnameproof', name))
+        return {}
+
+
+def add_claim(block_processor, claims, raw_claim_id, name, cert_id=None, on_claimtrie=False):
+    claim_info = ClaimInfo(name, b'value', b'txid', 0, 10, b'address', 1, cert_id)
+    block_processor.put_claim_info(raw_claim_id, claim_info)
+    block_processor.put_claim_for_name(name, raw_claim_id)
+    if on_claimtrie:
+        block_processor.add_claim_to_claimtrie(raw_claim_id, claim_info, 1)
+    if cert_id:
+        block_processor.put_claim_id_signed_by_cert_id(cert_id, raw_claim_id, name)
+    claim_id = hash_to_str(raw_claim_id)
+    claims[claim_id] = {'claimId': claim_id, 'name': name.decode(), 'txid': hash_to_str(b'txid'), 'n': 0,
+                        'amount': 10, 'height': 1, 'value': 'value', 'effective amount': 12, 'valid at height': 3}
+    return claim_id
+
+
+def make_session(block_processor, claims, claims_from_daemon=False):
+    session = LBRYElectrumX.__new__(LBRYElectrumX)
+    session.bp, session.env, session.daemon = block_processor, block_processor.env, FakeDaemon(claims)
+    session.claims_from_daemon = claims_from_daemon
+    session.hashX_subs, session.subscribed_names, session.subscribed_claim_ids = {}, set(), set()
+    session.max_subs, session.controller = 10, MagicMock()
+    session.notifications = []
+    session.send_notification = lambda method, params: session.notifications.append((method, params))
+    return session
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def test_batch_resolve_fetches_claims_in_one_vector_call(block_processor):
+    claims = {}
+    channel_id = add_claim(block_processor, claims, b'c' * 20, b'@channel')
+    claim_id = add_claim(block_processor, claims, b'a' * 20, b'foo', cert_id=b'c' * 20)
+    other_claim_id = add_claim(block_processor, claims, b'b' * 20, b'bar', cert_id=b'c' * 20)
+    session = make_session(block_processor, claims, claims_from_daemon=True)
+
+    uris = ('lbry://foo#' + claim_id, 'lbry://bar:1', 'lbry://@channel#' + channel_id,
+            'lbry://@channel#{}/foo'.format(channel_id), 'lbry://foo#' + claim_id)
+    results = run(session.claimtrie_getvalueforuris(None, *uris))
+
+    assert session.daemon.calls == [('getclaimsbyids', sorted([channel_id, claim_id, other_claim_id]))]
+    assert len(results) == 4
+    assert results['lbry://foo#' + claim_id]['claim']['result']['claim_id'] == claim_id
+    assert results['lbry://foo#' + claim_id]['certificate']['result']['claim_id'] == channel_id
+    assert results['lbry://bar:1']['claim']['result']['claim_id'] == other_claim_id
+    assert set(results['lbry://@channel#' + channel_id]['unverified_claims_in_channel']) == {
+        claim_id, other_claim_id}
+    assert list(results['lbry://@channel#{}/foo'.format(channel_id)]['unverified_claims_for_name']) == [claim_id]
+
+
+def test_claims_are_built_from_the_local_index(block_processor):
+    claims = {}
+    claim_id = add_claim(block_processor, claims, b'a' * 20, b'foo', on_claimtrie=True)
+    off_claimtrie_claim_id = add_claim(block_processor, claims, b'b' * 20, b'bar')
+    block_processor.height = block_processor.db_height = 5
+    session = make_session(block_processor, claims)
+    daemon_session = make_session(block_processor, claims, claims_from_daemon=True)
+
+    claim = run(session.claimtrie_getclaimbyid(claim_id))
+    assert session.daemon.calls == []
+    assert claim == run(daemon_session.claimtrie_getclaimbyid(claim_id))
+    assert (claim['name'], claim['depth'], claim['effective_amount'], claim['valid_at_height']) == ('foo', 4, 10, 1)
+
+    # the effective amount of claims off the local claimtrie comes from the daemon
+    assert run(session.claimtrie_getclaimsbyids(claim_id, off_claimtrie_claim_id)) == \
+        run(daemon_session.claimtrie_getclaimsbyids(claim_id, off_claimtrie_claim_id))
+    assert session.daemon.calls == [('getclaimsbyids', [off_claimtrie_claim_id])]
+    assert run(session.claimtrie_getclaimbyid(hash_to_str(b'c' * 20))) == {}
+
+
+def test_subscribed_sessions_are_notified_of_flushed_changes(block_processor):
+    claims = {}
+    claim_id = add_claim(block_processor, claims, b'a' * 20, b'foo')
+    block_processor.batched_flush_claims()
+    sessions = [make_session(block_processor, claims) for _ in range(3)]
+    for session in sessions[:2]:
+        assert run(session.claimtrie_subscribe_claim(claim_id))['name'] == 'foo'
+    assert run(sessions[2].claimtrie_subscribe_name('foo')) == {'proof': {}, 'supports': []}
+    assert block_processor.claim_subscriptions.sessions_by_claim_id == {b'a' * 20: set(sessions[:2])}
+
+    block_processor.put_claim_info(b'a' * 20, ClaimInfo(b'foo', b'value2', b'txid', 0, 20, b'address', 2, None))
+    block_processor.batched_flush_claims()
+    block_processor.invalidate_name_caches()
+    run(asyncio.sleep(0.01))
+    for session in sessions[:2]:
+        method, (notified_claim_id, claim) = session.notifications[0]
+        assert (method, notified_claim_id, claim['amount']) == ('blockchain.claimtrie.subscribe_claim', claim_id, 20)
+    assert sessions[2].notifications == [
+        ('blockchain.claimtrie.subscribe_name', ('foo', {'proof': {}, 'supports': []}))]
+    # the claim was looked up once for both sessions
+    assert block_processor.claim_subscriptions.notifications == 3
+
+    for session in sessions:
+        block_processor.claim_subscriptions.unsubscribe(session, session.subscribed_names,
+                                                        session.subscribed_claim_ids)
+    assert not block_processor.claim_subscriptions
+
+
+def test_handlers_are_timed(block_processor):
+    claims = {}
+    claim_id = add_claim(block_processor, claims, b'a' * 20, b'foo')
+    session = make_session(block_processor, claims)
+    session.protocol_version = None
+    session.set_protocol_handlers((1, 2))
+
+    handler = session.request_handler('blockchain.claimtrie.getclaimbyid')
+    assert session.request_handler('blockchain.claimtrie.getclaimbyid') is handler
+    assert signature_info(handler).min_args == 1
+    assert run(handler(claim_id))['name'] == 'foo'
+    run(asyncio.gather(handler('not a claim id'), return_exceptions=True))
+    assert session.request_handler('blockchain.block.get_server_height')() == block_processor.height
+    assert session.request_handler('unknown') is None
+
+    stats = block_processor.handler_metrics.stats
+    assert (stats['blockchain.claimtrie.getclaimbyid']['calls'], stats['blockchain.claimtrie.getclaimbyid']['errors'],
+            stats['blockchain.block.get_server_height']['calls']) == (2, 1, 1)
+
+
+def test_names_the_local_claimtrie_cant_tell_are_left_to_the_daemon(block_processor):
+    claims = {}
+    claim_id = add_claim(block_processor, claims, b'a' * 20, b'foo', on_claimtrie=True)
+    block_processor.update_claimtrie(1)
+    block_processor.height = block_processor.db_height = 5
+    session = make_session(block_processor, claims)
+    assert run(session.get_winning_claim_id('foo')) == b'a' * 20
+    assert run(session.claimtrie_getclaimbyid(claim_id))['effective_amount'] == 10
+    assert session.daemon.calls == []
+
+    # expiration isn't modelled locally
+    block_processor.height = 1 + LBC.CLAIM_EXPIRATION_TIME
+    assert run(session.get_winning_claim_id('foo')) == b'a' * 20
+    assert run(session.claimtrie_getclaimbyid(claim_id))['effective_amount'] == 12
+    assert session.daemon.calls == [('getvalueforname', 'foo'), ('getclaimsbyids', [claim_id])]
+    assert session.get_claim_ids_for_uris(['lbry://foo']) == []
+
+    # neither is anything synced before the claimtrie was indexed
+    block_processor.height, block_processor.claimtrie_indexed = 5, False
+    session.daemon.calls = []
+    assert run(session.get_winning_claim_id('foo')) == b'a' * 20
+    assert run(session.claimtrie_getclaimbyid(claim_id))['effective_amount'] == 12
+    assert session.daemon.calls == [('getvalueforname', 'foo'), ('getclaimsbyids', [claim_id])]
+
+
+def test_supports_come_from_the_daemon_when_the_db_was_synced_without_them(block_processor):
+    claims = {}
+    claim_id = add_claim(block_processor, claims, b'a' * 20, b'foo', on_claimtrie=True)
+    block_processor.put_support_for_claim_id(b'a' * 20, b's' * 32, 1, 2, 1)
+    claims[claim_id]['supports'] = [{'txid': hash_to_str(b'd' * 32), 'n': 0, 'nAmount': 3}]
+    block_processor.height = block_processor.db_height = 5
+    session = make_session(block_processor, claims)
+    daemon_session = make_session(block_processor, claims, claims_from_daemon=True)
+    local_supports = [[hash_to_str(b's' * 32), 1, 2]]
+    assert run(session.claimtrie_getclaimbyid(claim_id))['supports'] == local_supports
+    assert run(daemon_session.claimtrie_getclaimbyid(claim_id))['supports'] == local_supports
+
+    block_processor.supports_indexed = False
+    daemon_supports = [[hash_to_str(b'd' * 32), 0, 3]]
+    claim = run(session.claimtrie_getclaimbyid(claim_id))
+    assert (claim['supports'], claim['effective_amount']) == (daemon_supports, 10)
+    assert run(daemon_session.claimtrie_getclaimbyid(claim_id))['supports'] == daemon_supports
+
+
+def test_cached_results_are_copied_to_refresh_their_depths(block_processor):
+    session = make_session(block_processor, {})
+    cached = {'claim': {'result': {'height': 1, 'depth': 2}}, 'claims': [{'height': 2, 'depth': 1}]}
+    block_processor.resolve_cache.put((None, 'lbry://foo'), cached, {b'foo'}, block_processor.resolve_cache.generation)
+    block_processor.db_height = 5
+
+    result = run(session.get_value_for_uri(None, 'lbry://foo'))
+    assert result == {'claim': {'result': {'height': 1, 'depth': 4}}, 'claims': [{'height': 2, 'depth': 3}]}
+    assert cached == {'claim': {'result': {'height': 1, 'depth': 2}}, 'claims': [{'height': 2, 'depth': 1}]}